@@ -1,6 +1,6 @@
 from django.contrib import admin
-from .models import Trip, User
+from .models import ArchivedTrip, Place, Trip, User
 
 # Register your models here.
 
-admin.site.register([Trip, User])
\ No newline at end of file
+admin.site.register([Trip, ArchivedTrip, User, Place])
\ No newline at end of file
@@ -0,0 +1,243 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework import status
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.throttling import AnonRateThrottle
+from api.tasks import start_trip_pipeline
+from api.helpers.trip_planner import calculate_trip as calculate_trip_data
+from api.helpers.gazetteer import search_places
+from api.helpers.idempotency import aacquire_trip_lock, arelease_trip_lock, get_idempotency_key, get_request_fingerprint, replayed_trip_response
+from api.helpers.http_session import get_session
+from api.helpers.routing import afetch_route
+from .models import Trip
+from .serializers import TripSerializer
+import aiohttp
+import asyncio
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncAPIView(APIView):
+    """
+    APIView whose handlers are coroutines, so under ASGI a request waiting on an
+    upstream service holds no thread.
+
+    Authentication, permissions and throttling stay synchronous (they touch the
+    database and cache) and run in a worker thread before the handler is awaited.
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # ATOMIC_REQUESTS cannot wrap async views; handlers manage their own writes
+        return transaction.non_atomic_requests(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+
+            response = handler(request, *args, **kwargs)
+            if asyncio.iscoroutine(response):
+                response = await response
+
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+
+def location_coords(location):
+    return {"latitude": float(location["latitude"]), "longitude": float(location["longitude"])}
+
+
+def route_coords(*locations):
+    return [[location["longitude"], location["latitude"]] for location in locations]
+
+
+def run_planner(*args, **kwargs):
+    # Runs on a pool thread outside the request cycle, so close its connection when done
+    try:
+        return calculate_trip_data(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+class AsyncTripPlannerView(AsyncAPIView):
+    permission_classes = [IsAuthenticated]
+
+    async def post(self, request):
+        current_location = request.data.get("current_location")
+        pickup_location = request.data.get("pickup_location")
+        dropoff_location = request.data.get("dropoff_location")
+        current_cycle_hours = float(request.data.get("current_cycle_hours", 0))
+
+        try:
+            idempotency_key = get_idempotency_key(request)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        fingerprint = get_request_fingerprint(request) if idempotency_key else None
+        if idempotency_key:
+            trip = await Trip.objects.filter(user=request.user, idempotency_key=idempotency_key).afirst()
+            if trip:
+                return replayed_trip_response(trip, fingerprint)
+
+        current_coords = location_coords(current_location)
+        pickup_coords = location_coords(pickup_location)
+        dropoff_coords = location_coords(dropoff_location)
+
+        try:
+            route = await afetch_route(route_coords(current_coords, pickup_coords, dropoff_coords))
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"ORS request failed: {str(e)}")
+            return Response({"error": f"Failed to fetch route from ORS: {str(e)}"}, status=500)
+
+        try:
+            trip = await Trip.objects.acreate(
+                user=request.user,
+                current_location=current_location,
+                pickup_location=pickup_location,
+                dropoff_location=dropoff_location,
+                current_cycle_hours=current_cycle_hours,
+                idempotency_key=idempotency_key,
+                idempotency_fingerprint=fingerprint,
+            )
+        except IntegrityError:
+            return replayed_trip_response(await Trip.objects.aget(user=request.user, idempotency_key=idempotency_key), fingerprint)
+        await sync_to_async(start_trip_pipeline)(
+            trip.id, route["distance"], route["duration"], current_cycle_hours, route["geometry"],
+            pickup_coords, current_coords, dropoff_coords, steps=route.get("steps"),
+        )
+
+        response_data = {
+            "message": "Trip Created Succesfully",
+            "data": TripSerializer(trip).data
+        }
+
+        return Response(response_data, status=status.HTTP_201_CREATED)
+
+
+class AsyncRouteDataView(AsyncAPIView):
+    permission_classes = [IsAuthenticated]
+
+    async def get(self, request):
+        trip_id = request.query_params.get("trip_id")
+        update = request.query_params.get("update")
+
+        trips = Trip.objects.defer("route_data", "log_sheets")
+        try:
+            if update:
+                trip = await trips.aget(id=trip_id)
+            else:
+                trip = await trips.aget(id=trip_id, route_data__isnull=True, log_sheets__isnull=True)
+        except (Trip.DoesNotExist, ValueError):
+            return Response("No Trip found with that ID", status=status.HTTP_404_NOT_FOUND)
+
+        locations = {
+            "current_location": trip.current_location,
+            "pickup_location": trip.pickup_location,
+            "dropoff_location": trip.dropoff_location,
+        }
+        if not all(locations.values()):
+            logger.error("One or more locations are missing")
+            return Response({"error": "All locations are required"}, status=400)
+
+        for loc_name, loc in locations.items():
+            if not all(field in loc for field in ("name", "latitude", "longitude")):
+                logger.error(f"Missing fields in {loc_name}: {loc}")
+                return Response({"error": f"Missing fields in {loc_name}"}, status=400)
+
+        current_coords = location_coords(trip.current_location)
+        pickup_coords = location_coords(trip.pickup_location)
+        dropoff_coords = location_coords(trip.dropoff_location)
+
+        try:
+            route = await afetch_route(route_coords(current_coords, pickup_coords, dropoff_coords))
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"ORS request failed: {str(e)}")
+            return Response({"error": f"Failed to fetch route from ORS: {str(e)}"}, status=500)
+
+        lock_token = await aacquire_trip_lock(trip.id)
+        if not lock_token:
+            return Response({"message": "Trip is already being planned"}, status=status.HTTP_202_ACCEPTED)
+
+        # Scheduling and rendering are CPU bound; keep them off the event loop
+        try:
+            await sync_to_async(run_planner, thread_sensitive=False)(
+                trip.id, route["distance"], route["duration"], float(trip.current_cycle_hours), route["geometry"],
+                pickup_coords, current_coords, dropoff_coords, steps=route.get("steps"),
+            )
+        except Exception as e:
+            logger.error(f"calculate_trip failed: {str(e)}")
+            return Response({"error": f"Failed to calculate trip: {str(e)}"}, status=500)
+        finally:
+            await arelease_trip_lock(trip.id, lock_token)
+
+        return Response({"message": "Route Data creation initiated successfully"}, status=status.HTTP_200_OK)
+
+
+class AsyncLocationView(AsyncAPIView):
+    throttle_classes = [AnonRateThrottle]
+    permission_classes = [IsAuthenticated]
+
+    async def get(self, request):
+        query = request.query_params.get("q", "")
+        if not query:
+            return Response({"error": "Query parameter 'q' is required"}, status=400)
+
+        if settings.LOCATION_SEARCH_MODE == "gazetteer":
+            suggestions = await sync_to_async(search_places)(query)
+            if suggestions:
+                logger.info(f"Found {len(suggestions)} gazetteer suggestions for query: {query}")
+                return Response(suggestions)
+            logger.info(f"No gazetteer match for query: {query}, falling back to Nominatim")
+
+        logger.info(f"Fetching autocomplete suggestions for query: {query}")
+
+        nominatim_url = "https://nominatim.openstreetmap.org/search"
+        params = {
+            "q": query,
+            "format": "json",
+            "limit": 10,
+            "addressdetails": 1,
+            "countrycodes": "us",
+        }
+        headers = {
+            "User-Agent": "eld_app"
+        }
+
+        try:
+            timeout = aiohttp.ClientTimeout(total=5)
+            async with get_session().get(nominatim_url, params=params, headers=headers, timeout=timeout) as response:
+                response.raise_for_status()
+                results = await response.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"Nominatim autocomplete request failed: {str(e)}")
+            return Response({"error": f"Failed to fetch location suggestions: {str(e)}"}, status=500)
+
+        suggestions = [
+            {
+                "name": result["display_name"],
+                "latitude": float(result["lat"]),
+                "longitude": float(result["lon"]),
+            }
+            for result in results
+        ]
+
+        logger.info(f"Found {len(suggestions)} town/city suggestions for query: {query}")
+        return Response(suggestions)
@@ -0,0 +1,135 @@
+from bisect import bisect_left
+from collections import namedtuple
+import heapq
+import logging
+import re
+import threading
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+
+GazetteerPlace = namedtuple("GazetteerPlace", ["key", "name", "state", "latitude", "longitude", "population"])
+
+# Prefixes up to this length match thousands of places, so their top results are precomputed
+PRECOMPUTED_PREFIX_LENGTH = 3
+
+# GeoNames stores US states as their postal code (admin1)
+US_STATE_NAMES = {
+    "AL": "Alabama", "AK": "Alaska", "AZ": "Arizona", "AR": "Arkansas", "CA": "California",
+    "CO": "Colorado", "CT": "Connecticut", "DE": "Delaware", "DC": "District of Columbia",
+    "FL": "Florida", "GA": "Georgia", "HI": "Hawaii", "ID": "Idaho", "IL": "Illinois",
+    "IN": "Indiana", "IA": "Iowa", "KS": "Kansas", "KY": "Kentucky", "LA": "Louisiana",
+    "ME": "Maine", "MD": "Maryland", "MA": "Massachusetts", "MI": "Michigan", "MN": "Minnesota",
+    "MS": "Mississippi", "MO": "Missouri", "MT": "Montana", "NE": "Nebraska", "NV": "Nevada",
+    "NH": "New Hampshire", "NJ": "New Jersey", "NM": "New Mexico", "NY": "New York",
+    "NC": "North Carolina", "ND": "North Dakota", "OH": "Ohio", "OK": "Oklahoma", "OR": "Oregon",
+    "PA": "Pennsylvania", "RI": "Rhode Island", "SC": "South Carolina", "SD": "South Dakota",
+    "TN": "Tennessee", "TX": "Texas", "UT": "Utah", "VT": "Vermont", "VA": "Virginia",
+    "WA": "Washington", "WV": "West Virginia", "WI": "Wisconsin", "WY": "Wyoming",
+}
+
+
+def normalize_place_name(value):
+    """Lowercase, strip accents and punctuation so 'St. Louis' and 'st louis' share a key."""
+    value = unicodedata.normalize("NFKD", value)
+    value = "".join(ch for ch in value if not unicodedata.combining(ch))
+    value = re.sub(r"[^a-z0-9 ]+", " ", value.lower())
+    return " ".join(value.split())
+
+
+class PlaceIndex:
+    """
+    In-memory prefix index over gazetteer places, ranked by population.
+
+    Places are kept in a list sorted by normalized name so any prefix maps to a
+    contiguous range found with two bisections. Short prefixes have their top
+    results precomputed since their ranges are large.
+    """
+
+    def __init__(self, places, limit=10):
+        self.limit = limit
+        self.places = sorted(places, key=lambda place: place.key)
+        self.keys = [place.key for place in self.places]
+        self.top = {}
+
+        for place in sorted(self.places, key=lambda place: place.population, reverse=True):
+            for length in range(1, min(len(place.key), PRECOMPUTED_PREFIX_LENGTH) + 1):
+                top = self.top.setdefault(place.key[:length], [])
+                if len(top) < limit:
+                    top.append(place)
+
+    def __len__(self):
+        return len(self.places)
+
+    def search(self, query, limit=None):
+        """
+        Return up to `limit` places whose name starts with `query`, most populous first.
+
+        A trailing ", <state>" in the query narrows results to that state, given as its
+        exact postal code ("TX") or the start of its name ("Tex").
+        """
+        limit = limit or self.limit
+        name_part, _, state_part = query.partition(",")
+        key = normalize_place_name(name_part)
+        state = normalize_place_name(state_part)
+        if not key:
+            return []
+
+        if not state and len(key) <= PRECOMPUTED_PREFIX_LENGTH:
+            return self.top.get(key, [])[:limit]
+
+        lo = bisect_left(self.keys, key)
+        hi = bisect_left(self.keys, key + "\uffff", lo)
+        candidates = self.places[lo:hi]
+        if state:
+            candidates = [place for place in candidates if state_matches(place.state, state)]
+        return heapq.nlargest(limit, candidates, key=lambda place: place.population)
+
+
+def state_matches(code, state):
+    """Whether the normalized query `state` names the state with postal `code`."""
+    if state == code.lower():
+        return True
+    return STATE_NAME_KEYS.get(code.upper(), "\0").startswith(state)
+
+
+STATE_NAME_KEYS = {code: normalize_place_name(name) for code, name in US_STATE_NAMES.items()}
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_place_index():
+    """
+    Build the process-wide index from the Place table on first use. An empty table
+    is not cached, so places loaded after the process started are picked up.
+    """
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                from api.models import Place
+
+                rows = Place.objects.values_list("name", "state", "latitude", "longitude", "population")
+                index = PlaceIndex(
+                    GazetteerPlace(normalize_place_name(name), name, state, latitude, longitude, population)
+                    for name, state, latitude, longitude, population in rows.iterator(chunk_size=5000)
+                )
+                if not len(index):
+                    return index
+                _index = index
+                logger.info(f"Loaded {len(_index)} gazetteer places into the location index")
+    return _index
+
+
+def search_places(query, limit=10):
+    return [
+        {
+            "name": f"{place.name}, {place.state}" if place.state else place.name,
+            "latitude": place.latitude,
+            "longitude": place.longitude,
+        }
+        for place in get_place_index().search(query, limit)
+    ]
@@ -0,0 +1,405 @@
+from bisect import bisect_right
+import heapq
+import numpy as np
+
+
+# Hours-of-service limits
+MAX_DRIVING_HOURS = 11
+MAX_WINDOW_HOURS = 14
+MAX_CYCLE_HOURS = 70
+RESTART_HOURS = 34
+SHIFT_RESET_HOURS = 10
+
+# Spacing of POI-based stops, in miles
+FUEL_INTERVAL_MILES = 1000
+TRAILER_INTERVAL_MILES = 600
+INSPECTION_INTERVAL_MILES = 300
+
+SCALING_DURATION = 0.5
+TRAILER_CHANGE_DURATION = 0.5
+INSPECTION_DURATION = 0.25
+
+# A POI-based stop goes to the POI nearest its target mile within this many miles either side
+POI_WINDOW_MILES = 50
+
+# A due 30-minute break is taken up to this many driving hours early at a real rest area
+REST_AREA_LOOKAHEAD_HOURS = 1
+
+# A schedule is abandoned past this many stops; a coast-to-coast trip needs a few hundred
+MAX_STOPS = 5000
+
+# Tie-breaking when several events fall on the same mile
+PICKUP, DROPOFF, RESTART, SHIFT_END, BREAK, FUEL, SCALING, TRAILER, INSPECTION = range(9)
+
+# Event kinds whose position depends on the duty clocks and is recomputed after every event
+LIMIT_EVENTS = ("restart", "shift_end", "break")
+
+
+class SpeedProfile:
+    """
+    Maps route miles to cumulative driving hours and back by linear interpolation.
+
+    Built from ORS step durations when available (see trip_planner.build_speed_profile);
+    otherwise, and past the end of the profile, a constant speed is assumed.
+    """
+
+    def __init__(self, speed_mph, profile=None):
+        self.speed_mph = speed_mph
+        self.miles = self.hours = None
+        if profile and len(profile["miles"]) > 1 and profile["hours"][-1] > 0:
+            self.miles = np.asarray(profile["miles"], dtype=float)
+            self.hours = np.asarray(profile["hours"], dtype=float)
+            # Beyond the geometry, keep the route's average speed
+            self.speed_mph = self.miles[-1] / self.hours[-1]
+
+    def hours_at(self, mile):
+        if self.miles is None:
+            return mile / self.speed_mph
+        if mile >= self.miles[-1]:
+            return float(self.hours[-1] + (mile - self.miles[-1]) / self.speed_mph)
+        return float(np.interp(mile, self.miles, self.hours))
+
+    def mile_at(self, hours):
+        if self.miles is None:
+            return hours * self.speed_mph
+        if hours >= self.hours[-1]:
+            return float(self.miles[-1] + (hours - self.hours[-1]) * self.speed_mph)
+        return float(np.interp(hours, self.hours, self.miles))
+
+    def advance(self, mile, hours):
+        """Mile reached after driving `hours` from `mile`."""
+        return self.mile_at(self.hours_at(mile) + hours)
+
+
+class HOSScheduler:
+    """
+    Event-driven hours-of-service simulation of a single driver along a speed profile.
+
+    Instead of re-checking every rule after each fixed driving chunk, every upcoming
+    event (the next POI of each category, the next scaling threshold, the pickup and
+    dropoff, and the mile at which the break, 11/14-hour or 70-hour limit would be hit)
+    sits in a priority queue keyed by route mile. The simulation drives straight to the
+    earliest one, handles it and re-queues what it affects, so the cost grows with the
+    number of stops rather than with checks per iteration.
+
+    Time is kept on an absolute clock from the start of the trip, so schedules can
+    span any number of days; every emitted stop carries its "day" and hour of day.
+    """
+
+    def __init__(self, geometry, geometry_distances, pois, current_cycle_hours, speed_mph=60, speed_profile=None,
+                 scaling_interval=500, break_timing=6, pre_trip_duration=0.5, post_trip_duration=1.5,
+                 fueling_duration=0.5, loading_duration=0.5, unloading_duration=0.5, rest_break_duration=0.5):
+        if min(speed_mph, scaling_interval, break_timing) <= 0:
+            raise ValueError("speed_mph, scaling_interval and break_timing must be positive")
+
+        self.geometry = geometry
+        self.geometry_distances = geometry_distances
+        self.total_route_miles = geometry_distances[-1]
+        self.profile = SpeedProfile(speed_mph, speed_profile)
+        self.scaling_interval = scaling_interval
+        self.break_timing = break_timing
+        self.pre_trip_duration = pre_trip_duration
+        self.post_trip_duration = post_trip_duration
+        self.fueling_duration = fueling_duration
+        self.loading_duration = loading_duration
+        self.unloading_duration = unloading_duration
+        self.rest_break_duration = rest_break_duration
+
+        # POIs per category, sorted by route mile, with their miles as arrays for searchsorted
+        self.pois = pois
+        self.poi_miles = {
+            category: np.fromiter((poi["distance"] for poi in items), dtype=float, count=len(items))
+            for category, items in pois.items()
+        }
+
+        self.stops = []
+        self.events = []
+        self.sequence = 0
+        self.limits_version = 0
+
+        self.clock = 0.0
+        self.miles = 0.0
+        self.cycle_hours = current_cycle_hours
+        self.shift_driving_hours = 0.0
+        self.window_hours = 0.0
+        self.driving_since_break = 0.0
+        self.non_driving_run = 0.0
+        self.total_on_duty_hours = 0.0
+        self.split_sleeper_used = False
+        self.distance_miles = 0.0
+
+    def run(self, distance_miles, start_coords, end_coords, pickup_coords=None, pickup_miles=None):
+        """
+        Schedule a trip from start to dropoff, via the pickup unless `pickup_coords` is None
+        (start and pickup are the same place).
+
+        Returns:
+            dict: stops, total_days and total_on_duty_hours.
+        """
+        self.distance_miles = distance_miles
+        self.end_coords = end_coords
+        start_location = "Start" if pickup_coords is not None else "Start/Pickup"
+        self.add_stop(start_location, "Pre-trip & TI", "on_duty_not_driving", self.pre_trip_duration,
+                      start_coords.latitude, start_coords.longitude)
+
+        if pickup_coords is not None:
+            self.pickup_coords = pickup_coords
+            self.push(pickup_miles, PICKUP, "pickup")
+        else:
+            self.push(self.miles, SCALING, "scaling")
+        self.push(distance_miles, DROPOFF, "dropoff")
+        # As in the loop-based planner, the first stop of each kind is at the first POI on the
+        # route; the intervals only space the following ones
+        self.push_poi("fuel_stations", FUEL, "fuel", 0)
+        self.push_poi("trailer_changes", TRAILER, "trailer", 0)
+        self.push_poi("inspection_stops", INSPECTION, "inspection", 0)
+        self.push_limits()
+
+        while self.events:
+            mile, _, _, kind, payload, version = heapq.heappop(self.events)
+            if kind in LIMIT_EVENTS and version != self.limits_version:
+                continue
+            self.drive_to(mile)
+            if getattr(self, f"on_{kind}")(payload):
+                break
+            self.push_limits()
+
+        return {
+            "stops": self.stops,
+            "total_days": self.stops[-1]["day"] if self.stops else 1,
+            "total_on_duty_hours": self.total_on_duty_hours,
+        }
+
+    def push(self, mile, priority, kind, payload=None):
+        heapq.heappush(self.events, (mile, priority, self.sequence, kind, payload, self.limits_version))
+        self.sequence += 1
+
+    def push_poi(self, category, priority, kind, target_mile):
+        """
+        Queue the POI of `category` nearest `target_mile` within POI_WINDOW_MILES, never one
+        behind the truck. With none in the window, the first POI past it is used instead.
+        """
+        miles = self.poi_miles[category]
+        low = np.searchsorted(miles, max(target_mile - POI_WINDOW_MILES, self.miles), "left")
+        high = np.searchsorted(miles, target_mile + POI_WINDOW_MILES, "right")
+        index = low + int(np.argmin(np.abs(miles[low:high] - target_mile))) if low < high else low
+        if index < len(miles):
+            self.push(float(miles[index]), priority, kind, self.pois[category][index])
+
+    def push_limits(self):
+        """Requeue the clock-driven events; earlier entries go stale with the version bump."""
+        self.limits_version += 1
+
+        cycle_left = MAX_CYCLE_HOURS - self.cycle_hours
+        self.push(self.profile.advance(self.miles, max(cycle_left, 0)), RESTART, "restart")
+
+        shift_left = min(MAX_DRIVING_HOURS - self.shift_driving_hours, MAX_WINDOW_HOURS - self.window_hours)
+        self.push(self.profile.advance(self.miles, max(shift_left, 0)), SHIFT_END, "shift_end")
+
+        break_due = self.profile.advance(self.miles, max(self.break_timing - self.driving_since_break, 0))
+        rest_miles = self.poi_miles["rest_stops"]
+        earliest = max(self.miles, self.profile.advance(break_due, -REST_AREA_LOOKAHEAD_HOURS))
+        low = np.searchsorted(rest_miles, earliest, "left")
+        high = np.searchsorted(rest_miles, break_due, "right")
+        if low < high:
+            # The last rest area before the break is due
+            self.push(float(rest_miles[high - 1]), BREAK, "break", self.pois["rest_stops"][high - 1])
+        else:
+            self.push(break_due, BREAK, "break")
+
+    def drive_to(self, mile):
+        if mile <= self.miles:
+            return
+        hours = self.profile.hours_at(mile) - self.profile.hours_at(self.miles)
+        coords = self.coords_at(mile)
+        self.emit({
+            "location": "Driving",
+            "activity": "Driving",
+            "duty_status": "driving",
+            "duration": hours,
+            "lat": coords["lat"],
+            "lon": coords["lon"],
+            "miles_traveled": mile,
+        }, start_miles=self.miles)
+        self.miles = mile
+        self.clock += hours
+        self.shift_driving_hours += hours
+        self.window_hours += hours
+        self.driving_since_break += hours
+        self.cycle_hours += hours
+        self.total_on_duty_hours += hours
+        self.non_driving_run = 0.0
+
+    def add_stop(self, location, activity, duty_status, duration, lat=None, lon=None):
+        if lat is None:
+            coords = self.coords_at(self.miles)
+            lat, lon = coords["lat"], coords["lon"]
+        self.emit({
+            "location": location,
+            "activity": activity,
+            "duty_status": duty_status,
+            "duration": duration,
+            "lat": lat,
+            "lon": lon,
+            "miles_traveled": self.miles,
+        })
+        self.clock += duration
+        self.window_hours += duration
+        if duty_status == "on_duty_not_driving":
+            self.cycle_hours += duration
+            self.total_on_duty_hours += duration
+
+        # Any 30 consecutive minutes not driving satisfy the break requirement
+        self.non_driving_run += duration
+        if self.non_driving_run >= self.rest_break_duration:
+            self.driving_since_break = 0.0
+
+    def emit(self, stop, start_miles=None):
+        """
+        Append a stop starting at the current clock, split at midnights so each log day is complete.
+
+        Raises:
+            ValueError: Once the schedule exceeds MAX_STOPS stops.
+        """
+        start, remaining = self.clock, stop["duration"]
+        while True:
+            if len(self.stops) >= MAX_STOPS:
+                raise ValueError(f"The schedule exceeds {MAX_STOPS} stops")
+            day = int(start // 24)
+            time = start - day * 24
+            part = min(remaining, 24 - time)
+            if remaining - part < 1e-9:
+                part = remaining
+            piece = {**stop, "time": time, "day": day + 1, "duration": part}
+            if part < remaining and start_miles is not None:
+                # A driving segment split at midnight ends where the truck was at midnight
+                start_miles = self.profile.advance(start_miles, part)
+                coords = self.coords_at(start_miles)
+                piece.update(lat=coords["lat"], lon=coords["lon"], miles_traveled=start_miles)
+            self.stops.append(piece)
+            remaining -= part
+            start += part
+            if remaining <= 0:
+                return
+
+    def end_shift(self):
+        self.shift_driving_hours = 0.0
+        self.window_hours = 0.0
+        self.driving_since_break = 0.0
+
+    def coords_at(self, mile):
+        """Interpolate coordinates at a route mile."""
+        if mile <= 0:
+            return {"lat": self.geometry[0][1], "lon": self.geometry[0][0]}
+        if mile >= self.total_route_miles:
+            return {"lat": self.geometry[-1][1], "lon": self.geometry[-1][0]}
+        i = bisect_right(self.geometry_distances, mile) - 1
+        start, end = self.geometry_distances[i], self.geometry_distances[i + 1]
+        fraction = (mile - start) / (end - start) if end > start else 0
+        lon1, lat1 = self.geometry[i]
+        lon2, lat2 = self.geometry[i + 1]
+        return {"lat": lat1 + fraction * (lat2 - lat1), "lon": lon1 + fraction * (lon2 - lon1)}
+
+    # Event handlers; a truthy return ends the simulation
+
+    def on_pickup(self, payload):
+        self.add_stop("Pickup", "Loading", "on_duty_not_driving", self.loading_duration,
+                      self.pickup_coords.latitude, self.pickup_coords.longitude)
+        # Scale the loaded truck before the first leg
+        self.push(self.miles, SCALING, "scaling")
+
+    def on_dropoff(self, payload):
+        self.add_stop("Dropoff", "Unloading", "on_duty_not_driving", self.unloading_duration,
+                      self.end_coords.latitude, self.end_coords.longitude)
+        self.add_stop("Post-Trip", "Post-trip & TI", "off_duty", self.post_trip_duration)
+        return True
+
+    def on_restart(self, payload):
+        self.add_stop("Restart", "34-hour Restart", "off_duty", RESTART_HOURS)
+        self.cycle_hours = 0.0
+        self.split_sleeper_used = False
+        self.end_shift()
+
+    def on_shift_end(self, payload):
+        self.add_stop("Post-Trip", "Post-trip & TI", "off_duty", self.post_trip_duration)
+        if not self.split_sleeper_used and self.miles < self.distance_miles * 0.75:
+            self.add_stop("Sleeper Berth", "Sleeper Berth (Split 1)", "sleeper_berth", 8.0)
+            self.add_stop("Sleeper Berth", "Sleeper Berth (Split 2)", "sleeper_berth", 2.0)
+            self.split_sleeper_used = True
+        else:
+            self.add_stop("Sleeper Berth", "Sleeper Berth", "sleeper_berth", SHIFT_RESET_HOURS - self.post_trip_duration)
+        self.end_shift()
+
+    def on_break(self, rest_area):
+        if rest_area is not None:
+            self.add_stop(rest_area["location"], "Rest Break", "off_duty", self.rest_break_duration,
+                          rest_area["lat"], rest_area["lon"])
+        else:
+            self.add_stop("Rest Break", "30-min Break", "off_duty", self.rest_break_duration)
+        self.driving_since_break = 0.0
+
+    def on_fuel(self, station):
+        self.add_stop(station["location"], "Fueling", "on_duty_not_driving", self.fueling_duration,
+                      station["lat"], station["lon"])
+        self.push_poi("fuel_stations", FUEL, "fuel", self.miles + FUEL_INTERVAL_MILES)
+
+    def on_scaling(self, payload):
+        self.add_stop("Scaling Stop", "Scaling", "on_duty_not_driving", SCALING_DURATION)
+        self.push(self.miles + self.scaling_interval, SCALING, "scaling")
+
+    def on_trailer(self, truck_stop):
+        self.add_stop(truck_stop["location"], "Trailer Change", "on_duty_not_driving", TRAILER_CHANGE_DURATION,
+                      truck_stop["lat"], truck_stop["lon"])
+        self.push_poi("trailer_changes", TRAILER, "trailer", self.miles + TRAILER_INTERVAL_MILES)
+
+    def on_inspection(self, weigh_station):
+        self.add_stop(weigh_station["location"], "In-Road Inspection", "on_duty_not_driving", INSPECTION_DURATION,
+                      weigh_station["lat"], weigh_station["lon"])
+        self.push_poi("inspection_stops", INSPECTION, "inspection", self.miles + INSPECTION_INTERVAL_MILES)
+
+
+def schedule_route(route, distance, current_cycle_hours, pickup_coords, start_coords, end_coords, speed_mph=60, **params):
+    """
+    Schedule a trip over a route prepared by trip_planner.index_route.
+
+    Kept free of Django imports so what-if variants can run in a spawned process pool.
+
+    Returns:
+        dict: stops, total_days, total_on_duty_hours and distance_miles.
+    """
+    distance_miles = distance * 0.621371
+    scheduler = HOSScheduler(
+        route["geometry"], route["geometry_distances"], route["pois"], current_cycle_hours,
+        speed_mph=speed_mph, speed_profile=route.get("speed_profile"), **params,
+    )
+    pickup_miles = route["pickup_miles"]
+    schedule = scheduler.run(
+        distance_miles, start_coords, end_coords,
+        pickup_coords=pickup_coords if pickup_miles is not None else None,
+        pickup_miles=pickup_miles,
+    )
+    return {**schedule, "distance_miles": distance_miles}
+
+
+def compare_schedules(route, distance, pickup_coords, start_coords, end_coords, variants):
+    """
+    Schedule one route under several parameter sets and summarize each plan.
+
+    Each variant holds current_cycle_hours plus any schedule_route parameters. Only
+    the summaries are returned, so results stay cheap to send back from a worker process.
+    """
+    summaries = []
+    for variant in variants:
+        params = dict(variant)
+        current_cycle_hours = params.pop("current_cycle_hours", 0)
+        plan = schedule_route(route, distance, current_cycle_hours, pickup_coords, start_coords, end_coords, **params)
+        stops = plan["stops"]
+        arrival = next(stop for stop in stops if stop["activity"] == "Unloading")
+        summaries.append({
+            "total_days": plan["total_days"],
+            "total_on_duty_hours": round(plan["total_on_duty_hours"], 2),
+            "arrival_hours": round((arrival["day"] - 1) * 24 + arrival["time"], 2),
+            "completion_hours": round((stops[-1]["day"] - 1) * 24 + stops[-1]["time"] + stops[-1]["duration"], 2),
+            "stop_count": len(stops),
+        })
+    return summaries
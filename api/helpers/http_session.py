@@ -0,0 +1,66 @@
+from django.conf import settings
+import aiohttp
+import asyncio
+import logging
+import threading
+import weakref
+
+logger = logging.getLogger(__name__)
+
+
+# One pooled ClientSession per event loop; a session cannot be shared across loops
+_sessions = weakref.WeakKeyDictionary()
+_local = threading.local()
+
+
+def get_session():
+    """
+    Return the pooled aiohttp session of the running event loop, creating it on first use.
+
+    Connections are kept alive between calls, so consecutive trips reuse warm
+    DNS, TCP and TLS state instead of reconnecting to Overpass every time.
+    """
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=settings.HTTP_POOL_LIMIT,
+            limit_per_host=settings.HTTP_POOL_LIMIT_PER_HOST,
+            keepalive_timeout=settings.HTTP_KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=settings.HTTP_DNS_CACHE_TTL,
+        )
+        timeout = aiohttp.ClientTimeout(total=settings.HTTP_REQUEST_TIMEOUT)
+        session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        _sessions[loop] = session
+    return session
+
+
+def get_event_loop():
+    """Long-lived event loop of the calling thread, replacing a fresh loop per asyncio.run()."""
+    loop = getattr(_local, "loop", None)
+    if loop is None or loop.is_closed():
+        loop = asyncio.new_event_loop()
+        _local.loop = loop
+    return loop
+
+
+def run_async(coro):
+    """Run `coro` to completion on the calling thread's persistent event loop."""
+    return get_event_loop().run_until_complete(coro)
+
+
+def close_event_loop():
+    """Close the calling thread's pooled session and event loop (worker shutdown)."""
+    loop = getattr(_local, "loop", None)
+    if loop is None or loop.is_closed():
+        return
+    session = _sessions.pop(loop, None)
+    try:
+        if session is not None and not session.closed:
+            loop.run_until_complete(session.close())
+        loop.run_until_complete(loop.shutdown_asyncgens())
+    except Exception as e:
+        logger.warning(f"Error while closing the worker event loop: {e}")
+    finally:
+        loop.close()
+        _local.loop = None
@@ -0,0 +1,82 @@
+from django.conf import settings
+from hashlib import sha256
+from rest_framework import status
+from rest_framework.response import Response
+from api.helpers.leases import aacquire_lease, acquire_lease, arelease_lease, refresh_lease, release_lease
+from api.serializers import TripSerializer
+import json
+
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+
+
+def get_idempotency_key(request):
+    """
+    The client-chosen key identifying one logical plan-trip submission, or None.
+
+    Raises:
+        ValueError: If the key is longer than the column storing it.
+    """
+    key = request.headers.get(IDEMPOTENCY_HEADER, "").strip()
+    if len(key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+        raise ValueError(f"{IDEMPOTENCY_HEADER} must be at most {MAX_IDEMPOTENCY_KEY_LENGTH} characters")
+    return key or None
+
+
+def get_request_fingerprint(request):
+    """Hash of the submitted body, to tell a retry from a different request reusing its key."""
+    payload = json.dumps(request.data, sort_keys=True, separators=(",", ":"), default=str)
+    return sha256(payload.encode()).hexdigest()
+
+
+def replayed_trip_response(trip, fingerprint):
+    """
+    Answer a repeated submission with the trip the first one created, planned or
+    still in flight, or 422 if the key was first used with a different body.
+    """
+    # Trips stored before fingerprints were recorded cannot be checked
+    if trip.idempotency_fingerprint and trip.idempotency_fingerprint != fingerprint:
+        return Response(
+            {"error": f"{IDEMPOTENCY_HEADER} was already used with a different request"},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    response = Response({
+        "message": "Trip already created",
+        "data": TripSerializer(trip).data,
+    }, status=status.HTTP_200_OK)
+    response["Idempotent-Replayed"] = "true"
+    return response
+
+
+def trip_lock_key(trip_id):
+    return f"trip-plan-lock:{trip_id}"
+
+
+def acquire_trip_lock(trip_id):
+    """
+    Take the planning lease of a trip. Only one pipeline per trip runs at a time;
+    the lease expires on its own if a worker dies before releasing it.
+
+    Returns:
+        str: Token to refresh and release the lease with, or None if the trip is
+        already being planned.
+    """
+    return acquire_lease(trip_lock_key(trip_id), settings.TRIP_PLAN_LOCK_TIMEOUT)
+
+
+async def aacquire_trip_lock(trip_id):
+    return await aacquire_lease(trip_lock_key(trip_id), settings.TRIP_PLAN_LOCK_TIMEOUT)
+
+
+def refresh_trip_lock(trip_id, token):
+    """Renew the lease for the next pipeline stage. False if another pipeline has taken it over."""
+    return refresh_lease(trip_lock_key(trip_id), token, settings.TRIP_PLAN_LOCK_TIMEOUT)
+
+
+def release_trip_lock(trip_id, token):
+    release_lease(trip_lock_key(trip_id), token)
+
+
+async def arelease_trip_lock(trip_id, token):
+    await arelease_lease(trip_lock_key(trip_id), token)
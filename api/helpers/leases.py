@@ -0,0 +1,105 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+import os
+import threading
+import uuid
+
+
+# Delete or extend a lease only while it still holds the caller's token, so a holder
+# whose lease expired cannot drop or take over the lease of whoever took it next.
+RELEASE_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+REFRESH_SCRIPT = """
+local holder = redis.call("GET", KEYS[1])
+if holder == ARGV[1] or not holder then
+    redis.call("SET", KEYS[1], ARGV[1], "EX", ARGV[2])
+    return 1
+end
+return 0
+"""
+
+
+class LeaseClient:
+    """Raw Redis client for the leases, reconnected after a fork and shared by its threads."""
+
+    def __init__(self):
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    import redis
+
+                    self.client = redis.Redis.from_url(settings.CACHES["default"]["LOCATION"], decode_responses=True)
+                    self.release = self.client.register_script(RELEASE_SCRIPT)
+                    self.refresh = self.client.register_script(REFRESH_SCRIPT)
+                    self._pid = os.getpid()
+        return self
+
+
+lease_client = LeaseClient()
+
+
+def uses_redis():
+    return settings.CACHES["default"]["BACKEND"].endswith("RedisCache")
+
+
+def acquire_lease(key, timeout):
+    """
+    Take the lease `key` for `timeout` seconds. Returns the token proving ownership,
+    or None when someone else holds it.
+
+    With a non-Redis cache backend (local development) leases fall back to the cache
+    API, which cannot compare-and-delete atomically.
+    """
+    token = uuid.uuid4().hex
+    if uses_redis():
+        acquired = lease_client.get().client.set(cache.make_key(key), token, nx=True, ex=timeout)
+    else:
+        acquired = cache.add(key, token, timeout=timeout)
+    return token if acquired else None
+
+
+def get_lease_holder(key):
+    """Token of the current holder of `key`, or None when it is free."""
+    if uses_redis():
+        return lease_client.get().client.get(cache.make_key(key))
+    return cache.get(key)
+
+
+def refresh_lease(key, token, timeout):
+    """
+    Extend a lease to `timeout` seconds from now, taking it again if it expired in
+    the meantime. Returns False if someone else holds it.
+    """
+    if uses_redis():
+        return bool(lease_client.get().refresh(keys=[cache.make_key(key)], args=[token, timeout]))
+    if cache.get(key) not in (token, None):
+        return False
+    cache.set(key, token, timeout=timeout)
+    return True
+
+
+def release_lease(key, token):
+    """Release a lease if `token` still holds it. Returns False if it was lost."""
+    if uses_redis():
+        return bool(lease_client.get().release(keys=[cache.make_key(key)], args=[token]))
+    if cache.get(key) != token:
+        return False
+    cache.delete(key)
+    return True
+
+
+# Independent Redis calls, so they run in the executor's threads rather than one at a
+# time on the single thread sync_to_async shares by default
+aacquire_lease = sync_to_async(acquire_lease, thread_sensitive=False)
+aget_lease_holder = sync_to_async(get_lease_holder, thread_sensitive=False)
+arefresh_lease = sync_to_async(refresh_lease, thread_sensitive=False)
+arelease_lease = sync_to_async(release_lease, thread_sensitive=False)
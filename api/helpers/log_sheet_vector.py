@@ -0,0 +1,127 @@
+from xml.sax.saxutils import escape
+from api.helpers.trip_planner import (
+    LOG_SHEET_HEIGHT, LOG_SHEET_WIDTH, duty_positions, graph_width, graph_x_start, layout_eld_log, x_scale,
+)
+import zlib
+
+
+FONT_SIZE = 8
+# Offset from the top of a line of text to its baseline, matching PIL's top-left text anchor
+BASELINE_OFFSET = 7
+
+
+def grid_lines():
+    """Hour columns and duty status rows that the raster renderer gets from the blank template."""
+    rows = sorted(duty_positions.values())
+    top = rows[0] - 15
+    bottom = rows[-1] + 15
+    lines = [((graph_x_start + hour * x_scale, top, graph_x_start + hour * x_scale, bottom), 0.5) for hour in range(25)]
+    for y in [top, *[(a + b) / 2 for a, b in zip(rows, rows[1:])], bottom]:
+        lines.append(((graph_x_start, y, graph_x_start + graph_width, y), 0.5))
+    return lines
+
+
+def render_eld_log_svg(trip_data, day, start_date, user):
+    """
+    Render the log sheet for a single day of a trip as SVG.
+
+    Uses the same layout as the PNG renderer, drawing the grid as vectors instead
+    of the raster template.
+
+    Returns:
+        str: SVG document.
+    """
+    layout = layout_eld_log(trip_data, day, start_date, user)
+
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{LOG_SHEET_WIDTH}" height="{LOG_SHEET_HEIGHT}" '
+        f'viewBox="0 0 {LOG_SHEET_WIDTH} {LOG_SHEET_HEIGHT}">',
+        '<rect width="100%" height="100%" fill="white"/>',
+        '<g stroke="#999">',
+    ]
+    parts.extend(svg_line(coords, width) for coords, width in grid_lines())
+    parts.append('</g><g stroke="black" stroke-linecap="square">')
+    parts.extend(svg_line(coords, width) for coords, width in layout["lines"])
+    parts.append(f'</g><g font-family="Helvetica, Arial, sans-serif" font-size="{FONT_SIZE}">')
+    parts.extend(
+        f'<text x="{x:g}" y="{y + BASELINE_OFFSET:g}">{escape(str(text))}</text>'
+        for (x, y), text in layout["texts"]
+    )
+    parts.append('</g></svg>')
+    return "".join(parts)
+
+
+def svg_line(coords, width):
+    x1, y1, x2, y2 = coords
+    return f'<line x1="{x1:g}" y1="{y1:g}" x2="{x2:g}" y2="{y2:g}" stroke-width="{width:g}"/>'
+
+
+def render_eld_logs_pdf(trip_data, start_date, user):
+    """
+    Render every day of a trip as one page of a vector PDF.
+
+    Returns:
+        bytes: PDF document.
+    """
+    pages = [
+        pdf_page_content(layout_eld_log(trip_data, day, start_date, user))
+        for day in range(1, trip_data["total_days"] + 1)
+    ]
+    return build_pdf(pages)
+
+
+def pdf_page_content(layout):
+    # Flip the y axis so template pixel coordinates can be used as-is
+    ops = [f"1 0 0 -1 0 {LOG_SHEET_HEIGHT} cm", "0.6 G"]
+    for (x1, y1, x2, y2), width in grid_lines():
+        ops.append(f"{width:g} w {x1:g} {y1:g} m {x2:g} {y2:g} l S")
+    ops.append("0 G")
+    for (x1, y1, x2, y2), width in layout["lines"]:
+        ops.append(f"{width:g} w {x1:g} {y1:g} m {x2:g} {y2:g} l S")
+    ops.append(f"BT /F1 {FONT_SIZE} Tf")
+    for (x, y), text in layout["texts"]:
+        # Un-flip each line of text so it is not drawn upside down
+        ops.append(f"1 0 0 -1 {x:g} {y + BASELINE_OFFSET:g} Tm ({pdf_escape(str(text))}) Tj")
+    ops.append("ET")
+    return "\n".join(ops).encode("latin-1")
+
+
+def pdf_escape(text):
+    text = text.encode("latin-1", "replace").decode("latin-1")
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def build_pdf(page_contents):
+    """Assemble a minimal PDF: catalog, page tree, one Helvetica font and a compressed stream per page."""
+    page_count = len(page_contents)
+    first_page_id = 4
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        (
+            "<< /Type /Pages /Count %d /Kids [%s] >>" % (
+                page_count, " ".join(f"{first_page_id + 2 * i} 0 R" for i in range(page_count)),
+            )
+        ).encode(),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    ]
+    for i, content in enumerate(page_contents):
+        stream = zlib.compress(content)
+        objects.append((
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {LOG_SHEET_WIDTH} {LOG_SHEET_HEIGHT}] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {first_page_id + 2 * i + 1} 0 R >>"
+        ).encode())
+        objects.append(
+            f"<< /Length {len(stream)} /Filter /FlateDecode >>\nstream\n".encode() + stream + b"\nendstream"
+        )
+
+    pdf = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+
+    xref_offset = len(pdf)
+    pdf += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    pdf += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    pdf += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode()
+    return bytes(pdf)
@@ -0,0 +1,408 @@
+from array import array
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from hashlib import md5
+from api.helpers.http_session import get_session
+from api.helpers.rate_limit import AdaptiveBackoff, TokenBucket
+from api.helpers.single_flight import asingle_flight
+from api.helpers.tiered_cache import tiered_cache
+import aiohttp
+import asyncio
+import codecs
+import json
+import logging
+import numpy as np
+import struct
+import time
+
+logger = logging.getLogger(__name__)
+
+
+OVERPASS_URL = "http://overpass-api.de/api/interpreter"
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Freshness of the POIs a trip was planned with, worst first
+POI_UNAVAILABLE = "unavailable"
+POI_STALE = "stale"
+POI_OK = "ok"
+POI_STATUSES = (POI_UNAVAILABLE, POI_STALE, POI_OK)
+# Overpass answers these when it is overloaded or throttling us
+BACKOFF_STATUSES = (429, 504)
+
+overpass_bucket = TokenBucket("overpass", settings.OVERPASS_RATE_LIMIT, settings.OVERPASS_RATE_BURST)
+overpass_backoff = AdaptiveBackoff("overpass", settings.OVERPASS_BACKOFF_BASE, settings.OVERPASS_BACKOFF_MAX)
+
+
+class OverpassElementStream:
+    """
+    Incrementally decodes the objects of the top-level "elements" array of an
+    Overpass JSON response, so the full response body is never held in memory.
+
+    `done` is set once the array is closed. The text around it is kept to check that
+    the whole response arrived and to read Overpass' "remark", which reports runtime
+    errors such as a query timeout after a partial set of elements.
+    """
+
+    def __init__(self):
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.head = ""
+        self.tail = ""
+        self.in_elements = False
+        self.done = False
+
+    def feed(self, chunk):
+        """Consume a chunk of response bytes and yield every element completed by it."""
+        text = self.text_decoder.decode(chunk)
+        if self.done:
+            self.tail += text
+            return
+        self.buffer += text
+        pos = 0
+
+        if not self.in_elements:
+            key = self.buffer.find('"elements"')
+            start = self.buffer.find("[", key) if key != -1 else -1
+            if start == -1:
+                return
+            self.in_elements = True
+            self.head = self.buffer[:key]
+            pos = start + 1
+
+        buffer = self.buffer
+        while not self.done:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos == len(buffer):
+                break
+            if buffer[pos] == "]":
+                self.done = True
+                self.tail = buffer[pos + 1:]
+                break
+            try:
+                element, pos = self.decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # The element continues in the next chunk
+                break
+            yield element
+
+        self.buffer = "" if self.done else buffer[pos:]
+
+    @property
+    def complete(self):
+        """Whether the response ended with the closed elements array and document."""
+        if not self.done:
+            return False
+        try:
+            json.loads('{"elements":[]' + self.tail)
+        except json.JSONDecodeError:
+            return False
+        return True
+
+    @property
+    def remark(self):
+        """Overpass' "remark" (set on runtime errors), or None."""
+        for text in (self.head, self.tail):
+            key = text.find('"remark"')
+            if key == -1:
+                continue
+            start = text.find('"', text.find(":", key))
+            try:
+                return self.decoder.raw_decode(text, start)[0]
+            except (json.JSONDecodeError, ValueError):
+                # Cut off with the rest of the response
+                return text[start:]
+        return None
+
+
+# Cached POI batches are packed binary: header (with the fetch time), little-endian float32
+# lat and lon arrays, uint32 indexes into a table of distinct names, then the names as
+# NUL-separated UTF-8. POI1 batches predate the fetch time.
+POI_CACHE_HEADER = struct.Struct("<4sIId")
+POI_CACHE_MAGIC = b"POI2"
+LEGACY_POI_CACHE_HEADER = struct.Struct("<4sII")
+LEGACY_POI_CACHE_MAGIC = b"POI1"
+NO_NAME = 0xFFFFFFFF
+
+
+class PoiBuilder:
+    """Accumulates streamed elements as compact arrays, interning repeated names."""
+
+    def __init__(self):
+        self.lat = array("f")
+        self.lon = array("f")
+        self.name_index = array("I")
+        self.names = {}
+
+    def add(self, element):
+        """Keep only the coordinates and name of an element (ways carry them in "center")."""
+        coords = element.get("center", element)
+        if "lat" not in coords or "lon" not in coords:
+            return
+        name = element.get("tags", {}).get("name")
+        self.lat.append(coords["lat"])
+        self.lon.append(coords["lon"])
+        self.name_index.append(self.names.setdefault(name, len(self.names)) if name else NO_NAME)
+
+    def encode(self, fetched_at=0.0):
+        name_table = "\0".join(self.names).encode()
+        return b"".join([
+            POI_CACHE_HEADER.pack(POI_CACHE_MAGIC, len(self.lat), len(name_table), fetched_at),
+            np.asarray(self.lat, dtype="<f4").tobytes(),
+            np.asarray(self.lon, dtype="<f4").tobytes(),
+            np.asarray(self.name_index, dtype="<u4").tobytes(),
+            name_table,
+        ])
+
+
+def decode_pois(data):
+    """
+    Decode a packed POI batch. The coordinate and name index arrays are read-only
+    views into `data`, so a cache hit copies nothing but the name table.
+    """
+    magic = bytes(data[:4])
+    if magic == POI_CACHE_MAGIC:
+        _, count, name_table_length, fetched_at = POI_CACHE_HEADER.unpack_from(data)
+        offset = POI_CACHE_HEADER.size
+    elif magic == LEGACY_POI_CACHE_MAGIC:
+        # Written with the old one-day timeout, so still fresh
+        _, count, name_table_length = LEGACY_POI_CACHE_HEADER.unpack_from(data)
+        fetched_at = None
+        offset = LEGACY_POI_CACHE_HEADER.size
+    else:
+        raise ValueError("Not a packed POI batch")
+
+    lat = np.frombuffer(data, dtype="<f4", count=count, offset=offset)
+    lon = np.frombuffer(data, dtype="<f4", count=count, offset=offset + 4 * count)
+    name_index = np.frombuffer(data, dtype="<u4", count=count, offset=offset + 8 * count)
+    name_table = data[offset + 12 * count:offset + 12 * count + name_table_length]
+    names = name_table.decode().split("\0") if name_table else []
+    return {"lat": lat, "lon": lon, "name_index": name_index, "names": names, "fetched_at": fetched_at}
+
+
+def is_fresh(pois, cache_timeout):
+    return pois["fetched_at"] is None or time.time() - pois["fetched_at"] < cache_timeout
+
+
+async def fetch_overpass_data(session, query, cache_timeout=None):
+    """
+    Asynchronously fetches POIs from the Overpass API with caching.
+
+    The response is parsed element by element as it streams in and only the
+    packed binary form is kept and cached. A cached batch is served as is for
+    `cache_timeout` (the soft TTL), then served while a background task refetches
+    it until OVERPASS_HARD_TTL, after which it is refetched on the request path.
+    Batches are kept for OVERPASS_STALE_TIMEOUT, so a failed or throttled request
+    can still fall back to the last known POIs.
+
+    Args:
+        session (aiohttp.ClientSession): The session to use for the request.
+        query (str): The Overpass query.
+        cache_timeout (int): Soft TTL in seconds (default: OVERPASS_SOFT_TTL).
+
+    Returns:
+        dict: Packed POI batch as returned by decode_pois, with a "status" of POI_OK,
+        POI_STALE (cached batch served after a failure) or POI_UNAVAILABLE (empty).
+    """
+    if cache_timeout is None:
+        cache_timeout = settings.OVERPASS_SOFT_TTL
+    cache_key = get_poi_cache_key(query)
+
+    async def read_fresh_cache():
+        pois = await read_cached_pois(cache_key)
+        return {**pois, "status": POI_OK} if pois is not None and is_fresh(pois, cache_timeout) else None
+
+    # Check if data exists in cache
+    cached = await read_cached_pois(cache_key)
+    if cached is not None and is_fresh(cached, cache_timeout):
+        logger.info(f"Cache hit! {query} Returning cached data.")
+        return {**cached, "status": POI_OK}
+    if cached is not None and is_fresh(cached, settings.OVERPASS_HARD_TTL):
+        logger.info(f"Serving {cache_key} past its soft TTL while it is refreshed")
+        await sync_to_async(schedule_refresh)(query)
+        return {**cached, "status": POI_OK}
+
+    # Concurrent trips on the same lane share one upstream request
+    return await asingle_flight(
+        cache_key,
+        lambda: request_overpass_data(session, query, cache_key, cache_timeout, cached),
+        read_fresh_cache,
+        lease=settings.OVERPASS_SINGLE_FLIGHT_LEASE,
+        wait=settings.OVERPASS_SINGLE_FLIGHT_WAIT,
+    )
+
+
+def get_poi_cache_key(query):
+    return f"overpass:poi:{md5(query.encode()).hexdigest()}"
+
+
+async def read_cached_pois(cache_key):
+    cached_result = await tiered_cache.aget(cache_key)
+    return decode_pois(cached_result) if cached_result else None
+
+
+def schedule_refresh(query):
+    """Queue one background refetch of a query, however many requests find it past its soft TTL."""
+    from api.tasks import refresh_overpass_pois  # api.tasks imports the trip planner, which imports this module
+
+    if not cache.add(f"overpass:refresh:{md5(query.encode()).hexdigest()}", 1, timeout=settings.OVERPASS_REFRESH_LEASE):
+        return
+    try:
+        refresh_overpass_pois.delay(query)
+    except Exception as e:
+        # The cached batch is still served, and the lease keeps requests from retrying a down
+        # broker until it expires; after the hard TTL the batch is refetched on the request path
+        logger.warning(f"Could not queue POI refresh: {e}")
+
+
+async def refresh_overpass_data(query):
+    """Refetch a cached query ahead of its hard TTL, keeping the cached batch if Overpass fails."""
+    cache_key = get_poi_cache_key(query)
+    stale = await read_cached_pois(cache_key)
+    pois = await request_overpass_data(get_session(), query, cache_key, settings.OVERPASS_SOFT_TTL, stale)
+    return pois["status"]
+
+
+async def acquire_overpass_slot():
+    """
+    Wait for a token of the shared Overpass budget. False, without waiting, when the
+    token or the end of a backoff pause is more than OVERPASS_MAX_WAIT away.
+    """
+    pause = await sync_to_async(overpass_backoff.remaining)()
+    if pause > settings.OVERPASS_MAX_WAIT:
+        return False
+    wait = await sync_to_async(overpass_bucket.reserve)(settings.OVERPASS_MAX_WAIT)
+    if wait is None:
+        return False
+    await asyncio.sleep(max(pause, wait))
+    return True
+
+
+def get_retry_after(headers):
+    try:
+        return float(headers.get("Retry-After", ""))
+    except ValueError:
+        # Absent, or an HTTP date; fall back to exponential backoff
+        return None
+
+
+async def request_overpass_data(session, query, cache_key, cache_timeout, stale):
+    if not await acquire_overpass_slot():
+        logger.warning(f"Overpass budget exhausted or backing off, skipping request {cache_key}")
+        return fallback_pois(stale)
+
+    headers = {"Content-Type": "application/x-www-form-urlencoded"}
+    try:
+        async with session.post(OVERPASS_URL, data=query, headers=headers) as response:
+            if response.status in BACKOFF_STATUSES:
+                delay = await sync_to_async(overpass_backoff.trigger)(get_retry_after(response.headers))
+                logger.warning(f"Overpass answered {response.status}, backing off for {delay:.0f}s")
+            response.raise_for_status()
+            builder = PoiBuilder()
+            stream = OverpassElementStream()
+            async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+                for element in stream.feed(chunk):
+                    builder.add(element)
+
+            # A body cut off mid-array, or a runtime error after partial output, would
+            # otherwise be cached as the complete set of POIs for weeks
+            if not stream.complete or stream.remark:
+                logger.error(f"Overpass returned incomplete data for {cache_key}: {stream.remark or 'truncated response'}")
+                return fallback_pois(stale)
+
+            data = builder.encode(fetched_at=time.time())
+            await tiered_cache.aset(cache_key, data, timeout=max(cache_timeout, settings.OVERPASS_STALE_TIMEOUT))
+            await sync_to_async(overpass_backoff.reset)()
+            logger.info(f"No cache! {query} Returning API Data.")
+            return {**decode_pois(data), "status": POI_OK}
+
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.error(f"Overpass API request failed: {e!r}")
+        return fallback_pois(stale)
+
+
+def fallback_pois(stale):
+    """The last cached batch when there is one, otherwise an empty batch flagged unavailable."""
+    if stale is not None:
+        return {**stale, "status": POI_STALE}
+    return {**decode_pois(PoiBuilder().encode()), "status": POI_UNAVAILABLE}
+
+
+def worst_poi_status(statuses):
+    return min(statuses, key=POI_STATUSES.index, default=POI_OK)
+
+
+def to_poi_list(pois, default_name):
+    names = pois["names"]
+    return [
+        {
+            "lat": lat,
+            "lon": lon,
+            "location": names[index] if index != NO_NAME else default_name,
+            "distance": 0.0
+        }
+        for lat, lon, index in zip(pois["lat"].tolist(), pois["lon"].tolist(), pois["name_index"].tolist())
+    ]
+
+
+def fuel_stations_query(bbox):
+    return f"""
+    [out:json][timeout:30];
+    (
+        node["amenity"="fuel"]({bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]});
+        way["amenity"="fuel"]({bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]});
+        node["highway"="services"]["fuel"="yes"]({bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]});
+        way["highway"="services"]["fuel"="yes"]({bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]});
+    );
+    out center qt;
+    """
+
+
+def rest_stops_query(bbox):
+    return f"""
+    [out:json][timeout:30];
+    (
+        node["highway"="rest_area"]({bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]});
+        way["highway"="rest_area"]({bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]});
+        node["amenity"="rest_area"]({bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]});
+        way["amenity"="rest_area"]({bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]});
+        node["highway"="services"]["rest_area"="yes"]({bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]});
+        way["highway"="services"]["rest_area"="yes"]({bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]});
+    );
+    out center qt;
+    """
+
+
+def trailer_changes_query(bbox):
+    return f"""
+    [out:json][timeout:30];
+    (
+        node["amenity"="truck_stop"]({bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]});
+        way["amenity"="truck_stop"]({bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]});
+        node["highway"="services"]["truck_stop"="yes"]({bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]});
+        way["highway"="services"]["truck_stop"="yes"]({bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]});
+    );
+    out center qt;
+    """
+
+
+def inspection_stops_query(bbox):
+    return f"""
+    [out:json][timeout:30];
+    (
+        node["highway"="weigh_station"]({bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]});
+        way["highway"="weigh_station"]({bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]});
+    );
+    out center qt;
+    """
+
+
+# Overpass query and default POI name of every category the scheduler stops at
+POI_CATEGORIES = {
+    "fuel_stations": (fuel_stations_query, "Fuel Station"),
+    "rest_stops": (rest_stops_query, "Rest Stop"),
+    "trailer_changes": (trailer_changes_query, "Truck Stop"),
+    "inspection_stops": (inspection_stops_query, "Weigh Station"),
+}
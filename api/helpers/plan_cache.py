@@ -0,0 +1,62 @@
+from hashlib import sha256
+from django.conf import settings
+from api.helpers.tiered_cache import tiered_cache
+import json
+import logging
+import zlib
+
+logger = logging.getLogger(__name__)
+
+
+# Bump whenever routing, POI selection, HOS scheduling or log rendering changes its output.
+# The version namespaces every cache key, so a bump invalidates all memoized plans at once.
+TRIP_ENGINE_VERSION = 6
+
+
+def round_coords(coords, places=4):
+    """Round [lon, lat] pairs (~11 m at 4 places) so near-identical requests share a key."""
+    return [[round(float(lon), places), round(float(lat), places)] for lon, lat in coords]
+
+
+def make_plan_key(kind, *inputs):
+    """Content-addressed cache key: identical planning inputs always hash to the same key."""
+    payload = json.dumps(inputs, sort_keys=True, default=str)
+    return f"trip-plan:{kind}:{sha256(payload.encode()).hexdigest()}"
+
+
+def get_cached_plan(key):
+    return decode_plan(tiered_cache.get(key, version=TRIP_ENGINE_VERSION))
+
+
+async def aget_cached_plan(key):
+    return decode_plan(await tiered_cache.aget(key, version=TRIP_ENGINE_VERSION))
+
+
+def set_cached_plan(key, value):
+    """
+    Store a planning result compressed. Entries above PLAN_CACHE_MAX_ENTRY_BYTES are
+    skipped; everything else is evicted by TTL or Redis' LRU policy.
+    """
+    data = encode_plan(key, value)
+    if data is not None:
+        tiered_cache.set(key, data, timeout=settings.PLAN_CACHE_TIMEOUT, version=TRIP_ENGINE_VERSION)
+
+
+async def aset_cached_plan(key, value):
+    data = encode_plan(key, value)
+    if data is not None:
+        await tiered_cache.aset(key, data, timeout=settings.PLAN_CACHE_TIMEOUT, version=TRIP_ENGINE_VERSION)
+
+
+def decode_plan(cached):
+    if cached is None:
+        return None
+    return json.loads(zlib.decompress(cached).decode())
+
+
+def encode_plan(key, value):
+    data = zlib.compress(json.dumps(value).encode())
+    if len(data) > settings.PLAN_CACHE_MAX_ENTRY_BYTES:
+        logger.info(f"Not caching {key}: {len(data)} bytes exceeds the plan cache entry limit")
+        return None
+    return data
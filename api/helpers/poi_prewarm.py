@@ -0,0 +1,62 @@
+from collections import Counter
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from api.helpers.plan_cache import round_coords
+from api.helpers.overpass import worst_poi_status
+from api.helpers.trip_planner import get_overpass_refs_sync
+from api.models import Trip
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def get_lane(trip):
+    """Current, pickup and dropoff rounded like route cache keys, so one lane has one geometry."""
+    locations = (trip["current_location"], trip["pickup_location"], trip["dropoff_location"])
+    return tuple(tuple(pair) for pair in round_coords([[location["longitude"], location["latitude"]] for location in locations]))
+
+
+def get_popular_lanes(days, limit):
+    """
+    The `limit` lanes with the most planned trips in the last `days` days, each with
+    the id of its latest trip.
+    """
+    trips = (
+        Trip.objects.filter(created_at__gte=timezone.now() - timedelta(days=days), route_data__isnull=False)
+        .order_by("id")
+        .values("id", "current_location", "pickup_location", "dropoff_location")
+    )
+    counts = Counter()
+    latest = {}
+    for trip in trips.iterator(chunk_size=2000):
+        try:
+            lane = get_lane(trip)
+        except (KeyError, TypeError, ValueError):
+            continue
+        counts[lane] += 1
+        latest[lane] = trip["id"]
+    return [(lane, latest[lane]) for lane, _ in counts.most_common(limit)]
+
+
+def prewarm_poi_cache(days=None, limit=None):
+    """
+    Fetch the POIs along the fleet's busiest lanes, so their cache entries are never
+    missing or past the hard TTL when a trip is planned. Batches that are still fresh
+    cost a cache read; those past the soft TTL are refreshed in the background.
+
+    Returns:
+        int: Number of lanes warmed.
+    """
+    days = days or settings.POI_PREWARM_DAYS
+    limit = limit or settings.POI_PREWARM_LANES
+    warmed = 0
+    for lane, trip_id in get_popular_lanes(days, limit):
+        route_data = Trip.objects.filter(id=trip_id).values_list("route_data", flat=True).first()
+        geometry = (route_data or {}).get("geometry")
+        if not geometry:
+            continue
+        refs = get_overpass_refs_sync(geometry)
+        warmed += 1
+        logger.info(f"Prewarmed POIs for lane {lane}: {worst_poi_status(status for _, _, status in refs['batches'])}")
+    return warmed
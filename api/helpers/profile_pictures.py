@@ -0,0 +1,74 @@
+import base64
+import binascii
+import io
+import logging
+import os
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+
+PROFILE_THUMBNAIL_SIZES = (64, 256)
+
+
+def read_uploaded_picture(upload):
+    """
+    Validate an uploaded profile picture and return it as a ContentFile named with its real format.
+
+    Accepts a multipart upload or, for older clients, a base64 data URI string.
+    Raises ValueError if the payload is not a readable image.
+    """
+    if isinstance(upload, str):
+        header, _, encoded = upload.partition(",")
+        try:
+            content = base64.b64decode(encoded or header, validate=True)
+        except (binascii.Error, ValueError):
+            raise ValueError("Invalid Base64 string for profile picture.")
+    else:
+        content = upload.read()
+
+    try:
+        img = Image.open(io.BytesIO(content))
+        img.verify()
+    except Exception as e:
+        raise ValueError(f"Invalid image file: {str(e)}")
+
+    extension = (img.format or "PNG").lower()
+    return ContentFile(content, name=f"picture.{extension}")
+
+
+def delete_profile_picture_files(picture_name, thumbnails):
+    for name in [picture_name, *thumbnails.values()]:
+        if name:
+            default_storage.delete(name)
+
+
+def generate_profile_thumbnails(user_id, picture_name):
+    """
+    Render square WebP thumbnails for a stored profile picture.
+
+    Returns a mapping of size -> storage name.
+    """
+    with default_storage.open(picture_name, "rb") as f:
+        img = Image.open(f)
+        img = ImageOps.exif_transpose(img)
+        img.load()
+
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA")
+
+    # Thumbnails are named after the picture so a newer upload never collides with them
+    stem = os.path.splitext(os.path.basename(picture_name))[0]
+    thumbnails = {}
+    for size in PROFILE_THUMBNAIL_SIZES:
+        thumbnail = ImageOps.fit(img, (size, size), Image.Resampling.LANCZOS)
+        buffered = io.BytesIO()
+        thumbnail.save(buffered, format="WEBP", quality=80)
+        name = f"profile_pictures/thumbnails/{stem}_{size}.webp"
+        thumbnails[str(size)] = default_storage.save(name, ContentFile(buffered.getvalue()))
+
+    logger.info(f"Generated {len(thumbnails)} profile thumbnails for user {user_id}")
+    return thumbnails
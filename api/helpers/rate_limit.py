@@ -0,0 +1,121 @@
+from django.conf import settings
+from django.core.cache import cache
+import logging
+import math
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# Refill by elapsed time (Redis clock, so workers' clocks do not matter), then reserve a
+# token if it becomes available within max_wait. Returns the wait in seconds as a string,
+# since Lua numbers are truncated to integers in replies.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local max_wait = tonumber(ARGV[3])
+local clock = redis.call("TIME")
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call("HMGET", KEYS[1], "tokens", "updated")
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local wait = math.max(0, (1 - tokens) / rate)
+if wait <= max_wait then
+    tokens = tokens - 1
+end
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "updated", tostring(now))
+redis.call("EXPIRE", KEYS[1], math.ceil(capacity / rate + max_wait) + 1)
+return tostring(wait)
+"""
+
+
+class TokenBucket:
+    """
+    Token bucket shared by every worker through Redis: `rate` requests per second
+    with bursts of up to `capacity`.
+
+    With a non-Redis cache backend (local development) the bucket is per process.
+    """
+
+    def __init__(self, name, rate, capacity):
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+        self._script = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def reserve(self, max_wait):
+        """
+        Reserve the next token. Returns the seconds to wait before using it, or None
+        (reserving nothing) when that would take longer than `max_wait`.
+        """
+        if settings.CACHES["default"]["BACKEND"].endswith("RedisCache"):
+            try:
+                wait = float(self._get_script()(keys=[cache.make_key(f"token-bucket:{self.name}")], args=[self.rate, self.capacity, max_wait]))
+            except Exception as e:
+                # Never block upstream calls on a Redis outage; fall back to this process' bucket
+                logger.warning(f"Shared rate limiter {self.name} unavailable: {e}")
+                wait = self._reserve_local(max_wait)
+        else:
+            wait = self._reserve_local(max_wait)
+        return wait if wait <= max_wait else None
+
+    def _get_script(self):
+        # A forked worker cannot reuse its parent's connection
+        if self._pid != os.getpid():
+            import redis
+
+            client = redis.Redis.from_url(settings.CACHES["default"]["LOCATION"])
+            self._script = client.register_script(TOKEN_BUCKET_SCRIPT)
+            self._pid = os.getpid()
+        return self._script
+
+    def _reserve_local(self, max_wait):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = max(0.0, (1 - self._tokens) / self.rate)
+            if wait <= max_wait:
+                self._tokens -= 1
+            return wait
+
+
+class AdaptiveBackoff:
+    """
+    Shared pause after an upstream signals overload (429, 504). Each consecutive
+    signal doubles the pause, up to `maximum` seconds, unless the upstream sent a
+    Retry-After. A successful call resets it.
+    """
+
+    def __init__(self, name, base, maximum):
+        self.base = base
+        self.maximum = maximum
+        self.until_key = f"backoff:{name}:until"
+        self.level_key = f"backoff:{name}:level"
+
+    def remaining(self):
+        """Seconds until the upstream may be called again."""
+        until = cache.get(self.until_key)
+        return max(0.0, until - time.time()) if until else 0.0
+
+    def trigger(self, retry_after=None):
+        # The level outlives the pause, so an overload right after it doubles the next one
+        cache.add(self.level_key, 0, timeout=math.ceil(self.maximum * 4))
+        try:
+            level = cache.incr(self.level_key)
+        except ValueError:
+            level = 1
+        delay = min(self.maximum, retry_after if retry_after else self.base * 2 ** (level - 1))
+        cache.set(self.until_key, time.time() + delay, timeout=math.ceil(delay))
+        return delay
+
+    def reset(self):
+        if cache.get(self.level_key):
+            cache.delete_many([self.until_key, self.level_key])
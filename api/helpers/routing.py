@@ -0,0 +1,97 @@
+from django.conf import settings
+from api.helpers.http_session import get_session
+from api.helpers.plan_cache import aget_cached_plan, aset_cached_plan, get_cached_plan, make_plan_key, round_coords, set_cached_plan
+from api.helpers.single_flight import asingle_flight, single_flight
+import aiohttp
+import logging
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+def fetch_route(coords):
+    """
+    Fetch a driving route through `coords` ([lon, lat] pairs) from OpenRouteService.
+
+    Results are memoized on the rounded coordinates, so planning the same lane again
+    skips the ORS round trip.
+
+    Returns:
+        dict: distance (km), duration (hours), geometry ([lon, lat] pairs) and
+        steps ([first, last geometry index, duration in seconds] per ORS step).
+
+    Raises:
+        requests.exceptions.RequestException: If ORS cannot be reached or rejects the request.
+    """
+    cache_key = make_plan_key("route", round_coords(coords))
+    route = get_cached_plan(cache_key)
+    if route is not None:
+        logger.info("Route cache hit, skipping OpenRouteService")
+        return route
+
+    # Concurrent plans of the same lane share one ORS request
+    return single_flight(
+        cache_key,
+        lambda: request_route(coords, cache_key),
+        lambda: get_cached_plan(cache_key),
+        lease=settings.ORS_SINGLE_FLIGHT_LEASE,
+        wait=settings.ORS_SINGLE_FLIGHT_WAIT,
+    )
+
+
+def request_route(coords, cache_key):
+    headers = {"Authorization": settings.ORS_API_KEY}
+    body = {"coordinates": coords}
+    response = requests.post(settings.ORS_URL, json=body, headers=headers, timeout=settings.ORS_REQUEST_TIMEOUT)
+    response.raise_for_status()
+    route = parse_route(response.json())
+    set_cached_plan(cache_key, route)
+    return route
+
+
+async def afetch_route(coords):
+    """
+    Async variant of fetch_route for the ASGI views, sharing its cache entries.
+
+    Raises:
+        aiohttp.ClientError: If ORS cannot be reached or rejects the request.
+    """
+    cache_key = make_plan_key("route", round_coords(coords))
+    route = await aget_cached_plan(cache_key)
+    if route is not None:
+        logger.info("Route cache hit, skipping OpenRouteService")
+        return route
+
+    return await asingle_flight(
+        cache_key,
+        lambda: arequest_route(coords, cache_key),
+        lambda: aget_cached_plan(cache_key),
+        lease=settings.ORS_SINGLE_FLIGHT_LEASE,
+        wait=settings.ORS_SINGLE_FLIGHT_WAIT,
+    )
+
+
+async def arequest_route(coords, cache_key):
+    headers = {"Authorization": settings.ORS_API_KEY}
+    body = {"coordinates": coords}
+    timeout = aiohttp.ClientTimeout(total=settings.ORS_REQUEST_TIMEOUT)
+    async with get_session().post(settings.ORS_URL, json=body, headers=headers, timeout=timeout) as response:
+        response.raise_for_status()
+        route = parse_route(await response.json(content_type=None))
+    await aset_cached_plan(cache_key, route)
+    return route
+
+
+def parse_route(route_data):
+    feature = route_data["features"][0]
+    return {
+        "distance": feature["properties"]["summary"]["distance"] / 1000,
+        "duration": feature["properties"]["summary"]["duration"] / 3600,
+        "geometry": feature["geometry"]["coordinates"],
+        # [first, last geometry index, seconds] per ORS step, for the engine's speed profile
+        "steps": [
+            [step["way_points"][0], step["way_points"][1], step["duration"]]
+            for segment in feature["properties"].get("segments", [])
+            for step in segment.get("steps", [])
+        ],
+    }
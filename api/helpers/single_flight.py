@@ -0,0 +1,87 @@
+from django.conf import settings
+from django.core.cache import cache
+from api.helpers.leases import aacquire_lease, acquire_lease, aget_lease_holder, arelease_lease, get_lease_holder, release_lease
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def single_flight(key, fetch, read_cache, lease, wait):
+    """
+    Deduplicate an upstream request across workers.
+
+    The first caller takes a Redis lease on `key` for `lease` seconds and runs
+    `fetch`, which is expected to populate the cache. Concurrent callers poll
+    `read_cache` for up to `wait` seconds until the result appears. A result the
+    leader returned but `read_cache` does not find, such as a stale fallback, is
+    kept briefly for its waiters rather than refetched by each of them. Waiters
+    only run their own `fetch` when the leader failed or died, or `wait` elapses.
+    Size `lease` to outlast the leader's slowest fetch from that upstream.
+    """
+    lock_key = f"single-flight:{key}"
+    token = acquire_lease(lock_key, lease)
+    if token:
+        try:
+            result = fetch()
+            if result is not None and read_cache() is None:
+                cache.set(get_result_key(key, token), result, timeout=settings.SINGLE_FLIGHT_RESULT_TIMEOUT)
+            return result
+        finally:
+            release_lease(lock_key, token)
+
+    logger.info(f"Waiting for in-flight request {key}")
+    holder = get_lease_holder(lock_key)
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        time.sleep(settings.SINGLE_FLIGHT_POLL_INTERVAL)
+        result = read_cache()
+        if result is not None:
+            return result
+        current = get_lease_holder(lock_key)
+        if current != holder:
+            result = cache.get(get_result_key(key, holder)) if holder else None
+            if result is not None:
+                return result
+            if current is None:
+                break
+            holder = current
+    return fetch()
+
+
+async def asingle_flight(key, fetch, read_cache, lease, wait):
+    """Async variant of single_flight; `fetch` and `read_cache` are coroutine functions."""
+    lock_key = f"single-flight:{key}"
+    token = await aacquire_lease(lock_key, lease)
+    if token:
+        try:
+            result = await fetch()
+            if result is not None and await read_cache() is None:
+                await cache.aset(get_result_key(key, token), result, timeout=settings.SINGLE_FLIGHT_RESULT_TIMEOUT)
+            return result
+        finally:
+            await arelease_lease(lock_key, token)
+
+    logger.info(f"Waiting for in-flight request {key}")
+    holder = await aget_lease_holder(lock_key)
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        await asyncio.sleep(settings.SINGLE_FLIGHT_POLL_INTERVAL)
+        result = await read_cache()
+        if result is not None:
+            return result
+        current = await aget_lease_holder(lock_key)
+        if current != holder:
+            result = await cache.aget(get_result_key(key, holder)) if holder else None
+            if result is not None:
+                return result
+            if current is None:
+                break
+            holder = current
+    return await fetch()
+
+
+def get_result_key(key, token):
+    """The value returned by the leader holding `token`, kept for its waiters."""
+    return f"single-flight-result:{key}:{token}"
@@ -0,0 +1,192 @@
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import cache
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class LocalLRUCache:
+    """Bounded in-process LRU with a per-entry TTL and hit/miss/eviction counters."""
+
+    def __init__(self, max_entries, max_bytes, timeout):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def set(self, key, value, timeout=None):
+        size = len(value) if isinstance(value, (bytes, bytearray, memoryview)) else sys.getsizeof(value)
+        if size > self.max_bytes:
+            return
+        timeout = self.timeout if timeout is None else min(timeout, self.timeout)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + timeout, size, value)
+            self.bytes += size
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _remove(self, key):
+        self.bytes -= self._entries.pop(key)[1]
+
+
+class TieredCache:
+    """
+    Per-process LRU layered in front of the shared Django cache.
+
+    Reads try worker memory first and fall back to Redis, keeping what they find.
+    Writes go to both. When LOCAL_CACHE_INVALIDATION_CHANNEL is set, every write or
+    delete is published so other processes drop their local copy of the key.
+    """
+
+    def __init__(self, backend, local):
+        self.backend = backend
+        self.local = local
+        self.instance_id = None
+        self._client = None
+        self._pid = None
+        self._failed_pid = None
+        self._retry_at = 0
+        self._subscribe_lock = threading.Lock()
+
+    def get(self, key, version=None):
+        self._listen_for_invalidations()
+        local_key = self.backend.make_key(key, version)
+        value = self.local.get(local_key)
+        if value is None:
+            value = self.backend.get(key, version=version)
+            if value is not None:
+                self.local.set(local_key, value)
+        return value
+
+    async def aget(self, key, version=None):
+        self._listen_for_invalidations()
+        local_key = self.backend.make_key(key, version)
+        value = self.local.get(local_key)
+        if value is None:
+            value = await self.backend.aget(key, version=version)
+            if value is not None:
+                self.local.set(local_key, value)
+        return value
+
+    def set(self, key, value, timeout, version=None):
+        self.backend.set(key, value, timeout=timeout, version=version)
+        self._store_local(key, value, timeout, version)
+
+    async def aset(self, key, value, timeout, version=None):
+        await self.backend.aset(key, value, timeout=timeout, version=version)
+        self._store_local(key, value, timeout, version)
+
+    def delete(self, key, version=None):
+        self.backend.delete(key, version=version)
+        local_key = self.backend.make_key(key, version)
+        self.local.delete(local_key)
+        self._publish(local_key)
+
+    def stats(self):
+        return self.local.stats()
+
+    def _store_local(self, key, value, timeout, version):
+        local_key = self.backend.make_key(key, version)
+        self.local.set(local_key, value, timeout)
+        self._publish(local_key)
+
+    def _publish(self, local_key):
+        if not self._listen_for_invalidations():
+            return
+        try:
+            self._client.publish(settings.LOCAL_CACHE_INVALIDATION_CHANNEL, f"{self.instance_id}:{local_key}")
+        except Exception as e:
+            logger.warning(f"Could not publish cache invalidation for {local_key}: {e}")
+
+    def _listen_for_invalidations(self):
+        """
+        Subscribe to the invalidation channel on first use in each process, since a
+        forked worker inherits neither the subscriber thread nor a usable connection.
+        A failed subscription is retried after LOCAL_CACHE_SUBSCRIBE_RETRY_SECONDS, so
+        a Redis outage does not add a connect attempt to every cache read.
+        """
+        channel = settings.LOCAL_CACHE_INVALIDATION_CHANNEL
+        if not channel:
+            return False
+        pid = os.getpid()
+        if self._pid != pid:
+            if self._failed_pid == pid and time.monotonic() < self._retry_at:
+                return False
+            with self._subscribe_lock:
+                if self._pid != pid:
+                    if self._failed_pid == pid and time.monotonic() < self._retry_at:
+                        return False
+                    try:
+                        import redis
+
+                        client = redis.Redis.from_url(settings.CACHES["default"]["LOCATION"])
+                        pubsub = client.pubsub(ignore_subscribe_messages=True)
+                        pubsub.subscribe(**{channel: self._on_invalidation})
+                        pubsub.run_in_thread(sleep_time=1, daemon=True)
+                        self.instance_id = uuid.uuid4().hex
+                        self._client = client
+                        self._pid = pid
+                    except Exception as e:
+                        logger.warning(f"Could not subscribe to cache invalidations: {e}")
+                        self._failed_pid = pid
+                        self._retry_at = time.monotonic() + settings.LOCAL_CACHE_SUBSCRIBE_RETRY_SECONDS
+                        return False
+        return True
+
+    def _on_invalidation(self, message):
+        sender, _, local_key = message["data"].decode().partition(":")
+        if sender != self.instance_id:
+            self.local.delete(local_key)
+
+
+tiered_cache = TieredCache(cache, LocalLRUCache(
+    max_entries=settings.LOCAL_CACHE_MAX_ENTRIES,
+    max_bytes=settings.LOCAL_CACHE_MAX_BYTES,
+    timeout=settings.LOCAL_CACHE_TIMEOUT,
+))
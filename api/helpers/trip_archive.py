@@ -0,0 +1,121 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from api.models import ArchivedTrip, Trip
+import json
+import logging
+import zlib
+
+logger = logging.getLogger(__name__)
+
+
+# Trip columns kept in the compressed payload. Log sheets are kept as signed off: a
+# re-render would print the driver's current truck, trailer and driver numbers.
+ARCHIVED_FIELDS = (
+    "current_location", "pickup_location", "dropoff_location", "current_cycle_hours",
+    "route_data", "log_sheets", "idempotency_key", "idempotency_fingerprint",
+)
+
+
+def encode_trip(trip):
+    payload = {name: getattr(trip, name) for name in ARCHIVED_FIELDS}
+    return zlib.compress(json.dumps(payload, separators=(",", ":")).encode(), settings.TRIP_ARCHIVE_COMPRESSION_LEVEL)
+
+
+def restore_trip(archived, user=None):
+    """
+    Rebuild an unsaved, read-only Trip from its archive row, so serializers and the
+    log sheet views handle it like any other trip.
+    """
+    payload = json.loads(zlib.decompress(archived.payload))
+    # Trips archived before log sheets were kept are re-rendered on request
+    payload.setdefault("log_sheets", [])
+    # Archived before updated_at had its own column
+    payload.pop("updated_at", None)
+    trip = Trip(
+        id=archived.id,
+        user_id=archived.user_id,
+        created_at=archived.created_at,
+        updated_at=archived.updated_at,
+        **payload,
+    )
+    if user is not None:
+        trip.user = user
+    return trip
+
+
+def get_archive_cutoff():
+    """Trips created before this are moved to the archive, None when archiving is off."""
+    if not settings.TRIP_ARCHIVE_AFTER_DAYS:
+        return None
+    return timezone.now() - timedelta(days=settings.TRIP_ARCHIVE_AFTER_DAYS)
+
+
+def get_user_trip(trip_id, user):
+    """A trip of `user` from the hot table or, failing that, the archive, or None."""
+    trip = Trip.objects.filter(id=trip_id, user=user).first()
+    if trip is not None:
+        trip.user = user
+        return trip
+    archived = ArchivedTrip.objects.filter(id=trip_id, user=user).first()
+    return restore_trip(archived, user) if archived is not None else None
+
+
+def get_archived_trips(user, start=None, end=None):
+    """
+    Archive rows of `user`'s trips created in [start, end) (all of them by default),
+    newest first. Their payloads are not loaded; id, created_at and updated_at are
+    enough to list and version them, and restore_archived_trips loads the rest.
+    """
+    cutoff = get_archive_cutoff()
+    if cutoff is None or (start is not None and start >= cutoff):
+        return []
+    archived = ArchivedTrip.objects.filter(user=user).order_by("-created_at").defer("payload")
+    if start is not None:
+        archived = archived.filter(created_at__gte=start, created_at__lt=end)
+    return list(archived)
+
+
+def restore_archived_trips(archived, user):
+    """Restore the rows returned by get_archived_trips, loading their payloads in one query."""
+    if not archived:
+        return []
+    rows = ArchivedTrip.objects.filter(id__in=[trip.id for trip in archived]).order_by("-created_at")
+    return [restore_trip(trip, user) for trip in rows]
+
+
+def archive_old_trips(batch_size=None):
+    """
+    Move trips older than TRIP_ARCHIVE_AFTER_DAYS into ArchivedTrip, one transaction
+    per batch. Returns the number of trips archived.
+    """
+    cutoff = get_archive_cutoff()
+    if cutoff is None:
+        return 0
+
+    batch_size = batch_size or settings.TRIP_ARCHIVE_BATCH_SIZE
+    archived = 0
+    while True:
+        with transaction.atomic():
+            # Ids grow with created_at, so walking the primary key finds old trips without a created_at index
+            trips = list(
+                Trip.objects.select_for_update(skip_locked=True)
+                .filter(created_at__lt=cutoff)
+                .order_by("id")[:batch_size]
+            )
+            if not trips:
+                break
+            ArchivedTrip.objects.bulk_create([
+                ArchivedTrip(
+                    id=trip.id, user_id=trip.user_id, created_at=trip.created_at, updated_at=trip.updated_at,
+                    payload=encode_trip(trip),
+                )
+                for trip in trips
+            ])
+            Trip.objects.filter(id__in=[trip.id for trip in trips]).delete()
+        archived += len(trips)
+        logger.info(f"Archived {archived} trips created before {cutoff.isoformat()}")
+        if len(trips) < batch_size:
+            break
+    return archived
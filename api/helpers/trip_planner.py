@@ -1,160 +1,33 @@
 from datetime import timedelta
+from types import SimpleNamespace
 from django.conf import settings
+from django.utils import timezone
 import base64
+import inspect
 import io
 import math
-import base64
 from PIL import Image, ImageDraw
 from api.models import Trip
+from api.helpers.plan_cache import get_cached_plan, make_plan_key, round_coords, set_cached_plan
+from api.helpers.overpass import POI_CATEGORIES, POI_OK, POI_UNAVAILABLE, decode_pois, fallback_pois, fetch_overpass_data, get_poi_cache_key, to_poi_list, worst_poi_status
+from api.helpers.http_session import get_session, run_async
+from api.helpers.hos_scheduler import schedule_route
+from api.helpers.tiered_cache import tiered_cache
 import asyncio
-import aiohttp
-import zlib
-from hashlib import md5
-from django.core.cache import cache
-import json
 import logging
 import numpy as np
 
 logger = logging.getLogger(__name__)
 
 
-OVERPASS_URL = "http://overpass-api.de/api/interpreter"
-
-async def fetch_overpass_data(session, query, cache_timeout=86400):
-    """
-    Asynchronously fetches data from the Overpass API with caching.
-
-    Args:
-        session (aiohttp.ClientSession): The session to use for the request.
-        query (str): The Overpass query.
-        cache_timeout (int): Cache duration in seconds (default: 24 hours).
-
-    Returns:
-        dict: Parsed JSON response or empty result if request fails.
-    """
-
-    # Generate cache key based on the query
-    cache_key = md5(query.encode()).hexdigest()
-
-    # Check if data exists in cache
-    cached_result = await cache.aget(cache_key)
-    if cached_result:
-        logger.info(f"Cache hit! {query} Returning cached data.")
-        decompressed_data = zlib.decompress(cached_result).decode()
-        return json.loads(decompressed_data)
-
-    headers = {"Content-Type": "application/x-www-form-urlencoded"}
-    try:
-        async with session.post(OVERPASS_URL, data=query, headers=headers) as response:
-            response.raise_for_status()
-            data = await response.text()
-            json_data = json.loads(data)
-
-            # Cache compressed response as a string
-            await cache.aset(cache_key, zlib.compress(data.encode()), timeout=cache_timeout)
-            logger.info(f"No cache! {query} Returning API Data.")
-            return json_data
-
-    except aiohttp.ClientError as e:
-        logger.error(f"Overpass API request failed: {e}")
-        return {"elements": []}
-
-async def get_fuel_stations_data(bbox, session):
-    overpass_query_fuel = f"""
-    [out:json][timeout:30];
-    (
-        node["amenity"="fuel"]({bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]});
-        way["amenity"="fuel"]({bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]});
-        node["highway"="services"]["fuel"="yes"]({bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]});
-        way["highway"="services"]["fuel"="yes"]({bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]});
-    );
-    out center qt;
+def get_route_bboxes(geometry):
     """
-
-    data = await fetch_overpass_data(session, overpass_query_fuel)
-
-    return [
-        {
-            "lat": element.get('center', {}).get('lat') if 'center' in element else element['lat'],
-            "lon": element.get('center', {}).get('lon') if 'center' in element else element['lon'],
-            "location": element.get('tags', {}).get('name', 'Fuel Station'),
-            "distance": 0.0
-        }
-        for element in data.get('elements', [])
-    ]
-
-async def get_rest_stops_data(bbox, session):
-    overpass_query_rest = f"""
-    [out:json][timeout:30];
-    (
-        node["highway"="rest_area"]({bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]});
-        way["highway"="rest_area"]({bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]});
-        node["amenity"="rest_area"]({bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]});
-        way["amenity"="rest_area"]({bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]});
-        node["highway"="services"]["rest_area"="yes"]({bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]});
-        way["highway"="services"]["rest_area"="yes"]({bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]});
-    );
-    out center qt;
+    Bounding boxes (south, west, north, east) of the route in sections of about 500 miles,
+    or longer ones on routes that would need more than OVERPASS_MAX_ROUTE_SECTIONS.
     """
-
-    data = await fetch_overpass_data(session, overpass_query_rest)
-    return [
-        {
-            "lat": element.get('center', {}).get('lat') if 'center' in element else element['lat'],
-            "lon": element.get('center', {}).get('lon') if 'center' in element else element['lon'],
-            "location": element.get('tags', {}).get('name', 'Rest Stop'),
-            "distance": 0.0
-        }
-        for element in data.get('elements', [])
-    ]
-
-async def get_trailer_changes_data(bbox, session):
-    overpass_query_trailer = f"""
-    [out:json][timeout:30];
-    (
-        node["amenity"="truck_stop"]({bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]});
-        way["amenity"="truck_stop"]({bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]});
-        node["highway"="services"]["truck_stop"="yes"]({bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]});
-        way["highway"="services"]["truck_stop"="yes"]({bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]});
-    );
-    out center qt;
-    """
-
-    data = await fetch_overpass_data(session, overpass_query_trailer)
-    return [
-        {
-            "lat": element.get('center', {}).get('lat') if 'center' in element else element['lat'],
-            "lon": element.get('center', {}).get('lon') if 'center' in element else element['lon'],
-            "location": element.get('tags', {}).get('name', 'Truck Stop'),
-            "distance": 0.0
-        }
-        for element in data.get('elements', [])
-    ]
-
-async def get_inspection_stops_data(bbox, session):
-    overpass_query_inspection = f"""
-    [out:json][timeout:30];
-    (
-        node["highway"="weigh_station"]({bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]});
-        way["highway"="weigh_station"]({bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]});
-    );
-    out center qt;
-    """
-
-    data = await fetch_overpass_data(session, overpass_query_inspection)
-    return [
-        {
-            "lat": element.get('center', {}).get('lat') if 'center' in element else element['lat'],
-            "lon": element.get('center', {}).get('lon') if 'center' in element else element['lon'],
-            "location": element.get('tags', {}).get('name', 'Weigh Station'),
-            "distance": 0.0
-        }
-        for element in data.get('elements', [])
-    ]
-
-async def get_overpass_data(geometry):
-    # Segment the route into smaller sections (e.g., every 500 miles)
-    segment_length = 500 * 1.60934 
+    # Same units as the section loop below
+    route_length = sum(haversine(*geometry[i - 1], *geometry[i]) for i in range(1, len(geometry)))
+    segment_length = max(500 * 1.60934, route_length / settings.OVERPASS_MAX_ROUTE_SECTIONS)
     segments = []
     current_segment = []
     current_distance = 0
@@ -172,43 +45,71 @@ async def get_overpass_data(geometry):
             current_segment = [geometry[i]]
             current_distance = 0
 
-    # Fetch stops for each segment
-    all_fuel_stations = []
-    all_rest_stops = []
-    all_trailer_changes = []
-    all_inspection_stops = []
-    async with aiohttp.ClientSession() as session:
-        for segment in segments:
-            lats = [coord[1] for coord in segment]
-            lons = [coord[0] for coord in segment]
-            bbox = (min(lats), min(lons), max(lats), max(lons))
-
-            fuel_task = get_fuel_stations_data(bbox, session)
-            rest_task = get_rest_stops_data(bbox, session)
-            trailer_task = get_trailer_changes_data(bbox, session)
-            inspection_task = get_inspection_stops_data(bbox, session)
-
-            fuel_stations, rest_stops, trailer_changes, inspection_stops = await asyncio.gather(
-                fuel_task, rest_task, trailer_task, inspection_task
-            )
-
-            all_fuel_stations.extend(fuel_stations)
-            all_rest_stops.extend(rest_stops)
-            all_trailer_changes.extend(trailer_changes)
-            all_inspection_stops.extend(inspection_stops)
+    bboxes = []
+    for segment in segments:
+        lats = [coord[1] for coord in segment]
+        lons = [coord[0] for coord in segment]
+        bboxes.append((min(lats), min(lons), max(lats), max(lons)))
+    return bboxes
+
+
+async def fetch_route_pois(geometry):
+    """Packed POI batches along the route, as (category, query, batch) with each batch's status."""
+    session = get_session()
+    batches = []
+    for bbox in get_route_bboxes(geometry):
+        queries = [(category, build_query(bbox)) for category, (build_query, _) in POI_CATEGORIES.items()]
+        results = await asyncio.gather(*(fetch_overpass_data(session, query) for _, query in queries))
+        batches.extend((category, query, pois) for (category, query), pois in zip(queries, results))
+    return batches
+
+
+def collect_pois(batches):
+    """Merge (category, packed batch) pairs into the POI lists index_route takes."""
+    overpass_data = {category: [] for category in POI_CATEGORIES}
+    statuses = []
+    for category, pois in batches:
+        overpass_data[category].extend(to_poi_list(pois, POI_CATEGORIES[category][1]))
+        statuses.append(pois["status"])
+    # POI_OK, or POI_STALE/POI_UNAVAILABLE when some batch could not be fetched
+    overpass_data["status"] = worst_poi_status(statuses)
+    return overpass_data
+
+
+async def get_overpass_data(geometry):
+    batches = await fetch_route_pois(geometry)
+    return collect_pois((category, pois) for category, _, pois in batches)
 
-    return {
-        "fuel_stations": all_fuel_stations,
-        "rest_stops": all_rest_stops,
-        "trailer_changes": all_trailer_changes,
-        "inspection_stops": all_inspection_stops
-    }
 
 def get_overpass_data_sync(geometry):
-    overpass_data = asyncio.run(get_overpass_data(geometry))
+    overpass_data = run_async(get_overpass_data(geometry))
     return overpass_data
 
 
+def get_overpass_refs_sync(geometry):
+    """
+    Fetch the POIs along the route into the cache and return references to them:
+    a corridor has thousands of POIs, too many to pass between pipeline stages.
+    """
+    batches = run_async(fetch_route_pois(geometry))
+    return {"batches": [[category, get_poi_cache_key(query), pois["status"]] for category, query, pois in batches]}
+
+
+def load_overpass_refs(refs):
+    """POI lists from get_overpass_refs_sync references, or None if a batch left the cache since."""
+    batches = []
+    for category, cache_key, status in refs["batches"]:
+        if status == POI_UNAVAILABLE:
+            # Never cached: an empty batch
+            pois = fallback_pois(None)
+        else:
+            cached = tiered_cache.get(cache_key)
+            if cached is None:
+                return None
+            pois = decode_pois(cached)
+        batches.append((category, {**pois, "status": status}))
+    return collect_pois(batches)
+
 
 def preprocess_geometry(geometry):
     """Precomputes segment midpoints and cumulative distances."""
@@ -232,42 +133,82 @@ def preprocess_geometry(geometry):
     return np.array(midpoints), segment_distances
 
 
-def find_nearest_midpoint(midpoints, poi_lon, poi_lat):
-    distances = np.sqrt((midpoints[:, 0] - poi_lon)**2 + (midpoints[:, 1] - poi_lat)**2)
-    nearest_idx = np.argmin(distances)
-    return nearest_idx
+def project_pois(midpoints, segment_distances, pois, chunk_size=16):
+    """
+    Route mile of every POI: the start of the segment whose midpoint is nearest.
 
+    Vectorized over small blocks of POIs so the distance matrix stays cache-sized.
+    """
+    coords = np.array([[poi["lon"], poi["lat"]] for poi in pois], dtype=float).reshape(-1, 2)
+    mid_lons = np.ascontiguousarray(midpoints[:, 0]) if len(midpoints) else np.empty(0)
+    mid_lats = np.ascontiguousarray(midpoints[:, 1]) if len(midpoints) else np.empty(0)
+    segment_distances = np.asarray(segment_distances)
+
+    miles = np.empty(len(coords))
+    for start in range(0, len(coords), chunk_size):
+        block = coords[start:start + chunk_size]
+        squared = np.subtract.outer(block[:, 0], mid_lons)
+        squared *= squared
+        lat_diff = np.subtract.outer(block[:, 1], mid_lats)
+        lat_diff *= lat_diff
+        squared += lat_diff
+        miles[start:start + chunk_size] = segment_distances[squared.argmin(axis=1)]
+    return miles.tolist()
+
+
+def as_location(coords):
+    """Accept either a {"latitude", "longitude"} dict (Celery payloads) or an object with those attributes."""
+    if isinstance(coords, dict):
+        return SimpleNamespace(latitude=float(coords["latitude"]), longitude=float(coords["longitude"]))
+    return coords
+
+
+def plan_trip(distance, duration, current_cycle_hours, geometry, pickup_coords, start_coords, end_coords,
+              scaling_interval=500, break_timing=6, pre_trip_duration=0.5, post_trip_duration=1.5,
+              fueling_duration=0.5, loading_duration=0.5, unloading_duration=0.5, rest_break_duration=0.5,
+              overpass_data=None, steps=None):
+    """
+    Fetch POIs along the route and schedule HOS-compliant stops.
 
-def calculate_trip(trip_id, distance, duration, current_cycle_hours, geometry, pickup_coords, start_coords, end_coords,
-                   scaling_interval=500, break_timing=6, pre_trip_duration=0.5, post_trip_duration=1.5,
-                   fueling_duration=0.5, loading_duration=0.5, unloading_duration=0.5, rest_break_duration=0.5):
-    distance_miles = distance * 0.621371
-    
-    speed_mph = 60
-    driving_hours = distance_miles / speed_mph
-    total_on_duty_hours = driving_hours
-
-    stops = []
-    current_miles = 0
-    current_driving_hours = 0
-    current_window_hours = 0
-    current_cycle = current_cycle_hours
-    day = 1
-    time_in_day = 0
-    split_sleeper_used = False
+    `overpass_data` (as returned by get_overpass_data) skips the fetch when the POIs
+    were already loaded by an earlier pipeline stage. `steps` are the ORS step
+    durations from fetch_route; without them a constant 60 mph is assumed.
 
+    Returns:
+        dict: stops, total_days, total_on_duty_hours, distance_miles and poi_status.
+    """
+    if overpass_data is None:
+        overpass_data = get_overpass_data_sync(geometry)
+
+    route = index_route(geometry, pickup_coords, start_coords, overpass_data, steps)
+    plan = schedule_route(
+        route, distance, current_cycle_hours, pickup_coords, start_coords, end_coords,
+        scaling_interval=scaling_interval,
+        break_timing=break_timing,
+        pre_trip_duration=pre_trip_duration,
+        post_trip_duration=post_trip_duration,
+        fueling_duration=fueling_duration,
+        loading_duration=loading_duration,
+        unloading_duration=unloading_duration,
+        rest_break_duration=rest_break_duration,
+    )
+    plan["poi_status"] = overpass_data.get("status", POI_OK)
+    return plan
+
+
+def index_route(geometry, pickup_coords, start_coords, overpass_data, steps=None):
+    """
+    Precompute everything about a route that does not depend on HOS parameters:
+    cumulative miles along the geometry, the driving-time profile, the route mile
+    of every POI (sorted per category) and the mile of the pickup, or None when it
+    is the start.
+    """
     # Calculate cumulative distances along the geometry
     geometry_distances = [0]
     for i in range(1, len(geometry)):
         lon1, lat1 = geometry[i-1]
         lon2, lat2 = geometry[i]
-        distance_km = haversine(lon1, lat1, lon2, lat2)
-        distance_miles_segment = distance_km * 0.621371
-        geometry_distances.append(geometry_distances[-1] + distance_miles_segment)
-
-    total_route_miles = geometry_distances[-1]
-
-    overpass_data = get_overpass_data_sync(geometry)
+        geometry_distances.append(geometry_distances[-1] + haversine(lon1, lat1, lon2, lat2))
 
     fuel_stations = overpass_data['fuel_stations']
     rest_stops = overpass_data['rest_stops']
@@ -278,10 +219,8 @@ def calculate_trip(trip_id, distance, duration, current_cycle_hours, geometry, p
 
     midpoints, segment_distances = preprocess_geometry(geometry)
 
-    for poi in pois:
-        poi_lat, poi_lon = poi['lat'], poi['lon']
-        nearest_idx = find_nearest_midpoint(midpoints, poi_lon, poi_lat)
-        poi['distance'] = segment_distances[nearest_idx]
+    for poi, miles in zip(pois, project_pois(midpoints, segment_distances, pois)):
+        poi['distance'] = miles
 
     fuel_stations.sort(key=lambda x: x['distance'])
     rest_stops.sort(key=lambda x: x['distance'])
@@ -294,37 +233,8 @@ def calculate_trip(trip_id, distance, duration, current_cycle_hours, geometry, p
         abs(start_coords.longitude - pickup_coords.longitude) < 0.0001
     )
 
-    #Add the start point with a pre-trip inspection
-    if is_start_pickup_same:
-        stops.append({
-            "location": "Start/Pickup",
-            "activity": "Pre-trip & TI",
-            "time": time_in_day,
-            "duty_status": "on_duty_not_driving",
-            "duration": pre_trip_duration,
-            "lat": start_coords.latitude,
-            "lon": start_coords.longitude,
-            "miles_traveled": current_miles
-        })
-        total_on_duty_hours += pre_trip_duration
-        time_in_day += pre_trip_duration
-        current_window_hours += pre_trip_duration
-    else:
-        stops.append({
-            "location": "Start",
-            "activity": "Pre-trip & TI",
-            "time": time_in_day,
-            "duty_status": "on_duty_not_driving",
-            "duration": pre_trip_duration,
-            "lat": start_coords.latitude,
-            "lon": start_coords.longitude,
-            "miles_traveled": current_miles
-        })
-        total_on_duty_hours += pre_trip_duration
-        time_in_day += pre_trip_duration
-        current_window_hours += pre_trip_duration
-
-        # Calculate distance to pickup and add pickup stop
+    pickup_miles = None
+    if not is_start_pickup_same:
         pickup_index = None
         for i, coord in enumerate(geometry):
             if abs(coord[0] - pickup_coords.longitude) < 0.0001 and abs(coord[1] - pickup_coords.latitude) < 0.0001:
@@ -332,313 +242,60 @@ def calculate_trip(trip_id, distance, duration, current_cycle_hours, geometry, p
                 break
         if pickup_index is None:
             pickup_index = 1
-        start_to_pickup_miles = geometry_distances[pickup_index]
-        current_miles = start_to_pickup_miles
-        hours_to_pickup = start_to_pickup_miles / speed_mph
-        total_on_duty_hours += hours_to_pickup
-        time_in_day += hours_to_pickup
-        current_window_hours += hours_to_pickup
-        current_driving_hours += hours_to_pickup
-
-        stops.append({
-            "location": "Pickup",
-            "activity": "Loading",
-            "time": time_in_day,
-            "duty_status": "on_duty_not_driving",
-            "duration": loading_duration,
-            "lat": pickup_coords.latitude,
-            "lon": pickup_coords.longitude,
-            "miles_traveled": current_miles
-        })
-        total_on_duty_hours += loading_duration
-        time_in_day += loading_duration
-        current_window_hours += loading_duration
-
-    #Add real fueling, scaling, rest, trailer change, and inspection stops
-    fuel_index = 0
-    rest_index = 0
-    trailer_index = 0
-    inspection_index = 0
-    last_fuel_miles = -1000
-    last_scaling_miles = -scaling_interval
-    last_trailer_miles = -600
-    last_inspection_miles = -300
-    last_rest_miles = -8 * speed_mph
-    last_break_time = time_in_day
-
-    while current_miles < distance_miles:
-        # Check for 70-hour rule (restart)
-        if current_cycle + total_on_duty_hours >= 70:
-            stop_coords = get_coords_at_distance(current_miles, geometry, geometry_distances, total_route_miles)
-            stops.append({
-                "location": "Restart",
-                "activity": "34-hour Restart",
-                "time": time_in_day,
-                "duty_status": "off_duty",
-                "duration": 34,
-                "lat": stop_coords["lat"],
-                "lon": stop_coords["lon"],
-                "miles_traveled": current_miles
-            })
-            time_in_day += 34
-            current_cycle = 0
-            current_window_hours = 0
-            current_driving_hours = 0
-            last_break_time = time_in_day
-            split_sleeper_used = False
-            if time_in_day >= 24:
-                day += int(time_in_day // 24)
-                time_in_day = time_in_day % 24
-
-        # Check for fueling stop (every 1000 miles)
-        if current_miles - last_fuel_miles >= 1000 and fuel_index < len(fuel_stations):
-            fuel_stop = fuel_stations[fuel_index]
-            if fuel_stop['distance'] <= current_miles:
-                stops.append({
-                    "location": fuel_stop['location'],
-                    "activity": "Fueling",
-                    "time": time_in_day,
-                    "duty_status": "on_duty_not_driving",
-                    "duration": fueling_duration,
-                    "lat": fuel_stop['lat'],
-                    "lon": fuel_stop['lon'],
-                    "miles_traveled": current_miles
-                })
-                total_on_duty_hours += fueling_duration
-                current_window_hours += fueling_duration
-                time_in_day += fueling_duration
-                last_fuel_miles = current_miles
-                fuel_index += 1
-
-        # Check for scaling stop
-        if current_miles - last_scaling_miles >= scaling_interval:
-            stop_coords = get_coords_at_distance(current_miles, geometry, geometry_distances, total_route_miles)
-            stops.append({
-                "location": "Scaling Stop",
-                "activity": "Scaling",
-                "time": time_in_day,
-                "duty_status": "on_duty_not_driving",
-                "duration": 0.5,
-                "lat": stop_coords["lat"],
-                "lon": stop_coords["lon"],
-                "miles_traveled": current_miles
-            })
-            total_on_duty_hours += 0.5
-            current_window_hours += 0.5
-            time_in_day += 0.5
-            last_scaling_miles = current_miles
-
-        # Check for trailer change
-        if current_miles - last_trailer_miles >= 600 and trailer_index < len(trailer_changes):
-            trailer_stop = trailer_changes[trailer_index]
-            if trailer_stop['distance'] <= current_miles:
-                stops.append({
-                    "location": trailer_stop['location'],
-                    "activity": "Trailer Change",
-                    "time": time_in_day,
-                    "duty_status": "on_duty_not_driving",
-                    "duration": 0.5,
-                    "lat": trailer_stop['lat'],
-                    "lon": trailer_stop['lon'],
-                    "miles_traveled": current_miles
-                })
-                total_on_duty_hours += 0.5
-                current_window_hours += 0.5
-                time_in_day += 0.5
-                last_trailer_miles = current_miles
-                trailer_index += 1
-
-        # Check for in-road inspection
-        if current_miles - last_inspection_miles >= 300 and inspection_index < len(inspection_stops):
-            inspection_stop = inspection_stops[inspection_index]
-            if inspection_stop['distance'] <= current_miles:
-                stops.append({
-                    "location": inspection_stop['location'],
-                    "activity": "In-Road Inspection",
-                    "time": time_in_day,
-                    "duty_status": "on_duty_not_driving",
-                    "duration": 0.25,
-                    "lat": inspection_stop['lat'],
-                    "lon": inspection_stop['lon'],
-                    "miles_traveled": current_miles
-                })
-                total_on_duty_hours += 0.25
-                current_window_hours += 0.25
-                time_in_day += 0.25
-                last_inspection_miles = current_miles
-                inspection_index += 1
-
-        # Check for mandatory 30-minute break within 8 hours of driving
-        driving_time_since_break = (time_in_day - last_break_time) - sum(
-            stop["duration"] for stop in stops if stop["time"] >= last_break_time and stop["duty_status"] != "driving"
-        )
-        if driving_time_since_break >= break_timing and current_driving_hours > 0:
-            stop_coords = get_coords_at_distance(current_miles, geometry, geometry_distances, total_route_miles)
-            stops.append({
-                "location": "Rest Break",
-                "activity": "30-min Break",
-                "time": time_in_day,
-                "duty_status": "off_duty",
-                "duration": rest_break_duration,
-                "lat": stop_coords["lat"],
-                "lon": stop_coords["lon"],
-                "miles_traveled": current_miles
-            })
-            time_in_day += rest_break_duration
-            current_window_hours += rest_break_duration
-            current_driving_hours = 0
-            last_break_time = time_in_day
-            last_rest_miles = current_miles
-            if time_in_day >= 24:
-                day += int(time_in_day // 24)
-                time_in_day = time_in_day % 24
-
-        # Check for rest stop
-        if current_driving_hours >= 8 and rest_index < len(rest_stops):
-            rest_stop = rest_stops[rest_index]
-            if rest_stop['distance'] <= current_miles:
-                stops.append({
-                    "location": rest_stop['location'],
-                    "activity": "Rest Break",
-                    "time": time_in_day,
-                    "duty_status": "off_duty",
-                    "duration": rest_break_duration,
-                    "lat": rest_stop['lat'],
-                    "lon": rest_stop['lon'],
-                    "miles_traveled": current_miles
-                })
-                time_in_day += rest_break_duration
-                current_window_hours += rest_break_duration
-                current_driving_hours = 0
-                last_break_time = time_in_day
-                last_rest_miles = current_miles
-                rest_index += 1
-                if time_in_day >= 24:
-                    day += int(time_in_day // 24)
-                    time_in_day = time_in_day % 24
-
-        # Check for 11-hour driving or 14-hour on-duty limit
-        remaining_driving_hours = min(11 - current_driving_hours, 14 - current_window_hours)
-        if remaining_driving_hours <= 0:
-            stop_coords = get_coords_at_distance(current_miles, geometry, geometry_distances, total_route_miles)
-            stops.append({
-                "location": "Post-Trip",
-                "activity": "Post-trip & TI",
-                "time": time_in_day,
-                "duty_status": "off_duty",
-                "duration": post_trip_duration,
-                "lat": stop_coords["lat"],
-                "lon": stop_coords["lon"],
-                "miles_traveled": current_miles
-            })
-            time_in_day += post_trip_duration
-            current_window_hours += post_trip_duration
-
-            if not split_sleeper_used and current_miles < distance_miles * 0.75:
-                stops.append({
-                    "location": "Sleeper Berth",
-                    "activity": "Sleeper Berth (Split 1)",
-                    "time": time_in_day,
-                    "duty_status": "sleeper_berth",
-                    "duration": 8.0,
-                    "lat": stop_coords["lat"],
-                    "lon": stop_coords["lon"],
-                    "miles_traveled": current_miles
-                })
-                time_in_day += 8.0
-                stops.append({
-                    "location": "Sleeper Berth",
-                    "activity": "Sleeper Berth (Split 2)",
-                    "time": time_in_day,
-                    "duty_status": "sleeper_berth",
-                    "duration": 2.0,
-                    "lat": stop_coords["lat"],
-                    "lon": stop_coords["lon"],
-                    "miles_traveled": current_miles
-                })
-                time_in_day += 2.0
-                split_sleeper_used = True
-            else:
-                stops.append({
-                    "location": "Sleeper Berth",
-                    "activity": "Sleeper Berth",
-                    "time": time_in_day,
-                    "duty_status": "sleeper_berth",
-                    "duration": 10.0 - post_trip_duration,
-                    "lat": stop_coords["lat"],
-                    "lon": stop_coords["lon"],
-                    "miles_traveled": current_miles
-                })
-                time_in_day += (10.0 - post_trip_duration)
-
-            current_driving_hours = 0
-            current_window_hours = 0
-            last_break_time = time_in_day
-            last_rest_miles = current_miles
-            if time_in_day >= 24:
-                day += int(time_in_day // 24)
-                time_in_day = time_in_day % 24
+        pickup_miles = geometry_distances[pickup_index]
+
+    return {
+        "geometry": geometry,
+        "geometry_distances": geometry_distances,
+        "pois": {
+            "fuel_stations": fuel_stations,
+            "rest_stops": rest_stops,
+            "trailer_changes": trailer_changes,
+            "inspection_stops": inspection_stops,
+        },
+        "pickup_miles": pickup_miles,
+        "speed_profile": build_speed_profile(geometry_distances, steps),
+    }
+
+
+def build_speed_profile(geometry_distances, steps):
+    """
+    Cumulative driving hours at every geometry vertex, spreading each ORS step's
+    duration over its vertices in proportion to distance. None without step data.
+    """
+    if not steps:
+        return None
+
+    miles = np.asarray(geometry_distances, dtype=float)
+    segment_miles = np.diff(miles)
+    segment_hours = np.zeros(len(segment_miles))
+    for first, last, seconds in steps:
+        last = min(last, len(miles) - 1)
+        if last <= first:
             continue
+        span = miles[last] - miles[first]
+        step_segments = segment_miles[first:last]
+        shares = step_segments / span if span > 0 else np.full(len(step_segments), 1 / len(step_segments))
+        segment_hours[first:last] += shares * (seconds / 3600)
+
+    hours = np.concatenate(([0.0], np.cumsum(segment_hours)))
+    return {"miles": miles.tolist(), "hours": hours.tolist()}
+
+
+PLANNING_DEFAULTS = {
+    name: parameter.default
+    for name, parameter in inspect.signature(plan_trip).parameters.items()
+    if parameter.default is not parameter.empty and name not in ("overpass_data", "steps")
+}
 
-        # Add driving segment
-        miles_to_drive = min(remaining_driving_hours * speed_mph, distance_miles - current_miles)
-        hours_to_drive = miles_to_drive / speed_mph
-        current_miles += miles_to_drive
-        stop_coords = get_coords_at_distance(current_miles, geometry, geometry_distances, total_route_miles)
-        stops.append({
-            "location": "Driving",
-            "activity": "Driving",
-            "time": time_in_day,
-            "duty_status": "driving",
-            "duration": hours_to_drive,
-            "lat": stop_coords["lat"],
-            "lon": stop_coords["lon"],
-            "miles_traveled": current_miles
-        })
-        current_driving_hours += hours_to_drive
-        current_window_hours += hours_to_drive
-        total_on_duty_hours += hours_to_drive
-        time_in_day += hours_to_drive
-        if time_in_day >= 24:
-            day += int(time_in_day // 24)
-            time_in_day = time_in_day % 24
-
-    #Add dropoff with unloading
-    stops.append({
-        "location": "Dropoff",
-        "activity": "Unloading",
-        "time": time_in_day,
-        "duty_status": "on_duty_not_driving",
-        "duration": unloading_duration,
-        "lat": end_coords.latitude,
-        "lon": end_coords.longitude,
-        "miles_traveled": current_miles
-    })
-    total_on_duty_hours += unloading_duration
-    time_in_day += unloading_duration
-
-    #Add final post-trip inspection if not already added
-    if stops[-1]["activity"] != "Post-trip & TI":
-        stop_coords = get_coords_at_distance(current_miles, geometry, geometry_distances, total_route_miles)
-        stops.append({
-            "location": "Post-Trip",
-            "activity": "Post-trip & TI",
-            "time": time_in_day,
-            "duty_status": "off_duty",
-            "duration": post_trip_duration,
-            "lat": stop_coords["lat"],
-            "lon": stop_coords["lon"],
-            "miles_traveled": current_miles
-        })
-        time_in_day += post_trip_duration
-
-    #Add additional trip data fields
-    trip = Trip.objects.get(id=trip_id)
-    trip_data = {
-        "stops": stops,
-        "total_days": day,
-        "total_on_duty_hours": total_on_duty_hours,
-        "trailer_number": trip.user.trailer_number,
+
+def build_trip_data(plan, user):
+    """Add the log sheet header fields to a planned schedule (or a persisted route_data)."""
+    return {
+        "stops": plan["stops"],
+        "total_days": plan["total_days"],
+        "total_on_duty_hours": plan["total_on_duty_hours"],
+        "trailer_number": user.trailer_number,
         "shipper":  "N/A",
         "commodity":  "N/A",
         "load_id": "N/A",
@@ -646,17 +303,91 @@ def calculate_trip(trip_id, distance, duration, current_cycle_hours, geometry, p
         "co_driver": "N/A",
     }
 
+
+def calculate_trip(trip_id, distance, duration, current_cycle_hours, geometry, pickup_coords, start_coords, end_coords, steps=None, **params):
+    """
+    Plan a trip, render its log sheets and persist both on the Trip.
+
+    The schedule is memoized on the rounded coordinates, cycle hours, duration parameters
+    and engine version; rendered sheets additionally on the log date and driver details.
+    """
+    plan_key, plan = schedule_trip(distance, duration, current_cycle_hours, geometry, pickup_coords, start_coords, end_coords, steps=steps, **params)
+    return save_trip_plan(trip_id, plan_key, plan, duration, geometry)
+
+
+def get_schedule_key(current_cycle_hours, pickup_coords, start_coords, end_coords, **params):
+    pickup_coords, start_coords, end_coords = as_location(pickup_coords), as_location(start_coords), as_location(end_coords)
+    lane = round_coords([
+        [start_coords.longitude, start_coords.latitude],
+        [pickup_coords.longitude, pickup_coords.latitude],
+        [end_coords.longitude, end_coords.latitude],
+    ])
+    return make_plan_key("schedule", lane, float(current_cycle_hours), {**PLANNING_DEFAULTS, **params})
+
+
+def schedule_trip(distance, duration, current_cycle_hours, geometry, pickup_coords, start_coords, end_coords, overpass_data=None, steps=None, **params):
+    """
+    Return (plan_key, plan) for a trip, scheduling it unless the plan is cached.
+
+    `overpass_data` is passed through to plan_trip when the POIs were fetched beforehand.
+    """
+    plan_key = get_schedule_key(current_cycle_hours, pickup_coords, start_coords, end_coords, **params)
+    plan = get_cached_plan(plan_key)
+    if plan is None:
+        plan = plan_trip(
+            distance, duration, current_cycle_hours, geometry,
+            as_location(pickup_coords), as_location(start_coords), as_location(end_coords),
+            overpass_data=overpass_data, steps=steps, **{**PLANNING_DEFAULTS, **params},
+        )
+        # A plan made without complete POI data is not reused; the next trip on the lane retries Overpass
+        if is_complete(plan):
+            set_cached_plan(plan_key, plan)
+    else:
+        logger.info(f"Plan cache hit for {plan_key}")
+    return plan_key, plan
+
+
+def is_complete(plan):
+    return plan.get("poi_status", POI_OK) == POI_OK
+
+
+def save_trip_plan(trip_id, plan_key, plan, duration, geometry):
+    """Render the log sheets of a scheduled plan (unless rendering lazily) and persist both on the Trip."""
+    # One read for the trip and the driver fields printed on the sheets
+    trip = Trip.objects.select_related("user").only(
+        "created_at", "user__driver_number", "user__truck_number", "user__trailer_number",
+    ).get(id=trip_id)
+    trip_data = build_trip_data(plan, trip.user)
+
     route = {
-        "distance_miles": distance_miles,
+        "distance_miles": plan["distance_miles"],
         "duration_hours": duration,
         "geometry": geometry,
-        "stops": trip_data["stops"]
+        "stops": trip_data["stops"],
+        "total_days": trip_data["total_days"],
+        "total_on_duty_hours": trip_data["total_on_duty_hours"],
+        "poi_status": plan.get("poi_status", POI_OK),
+        # Fuel, rest and inspection stops may be missing or outdated
+        "degraded_poi_data": not is_complete(plan),
     }
 
-    log_sheets = generate_eld_logs(trip_data, trip.created_at.date(), trip.user)
-    trip.route_data = route
-    trip.log_sheets = log_sheets
-    trip.save()
+    # In lazy mode only the schedule is persisted; LogSheetView renders each day on first request
+    if settings.ELD_LAZY_RENDERING:
+        log_sheets = []
+    else:
+        start_date = trip.created_at.date()
+        render_key = make_plan_key(
+            "log_sheets", plan_key, start_date.isoformat(),
+            trip.user.driver_number, trip.user.truck_number, trip.user.trailer_number,
+        )
+        log_sheets = get_cached_plan(render_key) if is_complete(plan) else None
+        if log_sheets is None:
+            log_sheets = generate_eld_logs(trip_data, start_date, trip.user)
+            if is_complete(plan):
+                set_cached_plan(render_key, log_sheets)
+
+    # Write only the plan columns; update() skips auto_now, so bump updated_at explicitly
+    Trip.objects.filter(id=trip_id).update(route_data=route, log_sheets=log_sheets, updated_at=timezone.now())
     return trip_data
 
 def haversine(lon1, lat1, lon2, lat2, miles=True):
@@ -670,26 +401,6 @@ def haversine(lon1, lat1, lon2, lat2, miles=True):
     
     return R * c
 
-def get_coords_at_distance(target_miles, geometry, geometry_distances, total_route_miles):
-    """Interpolate coordinates at a given distance along a route."""
-    if target_miles <= 0:
-        return {"lat": geometry[0][1], "lon": geometry[0][0]}
-    if target_miles >= total_route_miles:
-        return {"lat": geometry[-1][1], "lon": geometry[-1][0]}
-
-    for i in range(len(geometry_distances) - 1):
-        if geometry_distances[i] <= target_miles <= geometry_distances[i + 1]:
-            fraction = (target_miles - geometry_distances[i]) / (geometry_distances[i + 1] - geometry_distances[i])
-            lon1, lat1 = geometry[i]
-            lon2, lat2 = geometry[i + 1]
-            interpolated_lat = lat1 + fraction * (lat2 - lat1)
-            interpolated_lon = lon1 + fraction * (lon2 - lon1)
-            return {"lat": interpolated_lat, "lon": interpolated_lon}
-
-    return {"lat": geometry[-1][1], "lon": geometry[-1][0]}
-
-
-
 def generate_eld_logs(trip_data, start_date, user):
     """
     Generate ELD logs for a trip with stops and timestamps, following the truck driver logbook format.
@@ -702,153 +413,195 @@ def generate_eld_logs(trip_data, start_date, user):
     Returns:
         list: List of base64-encoded log sheet images.
     """
+    return [
+        base64.b64encode(render_eld_log(trip_data, day, start_date, user)).decode("utf-8")
+        for day in range(1, trip_data["total_days"] + 1)
+    ]
+
+
+# Log sheet layout, in pixels of the blank log template
+LOG_SHEET_WIDTH = 513
+LOG_SHEET_HEIGHT = 518
+
+# Y-axis positions for duty statuses
+duty_positions = {
+    "off_duty": 192,
+    "sleeper_berth": 222,
+    "driving": 252,
+    "on_duty": 281
+}
+
+# Map duty_status from calculate_trip to logbook duty statuses
+duty_status_mapping = {
+    "on_duty_not_driving": "on_duty",
+    "off_duty": "off_duty",
+    "sleeper_berth": "sleeper_berth",
+    "driving": "driving"
+}
+
+# Scaling factors for the 24-hour grid
+x_scale = 13
+graph_x_start = 77
+graph_width = 312
+
+
+def stop_day(stop):
+    # Schedules from the event-driven scheduler carry their day; older plans only a time
+    return stop.get("day", int(stop["time"] // 24) + 1)
+
+
+def layout_eld_log(trip_data, day, start_date, user):
+    """
+    Compute the text and line primitives of a single day's log sheet.
+
+    Shared by the raster (PNG) and vector (SVG/PDF) renderers.
+
+    Returns:
+        dict: "texts" as ((x, y), text) and "lines" as ((x1, y1, x2, y2), width), in template pixels.
+    """
     stops = trip_data["stops"]
-    total_days = trip_data["total_days"]
-    
-    log_sheets = []
-
-    for day in range(1, total_days + 1):
-        # Load the blank log template
-        template_path = settings.BLANK_LOG_TEMPLATE_PATH
-        img = Image.open(template_path)
-        draw = ImageDraw.Draw(img)
-
-        #Fill in Header Information
-        log_date = start_date + timedelta(days=day - 1)
-        draw.text((26, 22), log_date.strftime("%Y-%m-%d"), fill="black")
-
-        # Driver and Carrier Information
-        draw.text((103, 59), user.driver_number, fill="black")
-        draw.text((154, 59), "N/A", fill="black")
-        draw.text((205, 59), "N/A", fill="black")
-        draw.text((308, 59), trip_data.get("co_driver", "N/A"), fill="black")
-        draw.text((308, 89), trip_data.get("home_terminal", "N/A"), fill="black")
-
-        # Calculate total miles driven for this day
-        day_stops = [stop for stop in stops if (stop["time"] // 24) + 1 == day]
-        daily_miles = 0
-        if day_stops:
-            driving_stops = [stop for stop in day_stops if stop["duty_status"] == "driving"]
-            if driving_stops:
-                start_miles = min(stop["miles_traveled"] for stop in driving_stops)
-                end_miles = max(stop["miles_traveled"] for stop in driving_stops)
-                daily_miles = end_miles - start_miles
-
-        # Vehicle and Shipment Information
-        draw.text((26, 89), str(user.truck_number), fill="black") 
-        draw.text((77, 89), str(user.trailer_number), fill="black")
-        draw.text((128, 89), str(round(daily_miles)), fill="black")
-        draw.text((26, 133), trip_data.get("shipper", "N/A"), fill="black")
-        draw.text((103, 133), trip_data.get("commodity", "N/A"), fill="black")
-        draw.text((180, 133), trip_data.get("load_id", "N/A"), fill="black")
-
-        #Duty Status Graph 
-        remarks = []
-        duty_totals = {
-            "off_duty": 0,
-            "sleeper_berth": 0,
-            "driving": 0,
-            "on_duty": 0
-        }
-        previous_time = 0  
-        previous_status = "off_duty"  
-        previous_y = 192  
-
-        # Define Y-axis positions for duty statuses
-        duty_positions = {
-            "off_duty": 192,        
-            "sleeper_berth": 222,   
-            "driving": 252,         
-            "on_duty": 281          
-        }
-
-        # Map duty_status from calculate_trip to logbook duty statuses
-        duty_status_mapping = {
-            "on_duty_not_driving": "on_duty",
-            "off_duty": "off_duty",
-            "sleeper_berth": "sleeper_berth",
-            "driving": "driving"
-        }
-
-        # Scaling factors for the 24-hour grid
-        x_scale = 13 
-        graph_x_start = 77 
-        graph_width = 312 
-
-        for stop in stops:
-            start_time = stop["time"]
-            if (start_time // 24) + 1 != day:
-                continue
-
-            start_time = start_time % 24
-            duration = stop["duration"]
-            duty_status = duty_status_mapping[stop["duty_status"]]
-            location = stop["location"]
-            activity = stop.get("activity", location)
-
-            # Calculate the X positions for the start and end of this duty status
-            start_x = graph_x_start + (start_time * x_scale)
-            end_x = graph_x_start + ((start_time + duration) * x_scale)
-            end_x = min(end_x, graph_x_start + graph_width)
-
-            # Get the Y position for the current duty status
-            line_y = duty_positions.get(duty_status, 192)
-
-            # Draw a vertical line to transition between duty statuses
-            if start_time > previous_time:
-                prev_end_x = graph_x_start + (start_time * x_scale)
-                draw.line((graph_x_start + (previous_time * x_scale), previous_y, prev_end_x, previous_y), fill="black", width=2)
-                duty_totals[previous_status] += (start_time - previous_time)
-
-            # Draw the line for the current duty status
-            draw.line((start_x, previous_y, start_x, line_y), fill="black", width=2)
-            draw.line((start_x, line_y, end_x, line_y), fill="black", width=2)
-
-            # Add a bracket if the truck didn't move
-            if duty_status in ["on_duty", "off_duty"] and stop["duty_status"] != "driving":
-                draw.line((start_x, line_y + 5, start_x, line_y + 10), fill="black", width=1)  # Adjusted bracket size
-                draw.line((end_x, line_y + 5, end_x, line_y + 10), fill="black", width=1)
-                draw.line((start_x, line_y + 7, end_x, line_y + 7), fill="black", width=1)
-
-            # Update duty totals
-            duty_totals[duty_status] += duration
-
-            # Add remark for duty status change
-            remark = f"{location}, {activity} at {int(start_time)}:{int((start_time % 1) * 60):02d}"
-            remarks.append(remark)
-
-            # Update previous values
-            previous_time = start_time + duration
-            previous_status = duty_status
-            previous_y = line_y
-
-        # Draw the final segment of the day
-        if previous_time < 24:
-            end_x = graph_x_start + (24 * x_scale)
-            draw.line((graph_x_start + (previous_time * x_scale), previous_y, end_x, previous_y), fill="black", width=2)
-            duty_totals[previous_status] += (24 - previous_time)
-
-        # Add Remarks
-        for i, remark in enumerate(remarks):
-            draw.text((26, 333 + i * 15), remark, fill="black")
-
-        #Calculate and Add Totals 
-        total_hours = sum(duty_totals.values())
-        if abs(total_hours - 24) > 0.01:
-            print(f"Warning: Total hours for day {day} is {total_hours}, expected 24 hours.")
-
-        draw.text((410, 192), f"{duty_totals['off_duty']:.2f} hrs", fill="black")
-        draw.text((410, 222), f"{duty_totals['sleeper_berth']:.2f} hrs", fill="black")
-        draw.text((410, 252), f"{duty_totals['driving']:.2f} hrs", fill="black")
-        draw.text((410, 281), f"{duty_totals['on_duty']:.2f} hrs", fill="black")
-
-        total_on_duty = duty_totals["driving"] + duty_totals["on_duty"]
-        draw.text((410, 333), f"Total On-Duty: {total_on_duty:.2f} hrs", fill="black")
-
-        #Convert Image to Base64
-        buffered = io.BytesIO()
-        img.save(buffered, format="PNG")
-        img_base64 = base64.b64encode(buffered.getvalue()).decode("utf-8")
-        log_sheets.append(img_base64)
-
-    return log_sheets
\ No newline at end of file
+    texts = []
+    lines = []
+
+    #Fill in Header Information
+    log_date = start_date + timedelta(days=day - 1)
+    texts.append(((26, 22), log_date.strftime("%Y-%m-%d")))
+
+    # Driver and Carrier Information
+    texts.append(((103, 59), user.driver_number))
+    texts.append(((154, 59), "N/A"))
+    texts.append(((205, 59), "N/A"))
+    texts.append(((308, 59), trip_data.get("co_driver", "N/A")))
+    texts.append(((308, 89), trip_data.get("home_terminal", "N/A")))
+
+    # Calculate total miles driven for this day
+    day_stops = [stop for stop in stops if stop_day(stop) == day]
+    daily_miles = 0
+    if day_stops:
+        driving_stops = [stop for stop in day_stops if stop["duty_status"] == "driving"]
+        if driving_stops:
+            start_miles = min(stop["miles_traveled"] for stop in driving_stops)
+            end_miles = max(stop["miles_traveled"] for stop in driving_stops)
+            daily_miles = end_miles - start_miles
+
+    # Vehicle and Shipment Information
+    texts.append(((26, 89), str(user.truck_number)))
+    texts.append(((77, 89), str(user.trailer_number)))
+    texts.append(((128, 89), str(round(daily_miles))))
+    texts.append(((26, 133), trip_data.get("shipper", "N/A")))
+    texts.append(((103, 133), trip_data.get("commodity", "N/A")))
+    texts.append(((180, 133), trip_data.get("load_id", "N/A")))
+
+    #Duty Status Graph 
+    remarks = []
+    duty_totals = {
+        "off_duty": 0,
+        "sleeper_berth": 0,
+        "driving": 0,
+        "on_duty": 0
+    }
+    previous_time = 0  
+    previous_status = "off_duty"  
+    previous_y = 192  
+
+    for stop in stops:
+        if stop_day(stop) != day:
+            continue
+
+        start_time = stop["time"] % 24
+        duration = stop["duration"]
+        duty_status = duty_status_mapping[stop["duty_status"]]
+        location = stop["location"]
+        activity = stop.get("activity", location)
+
+        # Calculate the X positions for the start and end of this duty status
+        start_x = graph_x_start + (start_time * x_scale)
+        end_x = graph_x_start + ((start_time + duration) * x_scale)
+        end_x = min(end_x, graph_x_start + graph_width)
+
+        # Get the Y position for the current duty status
+        line_y = duty_positions.get(duty_status, 192)
+
+        # Draw a vertical line to transition between duty statuses
+        if start_time > previous_time:
+            prev_end_x = graph_x_start + (start_time * x_scale)
+            lines.append(((graph_x_start + (previous_time * x_scale), previous_y, prev_end_x, previous_y), 2))
+            duty_totals[previous_status] += (start_time - previous_time)
+
+        # Draw the line for the current duty status
+        lines.append(((start_x, previous_y, start_x, line_y), 2))
+        lines.append(((start_x, line_y, end_x, line_y), 2))
+
+        # Add a bracket if the truck didn't move
+        if duty_status in ["on_duty", "off_duty"] and stop["duty_status"] != "driving":
+            lines.append(((start_x, line_y + 5, start_x, line_y + 10), 1))
+            lines.append(((end_x, line_y + 5, end_x, line_y + 10), 1))
+            lines.append(((start_x, line_y + 7, end_x, line_y + 7), 1))
+
+        # Update duty totals
+        duty_totals[duty_status] += duration
+
+        # Add remark for duty status change
+        remark = f"{location}, {activity} at {int(start_time)}:{int((start_time % 1) * 60):02d}"
+        remarks.append(remark)
+
+        # Update previous values
+        previous_time = start_time + duration
+        previous_status = duty_status
+        previous_y = line_y
+
+    # Draw the final segment of the day
+    if previous_time < 24:
+        end_x = graph_x_start + (24 * x_scale)
+        lines.append(((graph_x_start + (previous_time * x_scale), previous_y, end_x, previous_y), 2))
+        duty_totals[previous_status] += (24 - previous_time)
+
+    # Add Remarks
+    for i, remark in enumerate(remarks):
+        texts.append(((26, 333 + i * 15), remark))
+
+    #Calculate and Add Totals 
+    total_hours = sum(duty_totals.values())
+    if abs(total_hours - 24) > 0.01:
+        print(f"Warning: Total hours for day {day} is {total_hours}, expected 24 hours.")
+
+    texts.append(((410, 192), f"{duty_totals['off_duty']:.2f} hrs"))
+    texts.append(((410, 222), f"{duty_totals['sleeper_berth']:.2f} hrs"))
+    texts.append(((410, 252), f"{duty_totals['driving']:.2f} hrs"))
+    texts.append(((410, 281), f"{duty_totals['on_duty']:.2f} hrs"))
+
+    total_on_duty = duty_totals["driving"] + duty_totals["on_duty"]
+    texts.append(((410, 333), f"Total On-Duty: {total_on_duty:.2f} hrs"))
+
+    return {"texts": texts, "lines": lines}
+
+
+def render_eld_log(trip_data, day, start_date, user):
+    """
+    Render the log sheet for a single day of a trip onto the blank log template.
+
+    Args:
+        trip_data (dict): Contains stops and additional trip details.
+        day (int): 1-based day of the trip to render.
+        start_date (datetime): The start date of the trip.
+        user (object): User object containing driver details (e.g., driver_number, truck_number).
+
+    Returns:
+        bytes: PNG-encoded log sheet image.
+    """
+    layout = layout_eld_log(trip_data, day, start_date, user)
+
+    # Load the blank log template
+    template_path = settings.BLANK_LOG_TEMPLATE_PATH
+    img = Image.open(template_path)
+    draw = ImageDraw.Draw(img)
+
+    for coords, width in layout["lines"]:
+        draw.line(coords, fill="black", width=width)
+    for position, text in layout["texts"]:
+        draw.text(position, text, fill="black")
+
+    #Encode as PNG
+    buffered = io.BytesIO()
+    img.save(buffered, format="PNG")
+    return buffered.getvalue()
@@ -0,0 +1,124 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from django.conf import settings
+from api.helpers.hos_scheduler import MAX_CYCLE_HOURS, SHIFT_RESET_HOURS, compare_schedules
+from api.helpers.trip_planner import PLANNING_DEFAULTS
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+
+
+WHAT_IF_PARAMETERS = ("current_cycle_hours", *PLANNING_DEFAULTS)
+# (min, max) of each parameter. Values far below the defaults flood the schedule with
+# stops (scaling every mile, a break every few minutes) and hold a worker for minutes.
+PARAMETER_BOUNDS = {
+    "current_cycle_hours": (0, MAX_CYCLE_HOURS),
+    "scaling_interval": (50, 5000),
+    "break_timing": (1, 8),
+    **{name: (0, SHIFT_RESET_HOURS) for name in PLANNING_DEFAULTS if name.endswith("_duration")},
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def expand_variants(grid=None, variants=None):
+    """
+    Parameter sets to compare: every explicit entry of `variants`, then the cartesian
+    product of `grid` ({parameter: [values]}).
+
+    Raises:
+        ValueError: On unknown parameters, values that are not numbers within
+            PARAMETER_BOUNDS, or too many variants.
+    """
+    expanded = [dict(variant) for variant in variants or []]
+    if grid:
+        names = list(grid)
+        for values in grid.values():
+            if not isinstance(values, list) or not values:
+                raise ValueError("Every grid entry must be a non-empty list of values")
+        expanded += [dict(zip(names, combination)) for combination in itertools.product(*grid.values())]
+
+    if not expanded:
+        raise ValueError("Provide at least one variant or a parameter grid")
+    if len(expanded) > settings.WHAT_IF_MAX_VARIANTS:
+        raise ValueError(f"At most {settings.WHAT_IF_MAX_VARIANTS} variants can be compared at once")
+
+    for variant in expanded:
+        for name, value in variant.items():
+            if name not in WHAT_IF_PARAMETERS:
+                raise ValueError(f"Unknown parameter '{name}', expected one of {', '.join(WHAT_IF_PARAMETERS)}")
+            low, high = PARAMETER_BOUNDS[name]
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not low <= value <= high:
+                raise ValueError(f"Parameter '{name}' must be a number between {low} and {high}")
+    return expanded
+
+
+def get_executor():
+    """Process pool shared by what-if requests of this web process, started on first use."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Spawned workers only import the Django-free scheduler module
+            _executor = ProcessPoolExecutor(
+                max_workers=get_pool_size(),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _executor
+
+
+def get_pool_size():
+    # Every web worker has its own pool; never run more schedulers than there are cores
+    return max(1, min(settings.WHAT_IF_WORKERS, os.cpu_count() or 1))
+
+
+def reset_executor(executor):
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def compare_plans(route, distance, pickup_coords, start_coords, end_coords, variants, start_time):
+    """
+    Schedule every variant over one indexed route (see trip_planner.index_route) and
+    return a comparison table row per variant, in request order.
+
+    Even a single variant runs in the pool, so WHAT_IF_TIMEOUT always bounds the request.
+
+    Raises:
+        TimeoutError: If the variants take longer than WHAT_IF_TIMEOUT seconds.
+        ValueError: If a variant's schedule exceeds the scheduler's stop limit.
+    """
+    workers = max(1, min(get_pool_size(), len(variants)))
+    chunks = [variants[i::workers] for i in range(workers)]
+    trip = (route, distance, pickup_coords, start_coords, end_coords)
+
+    executor = get_executor()
+    deadline = time.monotonic() + settings.WHAT_IF_TIMEOUT
+    try:
+        futures = [executor.submit(compare_schedules, *trip, chunk) for chunk in chunks]
+        results = [future.result(timeout=max(0, deadline - time.monotonic())) for future in futures]
+    except (BrokenProcessPool, TimeoutError):
+        # A crashed worker poisons the pool and a stuck one holds a slot; start a fresh
+        # pool on the next request (a stuck worker exits once its variant is done)
+        reset_executor(executor)
+        raise
+
+    # Undo the round-robin chunking
+    summaries = [None] * len(variants)
+    for offset, chunk_results in enumerate(results):
+        summaries[offset::workers] = chunk_results
+
+    rows = []
+    for variant, summary in zip(variants, summaries):
+        rows.append({
+            "parameters": {"current_cycle_hours": 0, **PLANNING_DEFAULTS, **variant},
+            **summary,
+            "arrival_time": (start_time + timedelta(hours=summary["arrival_hours"])).isoformat(),
+        })
+    return rows
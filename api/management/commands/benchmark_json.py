@@ -0,0 +1,100 @@
+import io
+import json
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from api import renderers
+from api.renderers import ORJSONParser, ORJSONRenderer
+
+
+def make_trip(trip_id, points, days, rnd):
+    """A TripSerializer-shaped payload: dense geometry, a stop schedule and PNG-sized log sheets."""
+    lon, lat = -97.74, 30.27
+    geometry = []
+    for _ in range(points):
+        lon += rnd.uniform(0, 0.01)
+        lat += rnd.uniform(-0.004, 0.006)
+        geometry.append([round(lon, 6), round(lat, 6)])
+
+    stops = []
+    for index in range(days * 12):
+        lon, lat = geometry[index * (points - 1) // (days * 12)]
+        stops.append({
+            "location": "Pilot Travel Center",
+            "activity": "Driving",
+            "duty_status": "driving",
+            "duration": rnd.uniform(0.25, 5.5),
+            "lat": lat,
+            "lon": lon,
+            "miles_traveled": index * 48.3,
+            "time": index * 2.0 % 24,
+            "day": index // 12 + 1,
+        })
+
+    location = {"name": "Austin, Texas", "latitude": 30.27, "longitude": -97.74}
+    created_at = timezone.now() - timedelta(days=trip_id)
+    return {
+        "id": trip_id,
+        "current_location": location,
+        "pickup_location": location,
+        "dropoff_location": {"name": "Chicago, Illinois", "latitude": 41.88, "longitude": -87.63},
+        "current_cycle_hours": 12.5,
+        "created_at": created_at.isoformat(),
+        "updated_at": created_at.isoformat(),
+        "route_data": {
+            "distance_miles": 1154.2,
+            "duration_hours": 17.4,
+            "geometry": geometry,
+            "stops": stops,
+            "total_days": days,
+            "total_on_duty_hours": 33.5,
+        },
+        "log_sheets": ["".join(rnd.choices("ABCDEFGHabcdefgh0123456789+/", k=60_000)) for _ in range(days)],
+    }
+
+
+class Command(BaseCommand):
+    help = "Compare the stdlib and orjson JSON renderers/parsers on representative trip payloads."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--trips", type=int, default=20, help="Trips per payload (a history page)")
+        parser.add_argument("--points", type=int, default=5000, help="Geometry points per trip")
+        parser.add_argument("--days", type=int, default=2, help="Days (log sheets) per trip")
+        parser.add_argument("--repeat", type=int, default=20)
+
+    def handle(self, *args, **options):
+        if renderers.orjson is None:
+            raise CommandError("orjson is not installed; the ORJSON classes fall back to the stdlib renderer")
+
+        rnd = random.Random(0)
+        payload = [make_trip(trip_id, options["points"], options["days"], rnd) for trip_id in range(options["trips"])]
+        body = JSONRenderer().render(payload)
+        if json.loads(ORJSONRenderer().render(payload)) != json.loads(body):
+            raise CommandError("The orjson renderer output differs from the stdlib renderer")
+        self.stdout.write(f"Payload: {options['trips']} trips, {len(body) / 1e6:.1f} MB")
+
+        for name, renderer, parser in [
+            ("stdlib", JSONRenderer(), JSONParser()),
+            ("orjson", ORJSONRenderer(), ORJSONParser()),
+        ]:
+            render_time = self.measure(lambda: renderer.render(payload), options["repeat"])
+            parse_time = self.measure(lambda: parser.parse(io.BytesIO(body), parser_context={}), options["repeat"])
+            self.stdout.write(
+                f"{name:>7}: render {render_time * 1000:7.1f} ms ({len(body) / render_time / 1e6:6.0f} MB/s), "
+                f"parse {parse_time * 1000:7.1f} ms ({len(body) / parse_time / 1e6:6.0f} MB/s)"
+            )
+
+    def measure(self, func, repeat):
+        """Best wall time of `repeat` runs, which is the least disturbed by other load."""
+        best = float("inf")
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            best = min(best, time.perf_counter() - started)
+        return best
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from api.models import User
+from api.tasks import generate_profile_thumbnails
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate thumbnails for profile pictures that have none, such as the pictures "
+        "migration 0003 moved out of the database. Queued on the render workers unless --sync."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sync", action="store_true", help="Render in this process instead of queueing tasks")
+
+    def handle(self, *args, **options):
+        users = (
+            User.objects.exclude(profile_picture="").exclude(profile_picture__isnull=True)
+            .filter(profile_thumbnails={})
+            .values_list("id", "profile_picture")
+        )
+        count = 0
+        for user_id, picture_name in users.iterator():
+            if options["sync"]:
+                generate_profile_thumbnails(user_id, picture_name)
+            else:
+                generate_profile_thumbnails.delay(user_id, picture_name)
+            count += 1
+
+        action = "Generated" if options["sync"] else "Queued"
+        self.stdout.write(self.style.SUCCESS(f"{action} thumbnails for {count} profile pictures"))
@@ -0,0 +1,85 @@
+import csv
+import io
+import zipfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.models import Place
+
+
+# Column positions in the GeoNames dump format (US.txt, cities500.txt, ...)
+NAME_COLUMN = 1
+LATITUDE_COLUMN = 4
+LONGITUDE_COLUMN = 5
+FEATURE_CLASS_COLUMN = 6
+COUNTRY_CODE_COLUMN = 8
+ADMIN1_COLUMN = 10
+POPULATION_COLUMN = 14
+
+
+class Command(BaseCommand):
+    help = "Load US populated places from a GeoNames dump (plain .txt or .zip) into the location gazetteer."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Path to a GeoNames dump such as US.txt, US.zip or cities500.zip")
+        parser.add_argument("--min-population", type=int, default=0, help="Skip places with a smaller population")
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--append", action="store_true", help="Keep places that are already loaded")
+
+    def handle(self, *args, **options):
+        batch = []
+        loaded = 0
+        try:
+            with transaction.atomic():
+                if not options["append"]:
+                    Place.objects.all().delete()
+
+                for row in self.read_rows(options["path"]):
+                    place = self.parse_row(row, options["min_population"])
+                    if place is None:
+                        continue
+                    batch.append(place)
+                    if len(batch) >= options["batch_size"]:
+                        Place.objects.bulk_create(batch)
+                        loaded += len(batch)
+                        batch = []
+
+                Place.objects.bulk_create(batch)
+                loaded += len(batch)
+        except (OSError, zipfile.BadZipFile) as e:
+            raise CommandError(f"Could not read gazetteer dump: {e}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Loaded {loaded} places. Restart web workers to rebuild their location index."
+        ))
+
+    def read_rows(self, path):
+        if path.endswith(".zip"):
+            with zipfile.ZipFile(path) as archive:
+                name = next((n for n in archive.namelist() if n.endswith(".txt") and n != "readme.txt"), None)
+                if name is None:
+                    raise CommandError(f"No GeoNames .txt file found in {path}")
+                with archive.open(name) as raw:
+                    yield from csv.reader(io.TextIOWrapper(raw, encoding="utf-8"), delimiter="\t", quoting=csv.QUOTE_NONE)
+        else:
+            with open(path, encoding="utf-8", newline="") as f:
+                yield from csv.reader(f, delimiter="\t", quoting=csv.QUOTE_NONE)
+
+    def parse_row(self, row, min_population):
+        if len(row) <= POPULATION_COLUMN:
+            return None
+        if row[COUNTRY_CODE_COLUMN] != "US" or row[FEATURE_CLASS_COLUMN] != "P":
+            return None
+
+        population = int(row[POPULATION_COLUMN] or 0)
+        if population < min_population:
+            return None
+
+        return Place(
+            name=row[NAME_COLUMN],
+            state=row[ADMIN1_COLUMN],
+            latitude=float(row[LATITUDE_COLUMN]),
+            longitude=float(row[LONGITUDE_COLUMN]),
+            population=population,
+        )
@@ -0,0 +1,161 @@
+import multiprocessing
+import os
+import time
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.utils import timezone
+
+from api.helpers.trip_planner import build_trip_data, generate_eld_logs, stop_day
+from api.models import Trip
+
+
+def render_trip(job):
+    """Pool worker: render every log sheet of one trip. Returns (trip id, sheets, error)."""
+    trip_id, route_data, start_date, user = job
+    try:
+        stops = route_data["stops"]
+        plan = {
+            "stops": stops,
+            "total_days": route_data.get("total_days") or max((stop_day(stop) for stop in stops), default=1),
+            "total_on_duty_hours": route_data.get("total_on_duty_hours", 0),
+        }
+        return trip_id, generate_eld_logs(build_trip_data(plan, user), start_date, user), None
+    except Exception as e:
+        return trip_id, None, repr(e)
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-render the stored log sheets of planned trips, e.g. after the log template or renderer changed. "
+        "Bump TRIP_ENGINE_VERSION as well so memoized renders are not reused by new plans."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Rendering processes")
+        parser.add_argument("--batch-size", type=int, default=200, help="Trips rendered and written per transaction")
+        parser.add_argument("--chunk-size", type=int, default=500, help="Rows fetched per database round trip")
+        parser.add_argument("--checkpoint", help="File recording the last written trip id; rerunning resumes after it")
+        parser.add_argument("--user", help="Only re-render trips of this driver number")
+
+    def handle(self, *args, **options):
+        if options["workers"] < 1 or options["batch_size"] < 1 or options["chunk_size"] < 1:
+            raise CommandError("--workers, --batch-size and --chunk-size must be positive")
+        if settings.ELD_LAZY_RENDERING:
+            self.stdout.write("ELD_LAZY_RENDERING is on: sheets are rendered on request, only their caches are invalidated.")
+
+        last_id = self.read_checkpoint(options["checkpoint"])
+        trips = Trip.objects.filter(route_data__isnull=False, id__gt=last_id).order_by("id")
+        if options["user"]:
+            trips = trips.filter(user__driver_number=options["user"])
+        total = trips.count()
+        if last_id:
+            self.stdout.write(f"Resuming after trip {last_id}")
+        self.stdout.write(f"Re-rendering {total} trips with {options['workers']} workers")
+
+        if settings.ELD_LAZY_RENDERING:
+            trips = trips.only("id")
+        else:
+            trips = trips.select_related("user").only(
+                "id", "route_data", "created_at", "updated_at",
+                "user__driver_number", "user__truck_number", "user__trailer_number",
+            )
+
+        # Fork the workers before the first query so they share no database connection
+        connections.close_all()
+        # Lazy mode renders nothing, so it needs no workers
+        pool = None if settings.ELD_LAZY_RENDERING else multiprocessing.get_context("fork").Pool(options["workers"])
+        started = time.monotonic()
+        counts = {"done": 0, "sheets": 0, "failed": 0, "skipped": 0}
+        try:
+            batch = []
+            for trip in trips.iterator(chunk_size=options["chunk_size"]):
+                batch.append(trip)
+                if len(batch) >= options["batch_size"]:
+                    for name, count in self.process_batch(pool, batch, options).items():
+                        counts[name] += count
+                    self.report(counts, total, started)
+                    batch = []
+            if batch:
+                for name, count in self.process_batch(pool, batch, options).items():
+                    counts[name] += count
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Re-rendered {counts['done']} trips ({counts['sheets']} sheets) in {elapsed:.1f}s, "
+            f"{counts['failed']} failed, {counts['skipped']} re-planned during the run"
+        ))
+
+    def process_batch(self, pool, batch, options):
+        """Re-render (or, in lazy mode, invalidate) one batch. Returns its counts."""
+        now = timezone.now()
+
+        if settings.ELD_LAZY_RENDERING:
+            # Sheets are rendered on request and cached per updated_at, so bumping it is
+            # enough; the stored sheets of trips rendered before lazy mode are kept
+            done = Trip.objects.filter(id__in=[trip.id for trip in batch]).update(updated_at=now)
+            self.write_checkpoint(options["checkpoint"], batch[-1].id)
+            return {"done": done, "sheets": 0, "failed": 0, "skipped": len(batch) - done}
+
+        trips = {trip.id: trip for trip in batch}
+        jobs = [
+            (trip.id, trip.route_data, trip.created_at.date(), SimpleNamespace(
+                driver_number=trip.user.driver_number,
+                truck_number=trip.user.truck_number,
+                trailer_number=trip.user.trailer_number,
+            ))
+            for trip in batch
+        ]
+        chunksize = max(1, len(jobs) // (options["workers"] * 4))
+        results = pool.map(render_trip, jobs, chunksize=chunksize)
+
+        counts = {"done": 0, "sheets": 0, "failed": 0, "skipped": 0}
+        with transaction.atomic():
+            for trip_id, log_sheets, error in results:
+                if error:
+                    self.stderr.write(f"Trip {trip_id} failed to render: {error}")
+                    counts["failed"] += 1
+                    continue
+                # Only overwrite the sheets that were read; a trip re-planned since then already has
+                # current ones. update() skips auto_now; bumping it invalidates cached sheets and ETags.
+                written = Trip.objects.filter(id=trip_id, updated_at=trips[trip_id].updated_at).update(
+                    log_sheets=log_sheets, updated_at=now,
+                )
+                if written:
+                    counts["done"] += 1
+                    counts["sheets"] += len(log_sheets)
+                else:
+                    counts["skipped"] += 1
+
+        self.write_checkpoint(options["checkpoint"], batch[-1].id)
+        return counts
+
+    def report(self, counts, total, started):
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f"{counts['done'] + counts['failed'] + counts['skipped']}/{total} trips, {counts['sheets']} sheets, "
+            f"{counts['failed']} failed, {counts['done'] / elapsed:.1f} trips/s, {counts['sheets'] / elapsed:.1f} sheets/s"
+        )
+
+    def read_checkpoint(self, path):
+        if not path or not os.path.exists(path):
+            return 0
+        try:
+            with open(path) as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Could not read checkpoint {path}: {e}")
+
+    def write_checkpoint(self, path, trip_id):
+        if not path:
+            return
+        # Replace atomically so an interrupted run never leaves a truncated checkpoint
+        with open(f"{path}.tmp", "w") as f:
+            f.write(str(trip_id))
+        os.replace(f"{path}.tmp", path)
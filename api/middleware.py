@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+from django.utils.regex_helper import _lazy_re_compile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+re_accepts_brotli = _lazy_re_compile(r"\bbr\b")
+
+# PNG sheets and PDFs are already compressed; recompressing them only costs CPU. HTML
+# (admin, browsable API) is left out: it embeds CSRF tokens, which compression exposes to BREACH.
+COMPRESSIBLE_CONTENT_TYPES = ("application/json", "image/svg+xml")
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    Compress large JSON and SVG responses (trip payloads are mostly geometry floats) with
+    Brotli when the client accepts it and the brotli package is installed, gzip otherwise.
+    """
+
+    def process_response(self, request, response):
+        if not response.get("Content-Type", "").startswith(COMPRESSIBLE_CONTENT_TYPES):
+            return response
+        # Never compress a response that carries a CSRF secret, whatever its content type
+        if request.META.get("CSRF_COOKIE_NEEDS_UPDATE") or settings.CSRF_COOKIE_NAME in response.cookies:
+            return response
+        if not response.streaming and len(response.content) < settings.COMPRESSION_MIN_BYTES:
+            return response
+        if response.has_header("Content-Encoding"):
+            return response
+
+        if brotli is None or response.streaming or not re_accepts_brotli.search(request.META.get("HTTP_ACCEPT_ENCODING", "")):
+            return super().process_response(request, response)
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        compressed_content = brotli.compress(response.content, quality=settings.BROTLI_QUALITY)
+        if len(compressed_content) >= len(response.content):
+            return response
+        response.content = compressed_content
+        response.headers["Content-Length"] = str(len(response.content))
+
+        # Same as GZipMiddleware: the encoded body is no longer byte-identical, so weaken the ETag
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response.headers["ETag"] = "W/" + etag
+        response.headers["Content-Encoding"] = "br"
+        return response
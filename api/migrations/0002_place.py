@@ -0,0 +1,24 @@
+# Generated by Django 5.1.7 on 2026-10-19 06:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Place',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200)),
+                ('state', models.CharField(blank=True, max_length=20)),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+                ('population', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,52 @@
+import base64
+import binascii
+
+from django.core.files.base import ContentFile
+from django.db import migrations, models
+
+
+def move_base64_pictures_to_files(apps, schema_editor):
+    # Thumbnails are not rendered here; run `manage.py generate_profile_thumbnails` afterwards
+    User = apps.get_model('api', 'User')
+    users = User.objects.exclude(legacy_profile_picture__isnull=True).exclude(legacy_profile_picture='')
+    for user in users.iterator():
+        header, _, encoded = user.legacy_profile_picture.partition(',')
+        if not encoded:
+            header, encoded = 'data:image/png;base64', header
+        extension = header.split('/')[-1].split(';')[0] if header.startswith('data:image/') else 'png'
+        try:
+            content = base64.b64decode(encoded)
+        except (binascii.Error, ValueError):
+            continue
+        user.profile_picture.save(f'{user.pk}.{extension}', ContentFile(content), save=False)
+        user.save(update_fields=['profile_picture'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_place'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='user',
+            old_name='profile_picture',
+            new_name='legacy_profile_picture',
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='profile_picture',
+            field=models.ImageField(blank=True, null=True, upload_to='profile_pictures/'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='profile_thumbnails',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.RunPython(move_base64_pictures_to_files, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='user',
+            name='legacy_profile_picture',
+        ),
+    ]
@@ -0,0 +1,20 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_profile_picture_files'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trip',
+            name='idempotency_key',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='trip',
+            constraint=models.UniqueConstraint(fields=('user', 'idempotency_key'), name='unique_trip_idempotency_key'),
+        ),
+    ]
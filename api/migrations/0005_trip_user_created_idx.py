@@ -0,0 +1,17 @@
+# Generated by Django 5.1.7 on 2026-10-19 06:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_trip_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='trip',
+            index=models.Index(fields=['user', '-created_at'], name='trip_user_created_idx'),
+        ),
+    ]
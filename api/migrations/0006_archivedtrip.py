@@ -0,0 +1,28 @@
+# Generated by Django 5.1.7 on 2026-10-19 06:26
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_trip_user_created_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedTrip',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('payload', models.BinaryField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_trips', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-created_at'], name='archived_trip_user_created_idx')],
+            },
+        ),
+    ]
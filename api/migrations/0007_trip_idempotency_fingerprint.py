@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_archivedtrip'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trip',
+            name='idempotency_fingerprint',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,39 @@
+import json
+import zlib
+
+from django.db import migrations, models
+from django.utils.dateparse import parse_datetime
+
+
+def copy_updated_at_out_of_payloads(apps, schema_editor):
+    ArchivedTrip = apps.get_model('api', 'ArchivedTrip')
+    batch = []
+    for archived in ArchivedTrip.objects.filter(updated_at__isnull=True).iterator(chunk_size=500):
+        payload = json.loads(zlib.decompress(archived.payload))
+        archived.updated_at = parse_datetime(payload['updated_at']) if 'updated_at' in payload else archived.created_at
+        batch.append(archived)
+        if len(batch) >= 500:
+            ArchivedTrip.objects.bulk_update(batch, ['updated_at'])
+            batch = []
+    ArchivedTrip.objects.bulk_update(batch, ['updated_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_trip_idempotency_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedtrip',
+            name='updated_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(copy_updated_at_out_of_payloads, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='archivedtrip',
+            name='updated_at',
+            field=models.DateTimeField(),
+        ),
+    ]
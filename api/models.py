@@ -27,7 +27,8 @@ class User(AbstractBaseUser, PermissionsMixin):
     last_name = models.CharField(max_length=50, blank=True)
     trailer_number = models.CharField(max_length=50, blank=True)
     truck_number = models.CharField(max_length=50, blank=True)
-    profile_picture = models.TextField(blank=True, null=True)
+    profile_picture = models.ImageField(upload_to='profile_pictures/', blank=True, null=True)
+    profile_thumbnails = models.JSONField(default=dict, blank=True)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
 
@@ -49,6 +50,52 @@ class Trip(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     route_data = models.JSONField(null=True, blank=False)
     log_sheets = models.JSONField(null=True, blank=False)
+    # Idempotency-Key of the plan-trip request that created the trip
+    idempotency_key = models.CharField(max_length=255, null=True, blank=True)
+    # SHA-256 of the request body that first used idempotency_key
+    idempotency_fingerprint = models.CharField(max_length=64, null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "idempotency_key"], name="unique_trip_idempotency_key"),
+        ]
+        indexes = [
+            # Trip history: a user's trips newest first, optionally within one day
+            models.Index(fields=["user", "-created_at"], name="trip_user_created_idx"),
+        ]
 
     def __str__(self):
         return f"Trip for {self.user.driver_number} on {self.created_at}"
+
+class ArchivedTrip(models.Model):
+    """
+    A trip moved out of the Trip table by the retention job (see api/helpers/trip_archive.py).
+
+    Only the columns history lookups filter on or version by stay queryable; everything
+    else is zlib-compressed JSON in `payload`. The id is the original Trip id.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_trips')
+    created_at = models.DateTimeField()
+    # The Trip's updated_at, so history ETags need no payload
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    payload = models.BinaryField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "-created_at"], name="archived_trip_user_created_idx"),
+        ]
+
+    def __str__(self):
+        return f"Archived trip for {self.user.driver_number} on {self.created_at}"
+
+class Place(models.Model):
+    name = models.CharField(max_length=200)
+    state = models.CharField(max_length=20, blank=True)
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    population = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name}, {self.state}"
@@ -1,21 +1,25 @@
 from rest_framework import serializers
+from django.core.files.storage import default_storage
 from .models import User, Trip
-import base64
 
 class UserSerializer(serializers.ModelSerializer):
-    profile_picture = serializers.CharField(allow_blank=True, allow_null=True, required=False)
+    profile_picture = serializers.SerializerMethodField()
+    profile_thumbnails = serializers.SerializerMethodField()
 
     class Meta:
         model = User
-        fields = ['id', 'driver_number', 'first_name', 'last_name', 'trailer_number', 'truck_number', 'profile_picture']
+        fields = ['id', 'driver_number', 'first_name', 'last_name', 'trailer_number', 'truck_number', 'profile_picture', 'profile_thumbnails']
 
-    def validate_profile_picture(self, value):
-        if value and not value.startswith("data:image"):
-            try:
-                base64.b64decode(value.split(",")[1] if "," in value else value)
-            except Exception:
-                raise serializers.ValidationError("Invalid Base64 string for profile picture.")
-        return value
+    def _file_url(self, name):
+        url = default_storage.url(name)
+        request = self.context.get("request")
+        return request.build_absolute_uri(url) if request else url
+
+    def get_profile_picture(self, obj):
+        return self._file_url(obj.profile_picture.name) if obj.profile_picture else None
+
+    def get_profile_thumbnails(self, obj):
+        return {size: self._file_url(name) for size, name in (obj.profile_thumbnails or {}).items()}
 
 class TripSerializer(serializers.ModelSerializer):
     class Meta:
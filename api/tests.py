@@ -1,3 +1,955 @@
-from django.test import TestCase
+import base64
+import io
+import json
+import math
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from concurrent.futures import Future
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+from django.views.static import serve
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from api.helpers import overpass
+from api.helpers.leases import acquire_lease
+from api.helpers.single_flight import single_flight
+from api.helpers.idempotency import acquire_trip_lock, refresh_trip_lock, release_trip_lock, trip_lock_key
+from api.helpers import gazetteer
+from api.helpers.gazetteer import GazetteerPlace, PlaceIndex, normalize_place_name, search_places
+from api.helpers.trip_archive import archive_old_trips
+from api.helpers.what_if import expand_variants
+from api.management.commands.rerender_log_sheets import Command as RerenderLogSheetsCommand
+from api.middleware import CompressionMiddleware
+from api.helpers.tiered_cache import LocalLRUCache, TieredCache, tiered_cache
+from api.helpers.hos_scheduler import LIMIT_EVENTS, HOSScheduler, compare_schedules
+from api.helpers.trip_planner import as_location, get_overpass_data_sync, get_overpass_refs_sync, get_route_bboxes, haversine, index_route, load_overpass_refs, plan_trip
+from api.models import ArchivedTrip, Place, Trip, User
+from api.renderers import ORJSONRenderer
+from api.serializers import TripSerializer
+from api.tasks import start_trip_pipeline
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class TripHistoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("history-driver", "password")
+        other = User.objects.create_user("other-driver", "password")
+        location = {"name": "Austin", "latitude": 30.27, "longitude": -97.74}
+        day = timezone.make_aware(datetime(2025, 3, 14, 12))
+        for user, created_at in [
+            (cls.user, day - timedelta(days=1)),
+            (cls.user, day.replace(hour=0)),
+            (cls.user, day),
+            (cls.user, day.replace(hour=23, minute=59)),
+            (cls.user, day + timedelta(days=1)),
+            (other, day),
+        ]:
+            trip = Trip.objects.create(
+                user=user, current_location=location, pickup_location=location,
+                dropoff_location=location, current_cycle_hours=0,
+            )
+            # created_at is auto_now_add, so backdate it after creation
+            Trip.objects.filter(id=trip.id).update(created_at=created_at)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_history(self, **params):
+        """GET the history and return (response, SQL queries), ignoring ATOMIC_REQUESTS savepoints."""
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get("/api/trip-history/", params)
+        queries = [query["sql"] for query in context.captured_queries if "SAVEPOINT" not in query["sql"]]
+        return response, queries
+
+    def test_day_filter_returns_the_users_trips_of_that_day_newest_first(self):
+        response, queries = self.get_history(day="2025-03-14")
+
+        self.assertEqual(response.status_code, 200)
+        # The versions for the ETag, then the full rows
+        self.assertEqual(len(queries), 2)
+        created = [trip["created_at"] for trip in response.data]
+        self.assertEqual(len(created), 3)
+        self.assertEqual(created, sorted(created, reverse=True))
+
+    def test_history_without_day_lists_every_trip_of_the_user(self):
+        response, queries = self.get_history()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(len(response.data), 5)
+
+    def test_invalid_day_is_rejected(self):
+        response, _ = self.get_history(day="2025-02-30")
+        self.assertEqual(response.status_code, 400)
+
+    def test_unchanged_history_is_not_modified(self):
+        response, _ = self.get_history()
+        etag = response["ETag"]
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get("/api/trip-history/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        # Revalidation reads the versions only, never the route data or log sheets
+        self.assertFalse(any("route_data" in query["sql"] for query in context.captured_queries))
+
+        Trip.objects.filter(user=self.user).first().save()
+        response = self.client.get("/api/trip-history/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_large_payloads_are_compressed_and_revalidated(self):
+        trip = Trip.objects.filter(user=self.user).first()
+        Trip.objects.filter(id=trip.id).update(route_data={"geometry": [[-97.74 + i / 1000, 30.27] for i in range(2000)]})
+
+        response = self.client.get(f"/api/trips/{trip.id}/", HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertTrue(response["ETag"].startswith('W/"trip-'))
+
+        response = self.client.get(f"/api/trips/{trip.id}/", HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_log_sheets_are_revalidated_after_a_replan(self):
+        trip = Trip.objects.filter(user=self.user).first()
+        Trip.objects.filter(id=trip.id).update(route_data={"stops": [], "total_days": 1}, log_sheets=["c2hlZXQ="])
+
+        response = self.client.get(f"/api/log-sheet/{trip.id}/1/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"sheet")
+        self.assertEqual(response["Cache-Control"], "private, no-cache")
+        etag = response["ETag"]
+        self.assertEqual(self.client.get(f"/api/log-sheet/{trip.id}/1/", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # Re-planning keeps the URL but bumps updated_at
+        Trip.objects.filter(id=trip.id).update(log_sheets=["bmV3IHNoZWV0"], updated_at=timezone.now())
+        response = self.client.get(f"/api/log-sheet/{trip.id}/1/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"new sheet")
+
+    def test_day_filter_uses_the_user_created_index(self):
+        _, queries = self.get_history(day="2025-03-14")
+
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                # A handful of rows is cheaper to scan; make the planner show the index it would use at scale
+                cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute(f"{connection.ops.explain_query_prefix()} {queries[0]}")
+            plan = "\n".join(str(row) for row in cursor.fetchall())
+        self.assertIn("trip_user_created_idx", plan)
+        # The day bounds are index conditions, not a filter applied to every trip of the user
+        self.assertRegex(plan, r"(trip_user_created_idx \(|Index Cond: ).*created_at")
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    TRIP_ARCHIVE_AFTER_DAYS=30,
+    TRIP_ARCHIVE_BATCH_SIZE=2,
+)
+class TripArchiveTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("archive-driver", "password")
+        location = {"name": "Austin", "latitude": 30.27, "longitude": -97.74}
+        cls.old_day = (timezone.now() - timedelta(days=60)).replace(hour=12)
+        cls.trips = []
+        for created_at in [cls.old_day, cls.old_day.replace(hour=13), cls.old_day.replace(hour=14), timezone.now()]:
+            trip = Trip.objects.create(
+                user=cls.user, current_location=location, pickup_location=location,
+                dropoff_location=location, current_cycle_hours=12.5,
+                route_data={"stops": [], "total_days": 1}, log_sheets=["c2hlZXQ="],
+            )
+            Trip.objects.filter(id=trip.id).update(created_at=created_at)
+            cls.trips.append(trip)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_old_trips_move_to_the_archive_in_batches(self):
+        self.assertEqual(archive_old_trips(), 3)
+
+        self.assertEqual(list(Trip.objects.values_list("id", flat=True)), [self.trips[-1].id])
+        self.assertEqual(ArchivedTrip.objects.count(), 3)
+        self.assertEqual(archive_old_trips(), 0)
+
+    def test_archived_trips_are_served_by_detail_and_history(self):
+        archive_old_trips()
+        trip = self.trips[0]
+
+        response = self.client.get(f"/api/trips/{trip.id}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["id"], trip.id)
+        self.assertEqual(response.data["current_cycle_hours"], 12.5)
+        self.assertEqual(response.data["route_data"], {"stops": [], "total_days": 1})
+
+        self.assertEqual(response.data["log_sheets"], ["c2hlZXQ="])
+
+        response = self.client.get(f"/api/log-sheet/{trip.id}/1/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"sheet")
+
+        response = self.client.get("/api/trip-history/", {"day": self.old_day.date().isoformat()})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([trip["id"] for trip in response.data], [trip.id for trip in reversed(self.trips[:3])])
+
+        response = self.client.get("/api/trip-history/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([trip["id"] for trip in response.data], [trip.id for trip in reversed(self.trips)])
+
+    def test_history_revalidation_does_not_decompress_the_archive(self):
+        archive_old_trips()
+        self.assertEqual(
+            set(ArchivedTrip.objects.values_list("updated_at", flat=True)),
+            {trip.updated_at for trip in self.trips[:3]},
+        )
+        response = self.client.get("/api/trip-history/")
+
+        with mock.patch("api.helpers.trip_archive.restore_trip") as restore_trip, \
+                CaptureQueriesContext(connection) as context:
+            response = self.client.get("/api/trip-history/", HTTP_IF_NONE_MATCH=response["ETag"])
+
+        self.assertEqual(response.status_code, 304)
+        restore_trip.assert_not_called()
+        self.assertFalse(any("payload" in query["sql"] for query in context.captured_queries))
+
+    def test_archiving_is_off_by_default(self):
+        with override_settings(TRIP_ARCHIVE_AFTER_DAYS=0):
+            self.assertEqual(archive_old_trips(), 0)
+        self.assertEqual(Trip.objects.count(), 4)
+
+
+class TripPlannerTests(SimpleTestCase):
+    def plan_driving_hours(self, geometry, steps=None):
+        start = as_location({"latitude": geometry[0][1], "longitude": geometry[0][0]})
+        end = as_location({"latitude": geometry[-1][1], "longitude": geometry[-1][0]})
+        miles = sum(haversine(*geometry[i - 1], *geometry[i]) for i in range(1, len(geometry)))
+        overpass_data = {"fuel_stations": [], "rest_stops": [], "trailer_changes": [], "inspection_stops": []}
+        plan = plan_trip(miles / 0.621371, 0, 0, geometry, start, start, end, overpass_data=overpass_data, steps=steps)
+        return miles, sum(stop["duration"] for stop in plan["stops"] if stop["duty_status"] == "driving")
+
+    def test_step_durations_drive_the_route_at_their_speed(self):
+        geometry = [[-100 + i * 0.05, 35.0] for i in range(201)]
+        miles, _ = self.plan_driving_hours(geometry)
+        # Two steps at 60 mph over equal halves of the route
+        steps = [[0, 100, miles / 2 / 60 * 3600], [100, 200, miles / 2 / 60 * 3600]]
+
+        miles, hours = self.plan_driving_hours(geometry, steps)
+        self.assertAlmostEqual(hours, miles / 60, places=2)
+
+
+def make_scheduler(current_cycle_hours=0, pois=None, miles=3000.0, **params):
+    """A scheduler on a straight route of `miles`, driven at a constant 50 mph."""
+    categories = {"fuel_stations": [], "rest_stops": [], "trailer_changes": [], "inspection_stops": []}
+    for category, poi_miles in (pois or {}).items():
+        categories[category] = [
+            {"location": f"{category} {mile}", "lat": 35.0, "lon": -100 + mile / 300, "distance": mile}
+            for mile in poi_miles
+        ]
+    params = {"scaling_interval": 5000, "break_timing": 8, **params}
+    return HOSScheduler([[-100, 35.0], [-90, 35.0]], [0, miles], categories, current_cycle_hours, speed_mph=50, **params)
+
+
+def run_scheduler(scheduler, miles=3000.0):
+    location = SimpleNamespace(latitude=35.0, longitude=-100.0)
+    return scheduler.run(miles, location, location)
+
+
+def driving_hours_between(stops, location):
+    """Driving hours before each stop at `location`, counted from the previous one."""
+    hours, driving = [], 0.0
+    for previous, stop in zip([None, *stops], stops):
+        # Pieces of a stop split at midnight are one stop
+        if stop["location"] == location and (previous is None or previous["location"] != location):
+            hours.append(driving)
+            driving = 0.0
+        elif stop["duty_status"] == "driving":
+            driving += stop["duration"]
+    return hours
+
+
+class HOSSchedulerTests(SimpleTestCase):
+    def test_shifts_end_after_11_hours_of_driving(self):
+        stops = run_scheduler(make_scheduler())["stops"]
+
+        # The last Post-Trip follows the dropoff
+        shifts = driving_hours_between(stops, "Post-Trip")[:-1]
+        self.assertGreater(len(shifts), 3)
+        for hours in shifts:
+            self.assertAlmostEqual(hours, 11)
+
+    def test_shifts_end_when_the_14_hour_window_closes(self):
+        # 4 h pre-trip + 0.5 h scaling + 8 h driving + 0.5 h break leave 1 h of the window to drive
+        stops = run_scheduler(make_scheduler(pre_trip_duration=4))["stops"]
+
+        end = next(i for i, stop in enumerate(stops) if stop["location"] == "Post-Trip")
+        self.assertAlmostEqual(sum(stop["duration"] for stop in stops[:end]), 14)
+        self.assertAlmostEqual(sum(stop["duration"] for stop in stops[:end] if stop["duty_status"] == "driving"), 9)
+
+    def test_a_30_minute_break_follows_8_hours_of_driving(self):
+        stops = run_scheduler(make_scheduler())["stops"]
+
+        first_break = driving_hours_between(stops, "Rest Break")[0]
+        self.assertAlmostEqual(first_break, 8)
+        self.assertEqual(next(stop for stop in stops if stop["activity"] == "30-min Break")["duration"], 0.5)
+
+    def test_a_34_hour_restart_follows_70_hours_on_duty(self):
+        stops = run_scheduler(make_scheduler(current_cycle_hours=60))["stops"]
+
+        restart = next(i for i, stop in enumerate(stops) if stop["activity"] == "34-hour Restart")
+        self.assertEqual(sum(stop["duration"] for stop in stops if stop["activity"] == "34-hour Restart"), 34)
+        on_duty = sum(stop["duration"] for stop in stops[:restart] if stop["duty_status"] in ("driving", "on_duty_not_driving"))
+        self.assertAlmostEqual(on_duty, 10)
+
+    def test_stops_are_split_at_midnight(self):
+        stops = run_scheduler(make_scheduler())["stops"]
+
+        clock = 0.0
+        for stop in stops:
+            self.assertLessEqual(stop["time"] + stop["duration"], 24 + 1e-9)
+            self.assertAlmostEqual((stop["day"] - 1) * 24 + stop["time"], clock)
+            clock += stop["duration"]
+
+        # A drive across midnight ends where the truck was at midnight; the next day starts from there
+        before, after = next(
+            (before, after) for before, after in zip(stops, stops[1:])
+            if after["time"] == 0 and before["duty_status"] == after["duty_status"] == "driving"
+        )
+        self.assertEqual(after["day"], before["day"] + 1)
+        self.assertAlmostEqual(after["miles_traveled"] - before["miles_traveled"], after["duration"] * 50)
+
+    def test_total_days_counts_every_log_day(self):
+        plan = run_scheduler(make_scheduler())
+        last = plan["stops"][-1]
+
+        self.assertEqual(plan["total_days"], last["day"])
+        self.assertEqual(plan["total_days"], math.ceil(((last["day"] - 1) * 24 + last["time"] + last["duration"]) / 24))
+
+    def test_fuel_at_the_first_station_then_every_1000_miles(self):
+        stops = run_scheduler(make_scheduler(pois={"fuel_stations": [20, 700, 1030, 1900, 2060]}))["stops"]
+
+        fuel_miles = [stop["miles_traveled"] for stop in stops if stop["activity"] == "Fueling"]
+        self.assertEqual(fuel_miles, [20, 1030, 2060])
+
+
+class SchedulerEventTests(SimpleTestCase):
+    def queued(self, scheduler, kind):
+        """(mile, payload) of the queued `kind` events still current."""
+        return [
+            (mile, payload) for mile, _, _, event_kind, payload, version in sorted(scheduler.events)
+            if event_kind == kind and (kind not in LIMIT_EVENTS or version == scheduler.limits_version)
+        ]
+
+    def test_pois_nearest_the_target_within_50_miles_are_chosen(self):
+        scheduler = make_scheduler(pois={"fuel_stations": [940, 1030, 1200]})
+        scheduler.push_poi("fuel_stations", 0, "fuel", 1000)
+        [(mile, station)] = self.queued(scheduler, "fuel")
+        self.assertEqual(mile, 1030)
+        self.assertEqual(station["distance"], 1030)
+
+    def test_without_a_poi_in_the_window_the_first_one_past_it_is_chosen(self):
+        scheduler = make_scheduler(pois={"fuel_stations": [800, 1100]})
+        scheduler.push_poi("fuel_stations", 0, "fuel", 1000)
+        self.assertEqual([mile for mile, _ in self.queued(scheduler, "fuel")], [1100])
+
+    def test_pois_behind_the_truck_are_never_chosen(self):
+        scheduler = make_scheduler(pois={"fuel_stations": [960, 1060]})
+        scheduler.miles = 980
+        scheduler.push_poi("fuel_stations", 0, "fuel", 1000)
+        self.assertEqual([mile for mile, _ in self.queued(scheduler, "fuel")], [1060])
+
+    def test_no_poi_is_queued_past_the_last_one(self):
+        scheduler = make_scheduler(pois={"fuel_stations": [100]})
+        scheduler.miles = 200
+        scheduler.push_poi("fuel_stations", 0, "fuel", 1200)
+        self.assertEqual(self.queued(scheduler, "fuel"), [])
+
+    def test_limit_events_are_requeued_and_stale_ones_ignored(self):
+        scheduler = make_scheduler(current_cycle_hours=60)
+        scheduler.drive_to(300)
+        scheduler.push_limits()
+        # 6 of 8 driving hours used: the break is due 100 miles on; the cycle has 4 hours left
+        self.assertEqual(self.queued(scheduler, "break"), [(400, None)])
+        self.assertEqual(self.queued(scheduler, "restart"), [(500, None)])
+        self.assertEqual(self.queued(scheduler, "shift_end"), [(550, None)])
+
+        scheduler.on_break(None)
+        scheduler.push_limits()
+        self.assertEqual(self.queued(scheduler, "break"), [(700, None)])
+        # The earlier break is still in the heap, but under an old version that run() skips
+        stale = [mile for mile, _, _, kind, _, version in scheduler.events if kind == "break" and version != scheduler.limits_version]
+        self.assertEqual(stale, [400])
+
+    def test_due_breaks_are_taken_at_the_last_rest_area_up_to_an_hour_early(self):
+        scheduler = make_scheduler(pois={"rest_stops": [330, 380, 420]})
+        scheduler.drive_to(300)
+        scheduler.push_limits()
+        [(mile, rest_area)] = self.queued(scheduler, "break")
+        self.assertEqual(mile, 380)
+        self.assertEqual(rest_area["location"], "rest_stops 380")
+
+    def test_restart_and_shift_end_events_reset_the_clocks(self):
+        scheduler = make_scheduler(current_cycle_hours=60)
+        scheduler.distance_miles = 3000
+        scheduler.drive_to(500)
+        scheduler.on_restart(None)
+        self.assertEqual((scheduler.cycle_hours, scheduler.shift_driving_hours, scheduler.window_hours), (0, 0, 0))
+
+        scheduler.drive_to(800)
+        scheduler.on_shift_end(None)
+        self.assertEqual((scheduler.shift_driving_hours, scheduler.window_hours, scheduler.driving_since_break), (0, 0, 0))
+        self.assertEqual([stop["activity"] for stop in scheduler.stops[-3:]], ["Post-trip & TI", "Sleeper Berth (Split 1)", "Sleeper Berth (Split 2)"])
+
+
+class UserProfileTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("profile-driver", "password")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        # Production runs without ATOMIC_REQUESTS, where on_commit callbacks outside a transaction run at once
+        self.enterContext(mock.patch.dict(connection.settings_dict, ATOMIC_REQUESTS=False))
+
+    def test_thumbnails_are_queued_after_the_new_picture_is_saved(self):
+        picture = io.BytesIO()
+        Image.new("RGB", (8, 8)).save(picture, format="PNG")
+        saved_pictures = []
+
+        def record_saved_picture(user_id, picture_name):
+            saved_pictures.append((User.objects.get(id=user_id).profile_picture.name, picture_name))
+
+        with mock.patch("api.views.generate_profile_thumbnails.delay", side_effect=record_saved_picture):
+            response = self.client.put("/api/profile/", {
+                "first_name": "Dana",
+                "profile_picture": "data:image/png;base64," + base64.b64encode(picture.getvalue()).decode(),
+            }, format="json")
+
+        self.assertEqual(response.status_code, 200)
+        [(stored, queued)] = saved_pictures
+        self.assertEqual(stored, queued)
+        self.assertEqual(User.objects.get(id=self.user.id).first_name, "Dana")
+
+    def test_missing_thumbnails_are_generated(self):
+        picture = io.BytesIO()
+        Image.new("RGB", (8, 8)).save(picture, format="PNG")
+        self.user.profile_picture.save("picture.png", ContentFile(picture.getvalue()))
+        User.objects.create_user(
+            "thumbnailed-driver", "password",
+            profile_picture="profile_pictures/other.png", profile_thumbnails={"64": "thumbnail.webp"},
+        )
+
+        call_command("generate_profile_thumbnails", "--sync", stdout=io.StringIO())
+
+        self.user.refresh_from_db()
+        self.assertEqual(sorted(self.user.profile_thumbnails), ["256", "64"])
+
+    def test_picture_urls_are_served_without_debug(self):
+        # static() only routes media with DEBUG on; the media route must not depend on it
+        match = resolve(f"/{settings.MEDIA_URL.strip('/')}/profile_pictures/picture.png")
+        self.assertIs(match.func, serve)
+        self.assertEqual(match.kwargs["path"], "profile_pictures/picture.png")
+
+
+class FakeOverpassResponse:
+    """Streams `body` in small chunks, like a connection that may close mid-body."""
+
+    status = 200
+    headers = {}
+
+    def __init__(self, body):
+        self.content = self
+        self.body = body
+
+    async def iter_chunked(self, size):
+        for start in range(0, len(self.body), 7):
+            yield self.body[start:start + 7]
+
+    def raise_for_status(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class OverpassStreamTests(SimpleTestCase):
+    complete = b'{"version":0.6,"elements":[{"lat":1.5,"lon":2.5,"tags":{"name":"Fuel"}},{"lat":3.5,"lon":4.5}]}'
+
+    def request(self, body, stale=None):
+        session = mock.Mock(post=mock.Mock(return_value=FakeOverpassResponse(body)))
+        with mock.patch.object(overpass, "acquire_overpass_slot", mock.AsyncMock(return_value=True)), \
+                mock.patch.object(overpass.tiered_cache, "aset", mock.AsyncMock()) as cache_set:
+            pois = async_to_sync(overpass.request_overpass_data)(session, "query", "overpass:poi:test", 60, stale)
+        return pois, cache_set
+
+    def test_complete_response_is_cached(self):
+        pois, cache_set = self.request(self.complete)
+
+        self.assertEqual(pois["status"], overpass.POI_OK)
+        self.assertEqual(pois["lat"].tolist(), [1.5, 3.5])
+        cache_set.assert_awaited_once()
+
+    def test_truncated_response_is_not_cached(self):
+        stale = {**overpass.decode_pois(overpass.PoiBuilder().encode(fetched_at=1.0))}
+        for body in [
+            self.complete[:60],
+            self.complete[:-1],
+            self.complete[:-2] + b'],"remark":"runtime error: Query timed out in \\"query\\" at line 3 after 31 seconds."}',
+        ]:
+            with self.subTest(body=body):
+                pois, cache_set = self.request(body)
+                self.assertEqual(pois["status"], overpass.POI_UNAVAILABLE)
+                cache_set.assert_not_awaited()
+
+                pois, _ = self.request(body, stale=stale)
+                self.assertEqual(pois["status"], overpass.POI_STALE)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class TripIdempotencyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("idempotent-driver", "password")
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        route = {"distance": 100.0, "duration": 3600.0, "geometry": [[-97.74, 30.27], [-97.0, 31.0]]}
+        self.enterContext(mock.patch("api.views.fetch_route", return_value=route))
+        self.start_trip_pipeline = self.enterContext(mock.patch("api.views.start_trip_pipeline"))
+
+    def plan(self, cycle_hours, key="retry-1"):
+        location = {"name": "Austin", "latitude": 30.27, "longitude": -97.74}
+        return self.client.post("/api/plan-trip/", {
+            "current_location": location, "pickup_location": location, "dropoff_location": location,
+            "current_cycle_hours": cycle_hours,
+        }, format="json", HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retries_replay_the_trip_and_different_bodies_are_rejected(self):
+        created = self.plan(12)
+        self.assertEqual(created.status_code, 201)
+
+        replayed = self.plan(12)
+        self.assertEqual(replayed.status_code, 200)
+        self.assertEqual(replayed["Idempotent-Replayed"], "true")
+        self.assertEqual(replayed.data["data"]["id"], created.data["data"]["id"])
+
+        self.assertEqual(self.plan(30).status_code, 422)
+        self.assertEqual(Trip.objects.filter(user=self.user).count(), 1)
+        self.start_trip_pipeline.assert_called_once()
+
+    def test_an_expired_lease_holder_cannot_release_its_successor(self):
+        first = acquire_trip_lock(1)
+        self.assertIsNone(acquire_trip_lock(1))
+
+        # The first pipeline outlives its lease and a second one takes the trip
+        cache.delete(trip_lock_key(1))
+        second = acquire_trip_lock(1)
+        self.assertFalse(refresh_trip_lock(1, first))
+        release_trip_lock(1, first)
+        self.assertIsNone(acquire_trip_lock(1))
+
+        release_trip_lock(1, second)
+        self.assertIsNotNone(acquire_trip_lock(1))
+
+    def test_a_pipeline_that_cannot_be_enqueued_releases_its_lease(self):
+        with mock.patch("api.tasks.chain") as chain:
+            chain.return_value.apply_async.side_effect = OSError("broker unreachable")
+            with self.assertRaises(OSError):
+                start_trip_pipeline(2, 100.0, 3600.0, 0, [], None, None, None)
+
+        self.assertIsNotNone(acquire_trip_lock(2))
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class OverpassRefsTests(SimpleTestCase):
+    geometry = [[-100 + i * 0.5, 35.0] for i in range(41)]
+
+    def setUp(self):
+        self.enterContext(mock.patch("api.helpers.trip_planner.fetch_overpass_data", self.fetch_overpass_data))
+        self.enterContext(mock.patch("api.helpers.trip_planner.get_session"))
+
+    async def fetch_overpass_data(self, session, query):
+        # A corridor's worth of POIs per batch, cached like the real fetch
+        builder = overpass.PoiBuilder()
+        for index in range(500):
+            builder.add({"lat": 35.0, "lon": -100 + index / 25, "tags": {"name": f"Stop {index}"}})
+        data = builder.encode(fetched_at=1.0)
+        await tiered_cache.aset(overpass.get_poi_cache_key(query), data, timeout=60)
+        return {**overpass.decode_pois(data), "status": overpass.POI_OK}
+
+    def test_pipeline_stages_pass_references_to_the_cached_batches(self):
+        refs = get_overpass_refs_sync(self.geometry)
+        overpass_data = get_overpass_data_sync(self.geometry)
+
+        self.assertLess(len(json.dumps(refs)), 2048)
+        self.assertLess(len(json.dumps(refs)) * 100, len(json.dumps(overpass_data)))
+        self.assertEqual(load_overpass_refs(refs), overpass_data)
+
+        # An evicted batch makes the scheduling stage fetch the POIs again
+        tiered_cache.delete(refs["batches"][0][1])
+        self.assertIsNone(load_overpass_refs(refs))
+
+    def test_long_routes_are_fetched_in_a_bounded_number_of_sections(self):
+        # About 2,800 miles: 4 sections by default, 2 when at most 2 are allowed
+        geometry = [[-120 + i * 0.5, 35.0] for i in range(101)]
+        self.assertEqual(len(get_route_bboxes(geometry)), 4)
+        with override_settings(OVERPASS_MAX_ROUTE_SECTIONS=2):
+            bboxes = get_route_bboxes(geometry)
+        self.assertEqual(len(bboxes), 2)
+        self.assertEqual((bboxes[0][1], bboxes[-1][3]), (-120, -70))
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "redis://localhost:6379/0"}},
+    LOCAL_CACHE_INVALIDATION_CHANNEL="cache-invalidations",
+    LOCAL_CACHE_SUBSCRIBE_RETRY_SECONDS=30,
+)
+class TieredCacheTests(SimpleTestCase):
+    def test_failed_subscription_is_retried_after_a_backoff(self):
+        tiered = TieredCache(cache, LocalLRUCache(max_entries=8, max_bytes=1024, timeout=60))
+        with mock.patch("redis.Redis.from_url", side_effect=ConnectionError("down")) as from_url, \
+                mock.patch("api.helpers.tiered_cache.time.monotonic", return_value=1000.0) as monotonic:
+            for _ in range(5):
+                self.assertIsNone(tiered.get("missing"))
+            self.assertEqual(from_url.call_count, 1)
+
+            monotonic.return_value = 1031.0
+            tiered.get("missing")
+            self.assertEqual(from_url.call_count, 2)
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    SINGLE_FLIGHT_POLL_INTERVAL=0.01,
+)
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_waiters_take_the_stale_value_the_leader_returned(self):
+        started, finish = threading.Event(), threading.Event()
+        results = []
+
+        def leader_fetch():
+            started.set()
+            finish.wait(5)
+            return "stale"  # a fallback the leader does not cache
+
+        leader = threading.Thread(target=lambda: results.append(
+            single_flight("route", leader_fetch, lambda: None, lease=30, wait=30)
+        ))
+        leader.start()
+        started.wait(5)
+
+        def read_cache():
+            finish.set()
+            leader.join()
+            return None
+
+        waiter_fetch = mock.Mock(return_value="fresh")
+        self.assertEqual(single_flight("route", waiter_fetch, read_cache, lease=30, wait=30), "stale")
+        self.assertEqual(results, ["stale"])
+        waiter_fetch.assert_not_called()
+
+    def test_waiters_fetch_themselves_after_the_upstream_wait(self):
+        acquire_lease("single-flight:route", 30)
+        fetch = mock.Mock(return_value="fresh")
+        started = datetime.now()
+        self.assertEqual(single_flight("route", fetch, lambda: None, lease=30, wait=0.05), "fresh")
+        self.assertLess(datetime.now() - started, timedelta(seconds=1))
+        fetch.assert_called_once()
+
+
+class WhatIfVariantTests(SimpleTestCase):
+    def test_grid_and_explicit_variants_are_expanded_in_order(self):
+        variants = expand_variants({"break_timing": [6, 8], "scaling_interval": [500, 1000]}, [{"current_cycle_hours": 20}])
+
+        self.assertEqual(variants[0], {"current_cycle_hours": 20})
+        self.assertEqual(variants[1:], [
+            {"break_timing": 6, "scaling_interval": 500},
+            {"break_timing": 6, "scaling_interval": 1000},
+            {"break_timing": 8, "scaling_interval": 500},
+            {"break_timing": 8, "scaling_interval": 1000},
+        ])
+
+    @override_settings(WHAT_IF_MAX_VARIANTS=4)
+    def test_invalid_variants_are_rejected(self):
+        for grid, variants in [
+            (None, None),
+            ({"break_timing": []}, None),
+            ({"break_timing": 6}, None),
+            (None, [{"speed": 55}]),
+            (None, [{"break_timing": "6"}]),
+            (None, [{"break_timing": True}]),
+            (None, [{"current_cycle_hours": -1}]),
+            (None, [{"current_cycle_hours": 71}]),
+            (None, [{"scaling_interval": 0}]),
+            (None, [{"scaling_interval": 0.05}]),
+            (None, [{"break_timing": 0.1}]),
+            (None, [{"break_timing": 9}]),
+            (None, [{"fueling_duration": 1e9}]),
+            ({"break_timing": [1, 2, 3, 4, 5]}, None),
+        ]:
+            with self.subTest(grid=grid, variants=variants), self.assertRaises(ValueError):
+                expand_variants(grid, variants)
+
+    def test_schedules_stop_at_the_stop_limit(self):
+        geometry = [[-100 + i * 0.05, 35.0] for i in range(201)]
+        overpass_data = {"fuel_stations": [], "rest_stops": [], "trailer_changes": [], "inspection_stops": []}
+        location = as_location({"latitude": 35.0, "longitude": -100.0})
+        route = index_route(geometry, location, location, overpass_data)
+
+        with mock.patch("api.helpers.hos_scheduler.MAX_STOPS", 20), self.assertRaisesMessage(ValueError, "20 stops"):
+            compare_schedules(route, 900.0, location, location, location, [{"scaling_interval": 50}])
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class WhatIfViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("what-if-driver", "password")
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        geometry = [[-100 + i * 0.05, 35.0] for i in range(201)]
+        route = {"distance": 900.0, "duration": 36000.0, "geometry": geometry}
+        overpass_data = {"fuel_stations": [], "rest_stops": [], "trailer_changes": [], "inspection_stops": [], "status": overpass.POI_OK}
+        self.enterContext(mock.patch("api.views.fetch_route", return_value=route))
+        self.enterContext(mock.patch("api.views.get_overpass_data_sync", return_value=overpass_data))
+
+    def compare(self, **data):
+        return self.client.post("/api/plan-trip/what-if/", {
+            "current_location": {"latitude": 35.0, "longitude": -100.0},
+            "pickup_location": {"latitude": 35.0, "longitude": -100.0},
+            "dropoff_location": {"latitude": 35.0, "longitude": -90.0},
+            "start_time": "2025-03-14T08:00:00+00:00",
+            **data,
+        }, format="json")
+
+    @override_settings(WHAT_IF_WORKERS=1)
+    def test_variants_are_compared_in_request_order(self):
+        response = self.compare(grid={"current_cycle_hours": [0, 60]})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["poi_status"], overpass.POI_OK)
+        rows = response.data["variants"]
+        self.assertEqual([row["parameters"]["current_cycle_hours"] for row in rows], [0, 60])
+        # Starting near the 70-hour limit forces a restart, so the trip ends later
+        self.assertLess(rows[0]["arrival_time"], rows[1]["arrival_time"])
+
+    def test_invalid_variants_are_rejected(self):
+        response = self.compare(variants=[{"speed": 55}])
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(WHAT_IF_TIMEOUT=0.1)
+    def test_stuck_comparisons_time_out(self):
+        executor = mock.Mock(submit=mock.Mock(side_effect=lambda *args: Future()))
+        with mock.patch("api.helpers.what_if.get_executor", return_value=executor), \
+                mock.patch("api.helpers.what_if.get_pool_size", return_value=2), \
+                mock.patch("api.helpers.what_if.reset_executor") as reset_executor:
+            response = self.compare(grid={"current_cycle_hours": [0, 60]})
+
+        self.assertEqual(response.status_code, 504)
+        reset_executor.assert_called_once_with(executor)
+
+    @override_settings(WHAT_IF_TIMEOUT=0.1)
+    def test_a_single_variant_runs_under_the_deadline(self):
+        executor = mock.Mock(submit=mock.Mock(side_effect=lambda *args: Future()))
+        with mock.patch("api.helpers.what_if.get_executor", return_value=executor), \
+                mock.patch("api.helpers.what_if.get_pool_size", return_value=1), \
+                mock.patch("api.helpers.what_if.reset_executor"):
+            response = self.compare(variants=[{"current_cycle_hours": 0}])
+
+        self.assertEqual(response.status_code, 504)
+
+    def test_schedules_past_the_stop_limit_are_rejected(self):
+        def compare_schedules(*args):
+            # What the pool sends back when the scheduler gives up
+            future = Future()
+            future.set_exception(ValueError("The schedule exceeds 5000 stops"))
+            return future
+
+        executor = mock.Mock(submit=mock.Mock(side_effect=compare_schedules))
+        with mock.patch("api.helpers.what_if.get_executor", return_value=executor):
+            response = self.compare(variants=[{"current_cycle_hours": 0}])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("5000 stops", response.data["error"])
+
+
+class PlaceIndexTests(SimpleTestCase):
+    def setUp(self):
+        places = [
+            ("Dallas", "TX", 1_300_000), ("Dallas", "GA", 14_000), ("Austin", "TX", 960_000),
+            ("Austin", "MN", 25_000), ("Austin", "NV", 200), ("Portland", "OR", 650_000), ("Portland", "ME", 68_000),
+        ]
+        self.index = PlaceIndex(
+            GazetteerPlace(normalize_place_name(name), name, state, 0.0, 0.0, population)
+            for name, state, population in places
+        )
+
+    def search(self, query):
+        return [(place.name, place.state) for place in self.index.search(query)]
+
+    def test_state_can_be_given_by_code_or_name(self):
+        self.assertEqual(self.search("Dallas, Texas"), [("Dallas", "TX")])
+        self.assertEqual(self.search("Dallas, TX"), [("Dallas", "TX")])
+        self.assertEqual(self.search("Dallas, georgia"), [("Dallas", "GA")])
+        self.assertEqual(self.search("Portland, Maine"), [("Portland", "ME")])
+        self.assertEqual(self.search("Austin, Minn"), [("Austin", "MN")])
+
+    def test_partial_states_match_state_names_not_codes(self):
+        # As codes these would match NE, MI and nothing at all
+        self.assertEqual(self.search("Austin, Ne"), [("Austin", "NV")])
+        self.assertEqual(self.search("Austin, Mi"), [("Austin", "MN")])
+        self.assertEqual(self.search("Dallas, Tex"), [("Dallas", "TX")])
+        self.assertEqual(self.search("Dallas, Ohio"), [])
+
+
+class PlaceSearchTests(TestCase):
+    def setUp(self):
+        self.enterContext(mock.patch.object(gazetteer, "_index", None))
+
+    def test_places_loaded_after_an_empty_lookup_are_found(self):
+        self.assertEqual(search_places("Dallas"), [])
+        Place.objects.create(name="Dallas", state="TX", latitude=32.8, longitude=-96.8, population=1_300_000)
+        self.assertEqual(search_places("Dallas"), [{"name": "Dallas, TX", "latitude": 32.8, "longitude": -96.8}])
+
+
+class ORJSONRendererTests(TestCase):
+    def test_output_matches_the_stdlib_renderer(self):
+        user = User.objects.create_user("json-driver", "password")
+        location = {"name": "Austin, TX", "latitude": 30.27, "longitude": -97.74}
+        trip = Trip.objects.create(
+            user=user, current_location=location, pickup_location=location, dropoff_location=location,
+            current_cycle_hours=12.5, log_sheets=["c2hlZXQ="],
+            route_data={"distance_miles": 1154.2, "geometry": [[-97.74, 30.27]], "stops": [{"location": "Caf\u00e9", "time": 0.1}]},
+        )
+        payload = {
+            "trips": TripSerializer([trip], many=True).data,
+            "checked_at": timezone.make_aware(datetime(2025, 3, 14, 12, 0, 0, 123456)),
+            "day": datetime(2025, 3, 14).date(),
+            "by_day": {1: "c2hlZXQ="},
+        }
+
+        self.assertEqual(ORJSONRenderer().render(payload), JSONRenderer().render(payload))
+
+
+class CompressionMiddlewareTests(SimpleTestCase):
+    def compress(self, content_type, csrf_cookie=False):
+        request = RequestFactory().get("/", HTTP_ACCEPT_ENCODING="gzip, br")
+        if csrf_cookie:
+            get_token(request)
+        response = HttpResponse(b"x" * 4096, content_type=content_type)
+        return CompressionMiddleware(lambda request: response)(request)
+
+    def test_json_and_svg_are_compressed(self):
+        self.assertIn(self.compress("application/json").get("Content-Encoding"), ("br", "gzip"))
+        self.assertIn(self.compress("image/svg+xml").get("Content-Encoding"), ("br", "gzip"))
+
+    def test_html_is_not_compressed(self):
+        self.assertFalse(self.compress("text/html; charset=utf-8").has_header("Content-Encoding"))
+
+    def test_responses_with_a_csrf_token_are_not_compressed(self):
+        self.assertFalse(self.compress("application/json", csrf_cookie=True).has_header("Content-Encoding"))
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    BLANK_LOG_TEMPLATE_PATH=str(settings.BASE_DIR / "blank-paper-log.png"),
+)
+class RerenderLogSheetsTests(TransactionTestCase):
+    # The command closes database connections before forking its workers
+
+    def setUp(self):
+        user = User.objects.create_user("rerender-driver", "password")
+        location = {"name": "Austin", "latitude": 30.27, "longitude": -97.74}
+        stop = {
+            "location": "Start", "activity": "Pre-trip & TI", "duty_status": "on_duty_not_driving",
+            "duration": 0.5, "time": 6.0, "day": 1, "lat": 30.27, "lon": -97.74, "miles_traveled": 0,
+        }
+        self.trips = [
+            Trip.objects.create(
+                user=user, current_location=location, pickup_location=location, dropoff_location=location,
+                current_cycle_hours=0, route_data={"stops": [stop], "total_days": 1}, log_sheets=["b2xk"],
+            )
+            for _ in range(3)
+        ]
+        checkpoint = tempfile.TemporaryDirectory()
+        self.addCleanup(checkpoint.cleanup)
+        self.checkpoint = f"{checkpoint.name}/rerender.checkpoint"
+
+    def rerender(self, *args):
+        call_command("rerender_log_sheets", "--workers", "1", "--batch-size", "2", *args, stdout=io.StringIO(), stderr=io.StringIO())
+        return {trip.id: trip for trip in Trip.objects.all()}
+
+    @override_settings(ELD_LAZY_RENDERING=False)
+    def test_sheets_are_rerendered(self):
+        trips = self.rerender()
+
+        for trip in self.trips:
+            self.assertNotEqual(trips[trip.id].log_sheets, ["b2xk"])
+            self.assertEqual(len(trips[trip.id].log_sheets), 1)
+            self.assertGreater(trips[trip.id].updated_at, trip.updated_at)
+
+    @override_settings(ELD_LAZY_RENDERING=True)
+    def test_lazy_mode_only_invalidates_cached_sheets(self):
+        trips = self.rerender()
+
+        for trip in self.trips:
+            # Stored sheets are kept; the newer updated_at changes the sheet cache keys and ETags
+            self.assertEqual(trips[trip.id].log_sheets, ["b2xk"])
+            self.assertGreater(trips[trip.id].updated_at, trip.updated_at)
+
+    @override_settings(ELD_LAZY_RENDERING=True)
+    def test_rerun_resumes_after_the_checkpoint(self):
+        with open(self.checkpoint, "w") as f:
+            f.write(str(self.trips[1].id))
+
+        trips = self.rerender("--checkpoint", self.checkpoint)
+
+        self.assertEqual(trips[self.trips[0].id].updated_at, self.trips[0].updated_at)
+        self.assertEqual(trips[self.trips[1].id].updated_at, self.trips[1].updated_at)
+        self.assertGreater(trips[self.trips[2].id].updated_at, self.trips[2].updated_at)
+        with open(self.checkpoint) as f:
+            self.assertEqual(f.read(), str(self.trips[2].id))
+
+    @override_settings(ELD_LAZY_RENDERING=False)
+    def test_trips_replanned_during_the_run_keep_their_new_sheets(self):
+        batch = list(Trip.objects.select_related("user").order_by("id"))
+        # Re-planned after the command read the batch
+        Trip.objects.filter(id=batch[0].id).update(log_sheets=["bmV3"], updated_at=timezone.now())
+        pool = SimpleNamespace(map=lambda function, jobs, chunksize: [function(job) for job in jobs])
+
+        command = RerenderLogSheetsCommand(stdout=io.StringIO(), stderr=io.StringIO())
+        counts = command.process_batch(pool, batch, {"workers": 1, "checkpoint": None})
+
+        self.assertEqual(counts["done"], 2)
+        self.assertEqual(counts["skipped"], 1)
+        self.assertEqual(Trip.objects.get(id=batch[0].id).log_sheets, ["bmV3"])
@@ -1,15 +1,27 @@
+from django.conf import settings
 from django.urls import path
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
-from .views import UserProfileView, TripHistoryView, TripPlannerView, LocationView, RouteDataView
+from .views import UserProfileView, TripHistoryView, TripDetailView, TripPlannerView, LocationView, RouteDataView, LogSheetView, LogSheetPdfView, CacheStatsView, WhatIfView
+
+if settings.ASYNC_VIEWS:
+    from .async_views import AsyncTripPlannerView, AsyncLocationView, AsyncRouteDataView
+    trip_planner_view, location_view, route_data_view = AsyncTripPlannerView, AsyncLocationView, AsyncRouteDataView
+else:
+    trip_planner_view, location_view, route_data_view = TripPlannerView, LocationView, RouteDataView
 
 urlpatterns = [
     path("login/", TokenObtainPairView.as_view(), name="token_obtain_pair"),
     path("token/refresh/", TokenRefreshView.as_view(), name="token_refresh"),
     path("profile/", UserProfileView.as_view(), name="profile"),
     path("trip-history/", TripHistoryView.as_view(), name="trip_history"),
-    path("plan-trip/", TripPlannerView.as_view(), name="plan_trip"),
-    path('locations/', LocationView.as_view(), name='location'),
-    path('create-route-data/', RouteDataView.as_view(), name='create_route_data'),
+    path("trips/<int:trip_id>/", TripDetailView.as_view(), name="trip_detail"),
+    path("plan-trip/", trip_planner_view.as_view(), name="plan_trip"),
+    path("plan-trip/what-if/", WhatIfView.as_view(), name="plan_trip_what_if"),
+    path('locations/', location_view.as_view(), name='location'),
+    path('create-route-data/', route_data_view.as_view(), name='create_route_data'),
+    path('log-sheet/<int:trip_id>/<int:day>/', LogSheetView.as_view(), name='log_sheet'),
+    path('log-sheet/<int:trip_id>/pdf/', LogSheetPdfView.as_view(), name='log_sheet_pdf'),
+    path('cache-stats/', CacheStatsView.as_view(), name='cache_stats'),
 
 ]
 
@@ -2,17 +2,32 @@ from django.conf import settings
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.authtoken.models import Token
-from api.tasks import calculate_trip
-from api.helpers.trip_planner import calculate_trip as calculate_trip_data
+from api.tasks import generate_profile_thumbnails, start_trip_pipeline
+from api.helpers.idempotency import acquire_trip_lock, get_idempotency_key, get_request_fingerprint, release_trip_lock, replayed_trip_response
+from api.helpers.trip_planner import as_location, build_trip_data, calculate_trip as calculate_trip_data, get_overpass_data_sync, index_route, render_eld_log
+from api.helpers.what_if import compare_plans, expand_variants
+from api.helpers.gazetteer import search_places
+from api.helpers.overpass import POI_OK
+from api.helpers.log_sheet_vector import render_eld_log_svg, render_eld_logs_pdf
+from api.helpers.routing import fetch_route
+from api.helpers.tiered_cache import tiered_cache
+from api.helpers.trip_archive import get_archived_trips, get_user_trip, restore_archived_trips
+from api.helpers.profile_pictures import delete_profile_picture_files, read_uploaded_picture
 from .models import Trip
 from django.contrib.auth import authenticate
+from django.db import IntegrityError, transaction
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.http import parse_etags
 from .serializers import UserSerializer, TripSerializer
+from datetime import datetime, time, timedelta
+from hashlib import md5
 import requests
 import base64
-import io
-from PIL import Image
 import logging
 from rest_framework.throttling import AnonRateThrottle
 
@@ -30,7 +45,7 @@ class LoginView(APIView):
             token, created = Token.objects.get_or_create(user=user)
             return Response({
                 "token": token.key,
-                "user": UserSerializer(user).data
+                "user": UserSerializer(user, context={"request": request}).data
             })
         return Response({"error": "Invalid credentials"}, status=status.HTTP_401_UNAUTHORIZED)
     
@@ -39,54 +54,91 @@ class UserProfileView(APIView):
 
     def get(self, request):
         user = request.user
-        serializer = UserSerializer(user)
+        serializer = UserSerializer(user, context={"request": request})
         return Response(serializer.data)
 
     def put(self, request):
         user = request.user
         data = request.data.copy()
+        upload = request.FILES.get('profile_picture') or data.get('profile_picture')
+        data.pop('profile_picture', None)
 
-        # Handle profile picture if a file is uploaded
-        if 'profile_picture' in request.FILES:
-            file = request.FILES['profile_picture']
+        serializer = UserSerializer(user, data=data, partial=True, context={"request": request})
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        # Store the picture as a file; thumbnails are rendered by a background task
+        if upload:
             try:
-                
-                img = Image.open(file)
-                img.verify()  
-                img = Image.open(file)
-
-                # Convert the image to Base64
-                buffered = io.BytesIO()
-                img.save(buffered, format=img.format if img.format else "PNG")
-                img_base64 = base64.b64encode(buffered.getvalue()).decode("utf-8")
-
-                # Add the data URI prefix
-                mime_type = f"image/{img.format.lower() if img.format else 'png'}"
-                data['profile_picture'] = f"data:{mime_type};base64,{img_base64}"
-            except Exception as e:
-                return Response({"profile_picture": f"Invalid image file: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+                picture = read_uploaded_picture(upload)
+            except ValueError as e:
+                return Response({"profile_picture": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+            old_picture, old_thumbnails = user.profile_picture.name, user.profile_thumbnails
+            user.profile_picture.save(f"{user.id}.{picture.name.split('.')[-1]}", picture, save=False)
+            user.profile_thumbnails = {}
+            picture_name = user.profile_picture.name
 
-        serializer = UserSerializer(user, data=data, partial=True)
-        if serializer.is_valid():
+        # Only drop the old files and render thumbnails once the new picture is committed
+        with transaction.atomic():
             serializer.save()
-            return Response(serializer.data)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            if upload:
+                transaction.on_commit(lambda: delete_profile_picture_files(old_picture, old_thumbnails))
+                transaction.on_commit(lambda: generate_profile_thumbnails.delay(user.id, picture_name))
+        return Response(serializer.data)
 
 class TripHistoryView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
         day = request.query_params.get("day")
-        trips = Trip.objects.filter(user=request.user).order_by('-created_at')
+        # Only what the ETag needs; route data and log sheets are loaded after the 304 check
+        trips = Trip.objects.filter(user=request.user).order_by('-created_at').only("id", "created_at", "updated_at")
+        start = end = None
         if day:
-            trips = trips.filter(created_at__date=day)
-        serializer = TripSerializer(trips, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+            try:
+                day = parse_date(day)
+            except ValueError:
+                day = None
+            if day is None:
+                return Response({"error": "day must be a date (YYYY-MM-DD)"}, status=status.HTTP_400_BAD_REQUEST)
+            # A range on created_at can use the (user, created_at) index; created_at__date cannot
+            start = timezone.make_aware(datetime.combine(day, time.min))
+            end = start + timedelta(days=1)
+            trips = trips.filter(created_at__gte=start, created_at__lt=end)
+
+        # Trips past the retention window live in the archive; their columns are enough
+        # to list and version them, payloads are only decompressed for a full response
+        archived = get_archived_trips(request.user, start, end)
+        listing = sorted([*trips, *archived], key=lambda trip: trip.created_at, reverse=True) if archived else list(trips)
+
+        # The listing changes whenever a trip in it is added, removed or re-planned
+        versions = "|".join(trip_version(trip) for trip in listing)
+        etag = f'"history-{md5(versions.encode()).hexdigest()}"'
+
+        def render_history():
+            history = trips.defer(None)
+            if archived:
+                history = sorted([*history, *restore_archived_trips(archived, request.user)], key=lambda trip: trip.created_at, reverse=True)
+            return Response(TripSerializer(history, many=True).data, status=status.HTTP_200_OK)
+
+        return conditional_response(request, etag, render_history)
+
+class TripDetailView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, trip_id):
+        trip = get_user_trip(trip_id, request.user)
+        if trip is None:
+            return Response("No Trip found with that ID", status=status.HTTP_404_NOT_FOUND)
+        return conditional_response(
+            request, f'"trip-{trip_version(trip)}"',
+            lambda: Response(TripSerializer(trip).data, status=status.HTTP_200_OK),
+        )
+
 
 class TripPlannerView(APIView):
     permission_classes = [IsAuthenticated]
-    ors_api_key = settings.ORS_API_KEY
-    ors_url = settings.ORS_URL
 
     def post(self, request):
         current_location = request.data.get("current_location")
@@ -94,6 +146,16 @@ class TripPlannerView(APIView):
         dropoff_location = request.data.get("dropoff_location")
         current_cycle_hours = float(request.data.get("current_cycle_hours", 0))
 
+        # A retried or double-tapped submission gets the trip the first one created
+        try:
+            idempotency_key = get_idempotency_key(request)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        fingerprint = get_request_fingerprint(request) if idempotency_key else None
+        if idempotency_key:
+            trip = Trip.objects.filter(user=request.user, idempotency_key=idempotency_key).first()
+            if trip:
+                return replayed_trip_response(trip, fingerprint)
 
         current_coords = {"latitude": current_location['latitude'], "longitude": current_location['longitude']}
         pickup_coords =  {"latitude":pickup_location['latitude'], "longitude": pickup_location['longitude'] }
@@ -106,23 +168,31 @@ class TripPlannerView(APIView):
         ]
         
 
-        headers = {"Authorization": self.ors_api_key}
-        body = {"coordinates": coords}
-        response = requests.post(self.ors_url, json=body, headers=headers)
-        route_data = response.json()
-
-        distance = route_data["features"][0]["properties"]["summary"]["distance"] / 1000
-        duration = route_data["features"][0]["properties"]["summary"]["duration"] / 3600
-        geometry = route_data["features"][0]["geometry"]["coordinates"]
-
-        trip = Trip.objects.create(
-            user=request.user,
-            current_location=current_location,
-            pickup_location=pickup_location,
-            dropoff_location=dropoff_location,
-            current_cycle_hours=current_cycle_hours,
-        )
-        calculate_trip.delay(trip.id, distance, duration, current_cycle_hours, geometry, pickup_coords, current_coords, dropoff_coords)
+        try:
+            route = fetch_route(coords)
+        except requests.exceptions.RequestException as e:
+            logger.error(f"ORS request failed: {str(e)}")
+            return Response({"error": f"Failed to fetch route from ORS: {str(e)}"}, status=500)
+
+        distance = route["distance"]
+        duration = route["duration"]
+        geometry = route["geometry"]
+
+        try:
+            with transaction.atomic():
+                trip = Trip.objects.create(
+                    user=request.user,
+                    current_location=current_location,
+                    pickup_location=pickup_location,
+                    dropoff_location=dropoff_location,
+                    current_cycle_hours=current_cycle_hours,
+                    idempotency_key=idempotency_key,
+                    idempotency_fingerprint=fingerprint,
+                )
+        except IntegrityError:
+            # A concurrent submission with the same key got there first
+            return replayed_trip_response(Trip.objects.get(user=request.user, idempotency_key=idempotency_key), fingerprint)
+        start_trip_pipeline(trip.id, distance, duration, current_cycle_hours, geometry, pickup_coords, current_coords, dropoff_coords, steps=route.get("steps"))
 
         trip = TripSerializer(trip)
 
@@ -135,6 +205,55 @@ class TripPlannerView(APIView):
     
 
 
+class WhatIfView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        """
+        Compare HOS plans for one route under a grid and/or list of parameter sets.
+
+        The route, its POIs and their projection are computed once; only the scheduler
+        runs per variant.
+        """
+        try:
+            variants = expand_variants(request.data.get("grid"), request.data.get("variants"))
+            locations = [request.data[name] for name in ("current_location", "pickup_location", "dropoff_location")]
+            current_coords, pickup_coords, dropoff_coords = [as_location(location) for location in locations]
+            coords = [[location.longitude, location.latitude] for location in (current_coords, pickup_coords, dropoff_coords)]
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            return Response({"error": f"Invalid what-if request: {e}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        start_time = request.data.get("start_time")
+        start_time = parse_datetime(start_time) if start_time else timezone.now()
+        if start_time is None:
+            return Response({"error": "start_time must be an ISO 8601 datetime"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            route = fetch_route(coords)
+        except requests.exceptions.RequestException as e:
+            logger.error(f"ORS request failed: {str(e)}")
+            return Response({"error": f"Failed to fetch route from ORS: {str(e)}"}, status=500)
+
+        geometry = route["geometry"]
+        overpass_data = get_overpass_data_sync(geometry)
+        indexed_route = index_route(geometry, pickup_coords, current_coords, overpass_data, route.get("steps"))
+        try:
+            rows = compare_plans(indexed_route, route["distance"], pickup_coords, current_coords, dropoff_coords, variants, start_time)
+        except TimeoutError:
+            logger.error(f"What-if comparison of {len(variants)} variants timed out")
+            return Response({"error": "The comparison took too long; try fewer variants"}, status=status.HTTP_504_GATEWAY_TIMEOUT)
+        except ValueError as e:
+            return Response({"error": f"Invalid what-if request: {e}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            "distance_miles": route["distance"] * 0.621371,
+            "start_time": start_time.isoformat(),
+            "poi_status": overpass_data["status"],
+            "degraded_poi_data": overpass_data["status"] != POI_OK,
+            "variants": rows,
+        })
+
+
 class RouteDataView(APIView):
     permission_classes = [IsAuthenticated]
     
@@ -143,10 +262,12 @@ class RouteDataView(APIView):
             trip_id = request.query_params.get("trip_id")
             update = request.query_params.get("update")
 
+            # Planning only needs the locations, not a previous plan
+            trips = Trip.objects.defer("route_data", "log_sheets")
             if update:
-                trip = Trip.objects.get(id=trip_id)
+                trip = trips.get(id=trip_id)
             else:
-                trip = Trip.objects.get(id=trip_id, route_data__isnull=True, log_sheets__isnull=True)
+                trip = trips.get(id=trip_id, route_data__isnull=True, log_sheets__isnull=True)
 
 
             current_location = trip.current_location
@@ -184,37 +305,36 @@ class RouteDataView(APIView):
             })
 
             logger.info("Requesting route from OpenRouteService")
-            ors_api_key = settings.ORS_API_KEY
             coords = [
                 [current_coords.longitude, current_coords.latitude],
                 [pickup_coords.longitude, pickup_coords.latitude],
                 [dropoff_coords.longitude, dropoff_coords.latitude]
             ]
 
-
-            ors_url = settings.ORS_URL
-            headers = {"Authorization": ors_api_key}
-            body = {"coordinates": coords}
             try:
-                response = requests.post(ors_url, json=body, headers=headers, timeout=10)
-                response.raise_for_status()
-                route_data = response.json()
+                route = fetch_route(coords)
                 logger.info("Successfully received route data from ORS")
             except requests.exceptions.RequestException as e:
                 logger.error(f"ORS request failed: {str(e)}")
                 return Response({"error": f"Failed to fetch route from ORS: {str(e)}"}, status=500)
 
-            distance = route_data["features"][0]["properties"]["summary"]["distance"] / 1000
-            duration = route_data["features"][0]["properties"]["summary"]["duration"] / 3600
-            geometry = route_data["features"][0]["geometry"]["coordinates"]
+            distance = route["distance"]
+            duration = route["duration"]
+            geometry = route["geometry"]
+
+            lock_token = acquire_trip_lock(trip.id)
+            if not lock_token:
+                return Response({"message": "Trip is already being planned"}, status=status.HTTP_202_ACCEPTED)
 
             logger.info("Calculating trip stops")
             try:
-                calculate_trip_data(trip_id, distance, duration, current_cycle_hours, geometry, pickup_coords, current_coords, dropoff_coords)
+                calculate_trip_data(trip_id, distance, duration, current_cycle_hours, geometry, pickup_coords, current_coords, dropoff_coords, steps=route.get("steps"))
                 logger.info("Trip stops calculated successfully")
             except Exception as e:
                 logger.error(f"calculate_trip failed: {str(e)}")
                 return Response({"error": f"Failed to calculate trip: {str(e)}"}, status=500)
+            finally:
+                release_trip_lock(trip.id, lock_token)
 
 
             response_data = {
@@ -231,6 +351,129 @@ class RouteDataView(APIView):
             return Response(f"Error Occured {str(e)}", status=status.HTTP_400_BAD_REQUEST)
 
 
+class LogSheetView(APIView):
+    permission_classes = [IsAuthenticated]
+    # output -> (content type, renderer returning the encoded sheet)
+    outputs = {
+        "png": ("image/png", render_eld_log),
+        "svg": ("image/svg+xml", lambda *args: render_eld_log_svg(*args).encode()),
+    }
+
+    def get(self, request, trip_id, day):
+        output = request.query_params.get("output", "png")
+        if output not in self.outputs:
+            return Response({"error": f"output must be one of {', '.join(self.outputs)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        trip, error = get_planned_trip(request, trip_id)
+        if error:
+            return error
+
+        total_days = get_total_days(trip)
+        if not 1 <= day <= total_days:
+            return Response({"error": f"Day must be between 1 and {total_days}"}, status=status.HTTP_404_NOT_FOUND)
+
+        content_type, renderer = self.outputs[output]
+        return log_sheet_response(
+            request, trip, f"{day}.{output}", content_type,
+            lambda: self.render(trip, day, output, renderer),
+        )
+
+    def render(self, trip, day, output, renderer):
+        # Trips rendered eagerly already carry every PNG sheet
+        if output == "png" and trip.log_sheets and len(trip.log_sheets) >= day:
+            return base64.b64decode(trip.log_sheets[day - 1])
+        return renderer(get_trip_data(trip), day, trip.created_at.date(), trip.user)
+
+
+class LogSheetPdfView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, trip_id):
+        trip, error = get_planned_trip(request, trip_id)
+        if error:
+            return error
+
+        return log_sheet_response(
+            request, trip, "pdf", "application/pdf",
+            lambda: render_eld_logs_pdf(get_trip_data(trip), trip.created_at.date(), trip.user),
+        )
+
+
+def get_planned_trip(request, trip_id):
+    """Return (trip, None) for a planned trip owned by the user, or (None, error response)."""
+    trip = get_user_trip(trip_id, request.user)
+    if trip is None:
+        return None, Response("No Trip found with that ID", status=status.HTTP_404_NOT_FOUND)
+
+    if not trip.route_data:
+        return None, Response({"error": "Trip has not been planned yet"}, status=status.HTTP_404_NOT_FOUND)
+    return trip, None
+
+
+def get_total_days(trip):
+    return trip.route_data.get("total_days") or max(len(trip.log_sheets or []), 1)
+
+
+def get_trip_data(trip):
+    return build_trip_data({
+        "stops": trip.route_data["stops"],
+        "total_days": get_total_days(trip),
+        "total_on_duty_hours": trip.route_data.get("total_on_duty_hours", 0),
+    }, trip.user)
+
+
+def trip_version(trip):
+    """Changes whenever the trip is re-planned, which bumps updated_at."""
+    return f"{trip.id}-{int(trip.updated_at.timestamp() * 1000)}"
+
+
+def etag_matches(request, etag):
+    # Weak comparison: the compression middleware sends strong ETags back as W/"..."
+    header = request.headers.get("If-None-Match")
+    if not header:
+        return False
+    return header.strip() == "*" or etag in (tag.removeprefix("W/") for tag in parse_etags(header))
+
+
+def conditional_response(request, etag, render):
+    """Answer 304 when the client already holds `etag`, otherwise the response built by `render`."""
+    response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED) if etag_matches(request, etag) else render()
+    response["ETag"] = etag
+    # Clients may keep the payload but must revalidate it before use
+    response["Cache-Control"] = "private, no-cache"
+    return response
+
+
+def log_sheet_response(request, trip, variant, content_type, render):
+    """
+    Serve a rendered log sheet with HTTP caching, rendering it on first request.
+
+    A sheet only changes when the trip is re-planned or re-rendered, which bumps
+    updated_at, so the ETag and cache key are derived from it. Sheet URLs stay the
+    same across versions, so clients revalidate instead of caching them for a while.
+    """
+    sheet_version = f"{trip.id}-{variant}-{int(trip.updated_at.timestamp() * 1000)}"
+
+    def render_sheet():
+        cache_key = f"log-sheet:{sheet_version}"
+        content = cache.get(cache_key)
+        if content is None:
+            content = render()
+            cache.set(cache_key, content, timeout=settings.LOG_SHEET_CACHE_TIMEOUT)
+            logger.info(f"Rendered {variant} log sheet for trip {trip.id}")
+        return HttpResponse(content, content_type=content_type)
+
+    return conditional_response(request, f'"{sheet_version}"', render_sheet)
+
+
+class CacheStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        """Hit/miss/eviction counters of this web process' local POI and route cache."""
+        return Response(tiered_cache.stats())
+
+
 class LocationView(APIView):
     throttle_classes = [AnonRateThrottle]
     permission_classes = [IsAuthenticated]
@@ -240,6 +483,13 @@ class LocationView(APIView):
         if not query:
             return Response({"error": "Query parameter 'q' is required"}, status=400)
 
+        if settings.LOCATION_SEARCH_MODE == "gazetteer":
+            suggestions = search_places(query)
+            if suggestions:
+                logger.info(f"Found {len(suggestions)} gazetteer suggestions for query: {query}")
+                return Response(suggestions)
+            logger.info(f"No gazetteer match for query: {query}, falling back to Nominatim")
+
         logger.info(f"Fetching autocomplete suggestions for query: {query}")
 
         nominatim_url = "https://nominatim.openstreetmap.org/search"
@@ -1,6 +1,7 @@
 # project/celery.py
 import os
 from celery import Celery
+from celery.signals import worker_init, worker_process_init, worker_process_shutdown
 
 # Set the default Django settings module
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "trip.settings")
@@ -13,6 +14,32 @@ celery_app.config_from_object("django.conf:settings", namespace="CELERY")
 # Auto-discover tasks in Django apps
 celery_app.autodiscover_tasks()
 
+@worker_init.connect
+def apply_queue_worker_options(sender, **kwargs):
+    # Size a single-queue worker from settings, so every deployment runs it the same way
+    from django.conf import settings
+
+    queues = list(sender.app.amqp.queues.consume_from or ())
+    options = settings.CELERY_QUEUE_WORKER_OPTIONS.get(queues[0]) if len(queues) == 1 else None
+    if options:
+        sender.pool_cls = options["pool"]
+        sender.concurrency = options["concurrency"]
+        sender.prefetch_multiplier = options["prefetch_multiplier"]
+
+
+@worker_process_init.connect
+def init_worker_event_loop(**kwargs):
+    # Each forked worker gets its own long-lived loop; pooled sessions are bound to it lazily
+    from api.helpers.http_session import get_event_loop
+    get_event_loop()
+
+
+@worker_process_shutdown.connect
+def close_worker_event_loop(**kwargs):
+    from api.helpers.http_session import close_event_loop
+    close_event_loop()
+
+
 @celery_app.task(bind=True)
 def debug_task(self):
     print(f"Request: {self.request!r}")
\ No newline at end of file
@@ -9,10 +9,13 @@ https://docs.djangoproject.com/en/5.1/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
+import json
+import math
 import os
 from pathlib import Path
 from dotenv import load_dotenv
 from datetime import timedelta
+from celery.schedules import crontab
 import dj_database_url
 
 load_dotenv()
@@ -60,6 +63,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     "corsheaders.middleware.CorsMiddleware",
     'django.middleware.security.SecurityMiddleware',
+    'api.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -147,6 +151,23 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Uploaded files (profile pictures and their thumbnails). The web app and the render workers,
+# which write the thumbnails, must share this storage: either a volume mounted at MEDIA_ROOT
+# on both, or an object-storage backend, e.g.
+# MEDIA_STORAGE_BACKEND=storages.backends.s3.S3Storage MEDIA_STORAGE_OPTIONS='{"bucket_name": "trip-media"}'
+MEDIA_URL = os.getenv('MEDIA_URL', 'media/')
+MEDIA_ROOT = os.getenv('MEDIA_ROOT', BASE_DIR / 'media')
+MEDIA_STORAGE_BACKEND = os.getenv("MEDIA_STORAGE_BACKEND", "django.core.files.storage.FileSystemStorage")
+STORAGES = {
+    "default": {
+        "BACKEND": MEDIA_STORAGE_BACKEND,
+        "OPTIONS": json.loads(os.getenv("MEDIA_STORAGE_OPTIONS", "{}")),
+    },
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+# Serve MEDIA_ROOT from Django when DEBUG is off (filesystem storage only; object storage serves its own URLs)
+SERVE_MEDIA = get_env_bool(os.getenv("SERVE_MEDIA", "True")) and MEDIA_STORAGE_BACKEND.endswith("FileSystemStorage")
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -160,6 +181,16 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    # orjson-backed JSON when installed, stdlib json otherwise (see api/renderers.py)
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'api.renderers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
 SIMPLE_JWT = {
@@ -176,9 +207,136 @@ CORS_ALLOW_CREDENTIALS = get_env_bool(os.getenv('CORS_ORIGIN_ALLOW_ALL'))
 ORS_URL=os.getenv('ORS_URL', "")
 ORS_API_KEY=os.getenv('ORS_API_KEY', "")
 BLANK_LOG_TEMPLATE_PATH=os.getenv("BLANK_LOG_TEMPLATE_PATH")
+# "nominatim" or "gazetteer" (local index loaded with `manage.py load_gazetteer`, Nominatim on a miss)
+LOCATION_SEARCH_MODE=os.getenv("LOCATION_SEARCH_MODE", "nominatim")
+# Persist only the stop schedule and render each day's log sheet on first request
+ELD_LAZY_RENDERING = get_env_bool(os.getenv("ELD_LAZY_RENDERING"))
+LOG_SHEET_CACHE_TIMEOUT = int(os.getenv("LOG_SHEET_CACHE_TIMEOUT", 7 * 24 * 3600))
+# Memoized routes, schedules and rendered log sheets (see api/helpers/plan_cache.py)
+PLAN_CACHE_TIMEOUT = int(os.getenv("PLAN_CACHE_TIMEOUT", 7 * 24 * 3600))
+PLAN_CACHE_MAX_ENTRY_BYTES = int(os.getenv("PLAN_CACHE_MAX_ENTRY_BYTES", 2 * 1024 * 1024))
+# Per-process LRU in front of Redis for POI and route lookups (see api/helpers/tiered_cache.py)
+LOCAL_CACHE_MAX_ENTRIES = int(os.getenv("LOCAL_CACHE_MAX_ENTRIES", 512))
+LOCAL_CACHE_MAX_BYTES = int(os.getenv("LOCAL_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+LOCAL_CACHE_TIMEOUT = int(os.getenv("LOCAL_CACHE_TIMEOUT", 300))
+LOCAL_CACHE_INVALIDATION_CHANNEL = os.getenv("LOCAL_CACHE_INVALIDATION_CHANNEL")
+# Seconds a process waits before retrying a failed invalidation subscription
+LOCAL_CACHE_SUBSCRIBE_RETRY_SECONDS = float(os.getenv("LOCAL_CACHE_SUBSCRIBE_RETRY_SECONDS", 30))
+# Outbound Overpass budget shared by all workers through Redis (see api/helpers/rate_limit.py)
+OVERPASS_RATE_LIMIT = float(os.getenv("OVERPASS_RATE_LIMIT", 1))
+OVERPASS_RATE_BURST = int(os.getenv("OVERPASS_RATE_BURST", 4))
+OVERPASS_MAX_WAIT = float(os.getenv("OVERPASS_MAX_WAIT", 30))
+# Pause after Overpass answers 429/504, doubling while it keeps doing so
+OVERPASS_BACKOFF_BASE = float(os.getenv("OVERPASS_BACKOFF_BASE", 5))
+OVERPASS_BACKOFF_MAX = float(os.getenv("OVERPASS_BACKOFF_MAX", 300))
+# Routes are fetched in sections of about 500 miles, fewer and longer ones past this count,
+# so the fetch stage has a bounded number of sequential section fetches
+OVERPASS_MAX_ROUTE_SECTIONS = int(os.getenv("OVERPASS_MAX_ROUTE_SECTIONS", 8))
+# POI batches are served as cached until the soft TTL, then served while a background task
+# refetches them until the hard TTL, then refetched on the request path
+OVERPASS_SOFT_TTL = int(os.getenv("OVERPASS_SOFT_TTL", 24 * 3600))
+OVERPASS_HARD_TTL = int(os.getenv("OVERPASS_HARD_TTL", 7 * 24 * 3600))
+OVERPASS_REFRESH_LEASE = int(os.getenv("OVERPASS_REFRESH_LEASE", 600))
+# Batches are kept this long to serve when Overpass fails
+OVERPASS_STALE_TIMEOUT = int(os.getenv("OVERPASS_STALE_TIMEOUT", 30 * 24 * 3600))
+# The prewarm job keeps the POIs of the busiest lanes of the last POI_PREWARM_DAYS cached
+POI_PREWARM_LANES = int(os.getenv("POI_PREWARM_LANES", 50))
+POI_PREWARM_DAYS = int(os.getenv("POI_PREWARM_DAYS", 14))
+# Serve plan-trip, create-route-data and locations from the async views (run under ASGI: trip.asgi)
+ASYNC_VIEWS = get_env_bool(os.getenv("ASYNC_VIEWS"))
+# Pooled aiohttp connections reused across tasks on each worker (see api/helpers/http_session.py)
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", 32))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", 8))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", 60))
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", 300))
+# Upper bound per request; thread pools (the fetch queue) cannot enforce task time limits
+HTTP_REQUEST_TIMEOUT = float(os.getenv("HTTP_REQUEST_TIMEOUT", 90))
+# Cross-worker deduplication of identical Overpass/ORS requests (see api/helpers/single_flight.py).
+# Each upstream's lease covers the leader's slowest fetch from it, and waiters wait as long as the lease.
+# An Overpass fetch can take a full rate-limit wait plus a request timeout
+OVERPASS_SINGLE_FLIGHT_LEASE = int(os.getenv("OVERPASS_SINGLE_FLIGHT_LEASE", math.ceil(OVERPASS_MAX_WAIT + HTTP_REQUEST_TIMEOUT) + 10))
+OVERPASS_SINGLE_FLIGHT_WAIT = float(os.getenv("OVERPASS_SINGLE_FLIGHT_WAIT", OVERPASS_SINGLE_FLIGHT_LEASE))
+# ORS is called from web requests, so its waiters only wait out one ORS request
+ORS_REQUEST_TIMEOUT = float(os.getenv("ORS_REQUEST_TIMEOUT", 10))
+ORS_SINGLE_FLIGHT_LEASE = int(os.getenv("ORS_SINGLE_FLIGHT_LEASE", math.ceil(ORS_REQUEST_TIMEOUT) + 5))
+ORS_SINGLE_FLIGHT_WAIT = float(os.getenv("ORS_SINGLE_FLIGHT_WAIT", ORS_SINGLE_FLIGHT_LEASE))
+SINGLE_FLIGHT_POLL_INTERVAL = float(os.getenv("SINGLE_FLIGHT_POLL_INTERVAL", 0.2))
+# How long the leader's result is kept for waiters that did not find it in the cache
+SINGLE_FLIGHT_RESULT_TIMEOUT = int(os.getenv("SINGLE_FLIGHT_RESULT_TIMEOUT", 10))
+# What-if comparisons (POST /api/plan-trip/what-if/) run their variants in a process pool per
+# web worker, so web workers x WHAT_IF_WORKERS processes can compete for the cores
+WHAT_IF_MAX_VARIANTS = int(os.getenv("WHAT_IF_MAX_VARIANTS", 32))
+WHAT_IF_WORKERS = int(os.getenv("WHAT_IF_WORKERS", 2))
+# Comparisons still running after this many seconds are answered with 504
+WHAT_IF_TIMEOUT = float(os.getenv("WHAT_IF_TIMEOUT", 30))
+# Trips older than this many days move to the compressed ArchivedTrip table (0 keeps every trip hot)
+TRIP_ARCHIVE_AFTER_DAYS = int(os.getenv("TRIP_ARCHIVE_AFTER_DAYS", 0))
+TRIP_ARCHIVE_BATCH_SIZE = int(os.getenv("TRIP_ARCHIVE_BATCH_SIZE", 500))
+TRIP_ARCHIVE_COMPRESSION_LEVEL = int(os.getenv("TRIP_ARCHIVE_COMPRESSION_LEVEL", 6))
+# Responses smaller than this are sent uncompressed (see api/middleware.py)
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", 1024))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", 5))
 CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', "redis://localhost:6379/0")
 CELERY_ACCEPT_CONTENT = ["json"]
 CELERY_TASK_SERIALIZER = "json"
+# Long planning tasks: a worker reserves one task beyond those it runs
+CELERY_WORKER_PREFETCH_MULTIPLIER = int(os.getenv("CELERY_WORKER_PREFETCH_MULTIPLIER", 1))
+# Pool, concurrency and prefetch of a worker consuming only one of these queues, applied at
+# worker start (see trip/celery.py) over the command line flags
+CELERY_QUEUE_WORKER_OPTIONS = {
+    # I/O bound: many threads, each with its own event loop and pooled HTTP session
+    "fetch": {
+        "pool": "threads",
+        "concurrency": int(os.getenv("FETCH_WORKER_CONCURRENCY", 32)),
+        "prefetch_multiplier": int(os.getenv("FETCH_WORKER_PREFETCH_MULTIPLIER", 4)),
+    },
+    # CPU bound: one process per core
+    "render": {
+        "pool": "prefork",
+        "concurrency": int(os.getenv("RENDER_WORKER_CONCURRENCY", os.cpu_count() or 1)),
+        "prefetch_multiplier": CELERY_WORKER_PREFETCH_MULTIPLIER,
+    },
+}
+# Trip planning runs as a chain: Overpass fetch (I/O bound) then scheduling and rendering (CPU bound)
+CELERY_TASK_ROUTES = {
+    "api.tasks.fetch_trip_pois": {"queue": "fetch"},
+    "api.tasks.release_trip_plan": {"queue": "fetch"},
+    "api.tasks.archive_old_trips": {"queue": "fetch"},
+    "api.tasks.refresh_overpass_pois": {"queue": "fetch"},
+    "api.tasks.prewarm_poi_cache": {"queue": "fetch"},
+    "api.tasks.schedule_trip_stops": {"queue": "render"},
+    "api.tasks.render_trip_log_sheets": {"queue": "render"},
+    "api.tasks.generate_profile_thumbnails": {"queue": "render"},
+}
+# Run with `celery -A trip beat`
+CELERY_BEAT_SCHEDULE = {
+    "archive-old-trips": {
+        "task": "api.tasks.archive_old_trips",
+        "schedule": crontab(hour=3, minute=0),
+    },
+    "prewarm-poi-cache": {
+        "task": "api.tasks.prewarm_poi_cache",
+        "schedule": crontab(hour="*/6", minute=30),
+    },
+}
+# Route sections are fetched one after another, each waiting at most OVERPASS_MAX_WAIT for the
+# rate limiter and HTTP_REQUEST_TIMEOUT for Overpass (its categories are fetched concurrently)
+FETCH_TASK_SOFT_TIME_LIMIT = int(os.getenv(
+    "FETCH_TASK_SOFT_TIME_LIMIT",
+    math.ceil(OVERPASS_MAX_ROUTE_SECTIONS * (OVERPASS_MAX_WAIT + HTTP_REQUEST_TIMEOUT)),
+))
+FETCH_TASK_TIME_LIMIT = int(os.getenv("FETCH_TASK_TIME_LIMIT", FETCH_TASK_SOFT_TIME_LIMIT + 30))
+RENDER_TASK_SOFT_TIME_LIMIT = int(os.getenv("RENDER_TASK_SOFT_TIME_LIMIT", 240))
+RENDER_TASK_TIME_LIMIT = int(os.getenv("RENDER_TASK_TIME_LIMIT", 300))
+# Pipeline tasks are acknowledged after they finish and retried on transient database/Redis errors
+TRIP_TASK_MAX_RETRIES = int(os.getenv("TRIP_TASK_MAX_RETRIES", 3))
+TRIP_TASK_RETRY_BACKOFF_MAX = int(os.getenv("TRIP_TASK_RETRY_BACKOFF_MAX", 60))
+# Lease on a trip while it is being planned, so duplicate submissions enqueue nothing. Every
+# stage renews it, so it covers the slowest stage with all its retries and their backoff
+TRIP_PLAN_LOCK_TIMEOUT = int(os.getenv(
+    "TRIP_PLAN_LOCK_TIMEOUT",
+    (TRIP_TASK_MAX_RETRIES + 1) * max(FETCH_TASK_TIME_LIMIT, RENDER_TASK_TIME_LIMIT) + TRIP_TASK_MAX_RETRIES * TRIP_TASK_RETRY_BACKOFF_MAX,
+))
 CACHES = {
     "default": {
         "BACKEND": "django.core.cache.backends.redis.RedisCache",